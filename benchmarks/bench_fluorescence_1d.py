@@ -0,0 +1,47 @@
+"""
+Benchmark of the 1D fluorescence plot: the former melt/concat + px.line
+construction against the direct NumPy trace construction.
+
+Usage:
+    python benchmarks/bench_fluorescence_1d.py [n_eems]
+"""
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+import plotly_express as px
+
+from spectradb.utils.utils import _excitation_lines_figure
+
+
+def melt_concat_figure(plot_data):
+    combined_df = pd.concat([(pd.DataFrame(data, columns=em)
+                              .assign(Excitation=ex, Identifier=name)
+                              .melt(id_vars=['Excitation', 'Identifier'],
+                                    value_name='Intensity',
+                                    var_name='Emission'))
+                             for data, em, ex, name in plot_data],
+                            ignore_index=True)
+    fig = px.line(combined_df, x="Emission", y="Intensity",
+                  line_group="Excitation", color="Identifier")
+    fig.update_traces(line=dict(width=1.5))
+    return fig
+
+
+def main(n_eems: int = 100) -> None:
+    rng = np.random.default_rng(0)
+    ex = np.arange(200, 400, 10)
+    em = np.arange(250, 600, 2)
+    plot_data = [(rng.random((len(ex), len(em)), dtype=np.float32),
+                  em, ex, f"Sample {i}") for i in range(n_eems)]
+
+    for label, func in [("melt/concat + px.line", melt_concat_figure),
+                        ("numpy traces", _excitation_lines_figure)]:
+        seconds = min(timeit.repeat(lambda: func(plot_data),
+                                    number=1, repeat=3))
+        print(f"{label:>24}: {seconds:.3f} s for {n_eems} EEMs")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,64 @@
+"""
+Import-time regression benchmark.
+
+Measures `import spectradb` in fresh interpreters (as a process pool worker
+would) and lists the slowest modules reported by `python -X importtime`.
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs N] [--max-seconds S]
+
+With `--max-seconds` the script exits with status 1 when the median import
+time exceeds the threshold, so it can gate CI.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+TIMED_IMPORT = ("import time; t = time.perf_counter(); import spectradb; "
+                "print(time.perf_counter() - t)")
+
+
+def import_times(runs: int) -> list:
+    return [float(subprocess.run([sys.executable, "-c", TIMED_IMPORT],
+                                 capture_output=True, text=True,
+                                 check=True).stdout)
+            for _ in range(runs)]
+
+
+def slowest_modules(top: int = 10) -> list:
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import spectradb"],
+                            capture_output=True, text=True,
+                            check=True).stderr
+    rows = []
+    for line in stderr.splitlines()[1:]:
+        # "import time: <self us> | <cumulative us> | <module>"
+        _, cumulative_us, name = line.split("|")
+        name = name.strip()
+        rows.append((int(cumulative_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    args = parser.parse_args()
+
+    times = import_times(args.runs)
+    median = statistics.median(times)
+    print(f"import spectradb: median {median:.3f} s, "
+          f"min {min(times):.3f} s over {args.runs} runs")
+    print("slowest modules (cumulative):")
+    for cumulative_us, name in slowest_modules():
+        print(f"  {cumulative_us / 1e6:8.3f} s  {name}")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"FAIL: median import time above {args.max_seconds} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
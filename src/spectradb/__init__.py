@@ -1,4 +1,6 @@
 from .main import Database
+from .aio import AsyncDatabase
 from . import dataloaders
+from . import preprocessing
 
-__all__ = ["Database", "dataloaders"]
+__all__ = ["Database", "AsyncDatabase", "dataloaders", "preprocessing"]
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial, wraps
+from pathlib import Path
+from typing import Optional, Union
+
+from spectradb.main import Database
+
+
+def _offloaded(name: str):
+    """Builds the async counterpart of the `Database` method `name`."""
+    method = getattr(Database, name)
+
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        return await self._run(getattr(self.database, name), *args, **kwargs)
+
+    wrapper.__doc__ = (f"Async version of `Database.{name}`, run in the "
+                       "executor of the instance.")
+    return wrapper
+
+
+class AsyncDatabase:
+    """
+    asyncio facade of `Database`.
+
+    Queries, decoding and ingestion run in a bounded thread pool so they
+    never block the event loop. At most `max_concurrency` calls of an
+    instance are in flight at a time; further calls wait their turn.
+    Cancelling a call drops it if it has not started yet and otherwise
+    interrupts its running SQLite statement (an interrupted write is
+    rolled back).
+
+    Args:
+        database: Path to the SQLite database or a `Database` instance.
+        max_workers: Number of worker threads of the executor created by
+            the instance. It is also the default number of read-only
+            connections of a `Database` created from a path.
+        max_concurrency: Maximum number of calls in flight. Defaults to
+            `max_workers`.
+        executor: Executor to use instead of a private thread pool, e.g.
+            one shared by several instances. It is not shut down on close.
+        **kwargs: Passed to `Database` when `database` is a path.
+
+    Example:
+        async with AsyncDatabase("spectra.sqlite") as db:
+            df = await db.fetch_sample_data("FL_1", col_name="sample_id")
+    """
+
+    def __init__(self,
+                 database: Union[Database, Path, str],
+                 *,
+                 max_workers: int = 4,
+                 max_concurrency: Optional[int] = None,
+                 executor: Optional[Executor] = None,
+                 **kwargs) -> None:
+        if not isinstance(database, Database):
+            kwargs.setdefault("readers", max_workers)
+            database = Database(database, **kwargs)
+        self.database = database
+
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers, thread_name_prefix="spectradb")
+        self._semaphore = asyncio.Semaphore(max_concurrency or max_workers)
+
+    async def __aenter__(self):
+        await self.open_connection()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close_connection()
+
+    async def open_connection(self) -> None:
+        """Opens the connection of the underlying `Database`."""
+        await self._run(self.database.open_connection)
+
+    async def close_connection(self) -> None:
+        """Closes the `Database` and shuts down the private executor."""
+        try:
+            await self._run(self.database.close_connection)
+        finally:
+            if self._owns_executor:
+                self._executor.shutdown(wait=False)
+
+    def _call(self, event: threading.Event, func, *args, **kwargs):
+        """Runs `func` in a worker thread under the cancel event `event`."""
+        if event.is_set():
+            raise asyncio.CancelledError()
+        self.database._cancel_event.event = event
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.database._cancel_event.event = None
+
+    def _release(self, loop: asyncio.AbstractEventLoop, _future) -> None:
+        """Done callback of a worker: frees its semaphore slot."""
+        try:
+            loop.call_soon_threadsafe(self._semaphore.release)
+        except RuntimeError:
+            # The event loop is already closed
+            pass
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        Runs `func` in the executor, bounded by the instance semaphore.
+
+        The slot is released when the worker is done, not when the caller
+        is cancelled, so interrupted calls still count until they stop.
+        """
+        await self._semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        event = threading.Event()
+        try:
+            future = self._executor.submit(
+                partial(self._call, event, func, *args, **kwargs))
+        except BaseException:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(partial(self._release, loop))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            event.set()
+            raise
+
+    fetch_instrument_data = _offloaded("fetch_instrument_data")
+    fetch_sample_data = _offloaded("fetch_sample_data")
+    get_data_by_instrument_and_sample = _offloaded(
+        "get_data_by_instrument_and_sample")
+    execute_custom_query = _offloaded("execute_custom_query")
+    fetch_matrix = _offloaded("fetch_matrix")
+    transform_data_for_analysis = _offloaded("transform_data_for_analysis")
+    return_dataloader = _offloaded("return_dataloader")
+    create_spectrum = _offloaded("create_spectrum")
+    add_sample = _offloaded("add_sample")
+    remove_sample = _offloaded("remove_sample")
+    ingest_directory = _offloaded("ingest_directory")
+    build_similarity_index = _offloaded("build_similarity_index")
+    find_similar = _offloaded("find_similar")
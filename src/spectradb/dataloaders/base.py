@@ -1,12 +1,17 @@
+from __future__ import annotations
 from pathlib import Path
 from abc import ABC, abstractmethod
-import pandas as pd
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import Dict, Optional, Union
 from datetime import datetime
 import os
 
+from spectradb.utils.lazy import lazy_import
+
+# Only imported when a DataFrame is first built
+pd = lazy_import("pandas")
+
 
 class InstrumentID(Enum):
     """
@@ -29,17 +34,25 @@ class BaseDataLoader(ABC):
 
     Attributes:
         filepath (Path): Path to the data file.
+        lazy (bool): If True, only the cheap header/metadata is read on
+            initialization and the signal block is parsed the first time
+            `data` is accessed.
         data (Dict): Dictionary to store loaded data.
         df (pd.DataFrame): DataFrame for structured data representation.
+            Cached until the data or metadata is changed through the
+            loader's methods.
         metadata (Dict): Dictionary to store metadata information.
     """
 
     filepath: Path
     _load_data_on_init: bool = True
+    lazy: bool = False
 
-    data: Dict = field(init=False, default_factory=dict)
+    _data: Dict = field(init=False, default_factory=dict)
     _df: pd.DataFrame = field(init=False, default=None)
     metadata: Dict = field(init=False, default_factory=dict)
+    _signal_loaded: bool = field(init=False, default=False)
+    _df_stale: bool = field(init=False, default=True)
 
     def __post_init__(self):
         """
@@ -54,15 +67,62 @@ class BaseDataLoader(ABC):
         self.filepath = Path(self.filepath)
         self.validate_data()
         if self._load_data_on_init:
-            self.load_data()
+            if self.lazy:
+                self._load_metadata()
+            else:
+                self.load_data()
+
+    @property
+    def data(self):
+        """
+        The signal data. In lazy mode the signal block is parsed on first
+        access.
+        """
+        if self.lazy and not self._signal_loaded:
+            self._load_signal()
+            self._signal_loaded = True
+            self._df_stale = True
+        return self._data
+
+    @data.setter
+    def data(self, value) -> None:
+        self._data = value
+        self._signal_loaded = True
+        self._df_stale = True
+
+    def load_data(self) -> None:
+        """
+        Load the metadata and the signal data from the specified file.
+        """
+        self._load_all()
+        self._signal_loaded = True
+        print(self)
+
+    def _load_all(self) -> None:
+        """
+        Read the metadata and the signal block. Loaders whose signal parser
+        also returns the header values override this to read the file
+        once.
+        """
+        self._load_metadata()
+        self._load_signal()
 
     @abstractmethod
-    def load_data(self) -> Dict:
+    def _load_metadata(self) -> None:
         """
-        Load data from the specified file.
+        Read the metadata from the file without parsing the signal block.
 
-        Returns:
-            Dict: A dictionary containing the loaded data.
+        Signal metadata that can only be derived from the signal block is
+        filled in by `_load_signal`.
+        """
+        pass
+
+    @abstractmethod
+    def _load_signal(self) -> None:
+        """
+        Parse the signal block into `_data` and complete the signal metadata.
+
+        Must not overwrite metadata changed through `add_metadata`.
         """
         pass
 
@@ -102,19 +162,26 @@ class BaseDataLoader(ABC):
         pass
 
     @property
-    @abstractmethod
     def df(self) -> pd.DataFrame:
         """
-        Property to access the df. Creates or updates if it doesn't exist.
+        Property to access the df. Creates or updates it if it doesn't exist
+        or if it has been invalidated.
 
         Returns:
             pd.DataFrame: The DataFrame representation of the data.
         """
-        pass
+        if self._df is None or self._df_stale:
+            self._create_dataframe()
+            self._df_stale = False
+        return self._df
+
+    def _invalidate_df(self) -> None:
+        """Mark the cached df as outdated."""
+        self._df_stale = True
 
     def to_csv(self, path: Union[str, Path] = None) -> None:
         path = path or Path("processed_" + self.filepath.stem + ".csv")
-        self._df.to_csv(path)
+        self.df.to_csv(path)
 
 
 def metadata_template(
@@ -1,13 +1,16 @@
-from typing import Dict
-import pandas as pd
+from __future__ import annotations
 from spectradb.dataloaders.base import (BaseDataLoader,
                                         InstrumentID,
                                         metadata_template)
+from spectradb.dataloaders.parsers import (read_spa, read_spa_header,
+                                           read_cary_eclipse_csv,
+                                           read_cary_eclipse_header)
 from dataclasses import dataclass, field
 from typing import ClassVar, Optional, List
 import numpy as np
-from io import StringIO
-import csv
+from spectradb.utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
 
 
 @dataclass(slots=True)
@@ -22,7 +25,7 @@ class FluorescenceDataLoader(BaseDataLoader):
     Attributes:
         filepath (Path): The path to the CSV file containing the data.
         data (Dict): A dictionary where keys are sample names, and values are
-            the corresponding fluorescence data
+            the corresponding fluorescence data as float32 `np.ndarray`
             - (excitation along the rows and emission along columns).
         metadata (Dict): A dictionary containing metadata about the
             fluorescence data, including signal metadata
@@ -44,82 +47,52 @@ class FluorescenceDataLoader(BaseDataLoader):
         super(FluorescenceDataLoader, self).__post_init__()
         # Check this https://docs.python.org/3/library/dataclasses.html
 
-    def load_data(self) -> Dict:
-        """
-        Load fluorescence data from the CSV file and extract sample metadata.
-        """
-        with open(self.filepath, "r") as rawfile:
-            reader = csv.reader(rawfile)
-            # Reading the header of the csv
-            header = next(reader)
-            # This part of the code is written to catch an edge case where the
-            # user inputs a name with comma, causing the read_csv to fail
-            correct_header = []
-            current_data = []
-            for data in header:
-                if data == "":
-                    if current_data:
-                        correct_header.append(",".join(current_data))
-                        current_data = []
-                    correct_header.append(data)
-                else:
-                    current_data.append(data)
-            # creating a stream because we wanna save the file in memoery
-            output = StringIO()
-            writer = csv.writer(output)
-            # writing the first row
-            writer.writerow(correct_header)
-            # The reader is at the first row of data (after the header),
-            # so we can write the remaining rows directly.
-            writer.writerows(reader)
-            # Reset the stream so that read_csv can read from the beginning
-            output.seek(0)
-
-        df = pd.read_csv(output).dropna(how="all", axis=1).dropna(how="all", axis=0)
-
-        # Getting the names of the samples that were analyzed.
-        # Preferred over `set` as it preserves order.
-        unique_samples = list(
-            dict.fromkeys(
-                [col.split("_EX_")[0].strip() for col in df.columns if "_EX_" in col]
-            )
-        )
+    def _load_metadata(self) -> None:
+        """
+        Read the sample names and excitation wavelengths from the header.
+        """
+        self._set_metadata(read_cary_eclipse_header(self.filepath))
 
-        for sample_number, sample in enumerate(unique_samples, start=1):
+    def _load_signal(self) -> None:
+        """
+        Load fluorescence data from the CSV file for the remaining samples.
+        """
+        # Single streaming pass; a sample name containing commas is
+        # repaired in the header before the numeric block is parsed.
+        self._set_signal(*read_cary_eclipse_csv(self.filepath))
+
+    def _load_all(self) -> None:
+        # The parsed samples carry the header, so the file is read once
+        emission, samples = read_cary_eclipse_csv(self.filepath)
+        self._set_metadata((sample, excitation)
+                           for sample, excitation, _ in samples)
+        self._set_signal(emission, samples)
+
+    def _set_metadata(self, header) -> None:
+        """Creates the metadata of the `(sample, excitation)` pairs."""
+        for sample_number, (sample, excitation) in enumerate(header,
+                                                             start=1):
             sample_id = f"S{sample_number}"
             self._sample_id_map[sample_id] = sample
 
-            # Extracting emission wavelengths and excitation wavelengths
-            if sample_number == 1:
-                em_wl = df.iloc[1:, 0].astype(float).astype(int).tolist()
-                idx, ex_wl = zip(
-                    *[
-                        [
-                            i + 1,
-                            wavelengths.split("_EX_")[-1].split(".")[0],
-                        ]  # noqa: E501
-                        for i, wavelengths in enumerate(df.columns)
-                        if sample + "_EX_" in wavelengths
-                    ]
-                )
-            else:
-                idx = [i + 1 for i, _ in enumerate(df.columns) if sample + "_EX_" in _]
-
             # Using metadata template function to create the metadata entry
             self.metadata[sample_id] = metadata_template(
                 filepath=self.filepath,
                 sample_name=sample,
                 signal_metadata={
-                    "Excitation": np.array(ex_wl, dtype=int).tolist(),
-                    "Emission": em_wl,
+                    "Excitation": excitation,
+                    "Emission": None,
                 },
             )
-            # Storing actual fluorescence data for each sample
-            self.data[sample_id] = (
-                df.iloc[1:, list(idx)].to_numpy(dtype=np.float32).T.tolist()
-            )
 
-        print(self)
+    def _set_signal(self, emission: np.ndarray, samples: list) -> None:
+        """Stores the parsed data of the samples that were not deleted."""
+        for sample_id in self._sample_id_map:
+            _, excitation, data = samples[int(sample_id[1:]) - 1]
+            self.metadata[sample_id]["Signal Metadata"].update(
+                Excitation=excitation, Emission=emission)
+            # Storing actual fluorescence data for each sample
+            self._data[sample_id] = data
 
     def _create_dataframe(self) -> pd.DataFrame:
         """
@@ -159,19 +132,10 @@ class FluorescenceDataLoader(BaseDataLoader):
 
         for identifier in identifiers:
             del self.metadata[identifier]
-            del self.data[identifier]
+            self._data.pop(identifier, None)
             del self._sample_id_map[identifier]
+        self._invalidate_df()
 
-<<<<<<< HEAD
-    def add_metadata(
-        self,
-        identifier: str,
-        sample_name: Optional[str] = None,
-        internal_code: Optional[str] = None,
-        collected_by: Optional[str] = None,
-        comments: Optional[str] = None,
-    ) -> None:
-=======
     def add_metadata(self,
                      *,
                      identifier: str,
@@ -179,7 +143,6 @@ class FluorescenceDataLoader(BaseDataLoader):
                      internal_code: Optional[str] = None,
                      collected_by: Optional[str] = None,
                      comments: Optional[str] = None) -> None:
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
         """
         Add or update metadata for a given sample identifier.
         """
@@ -195,6 +158,7 @@ class FluorescenceDataLoader(BaseDataLoader):
             sample_metadata["Collected by"] = collected_by
         if comments is not None:
             sample_metadata["Comments"] = comments
+        self._invalidate_df()
 
     def validate_data(self) -> None:
         """
@@ -235,10 +199,6 @@ class FluorescenceDataLoader(BaseDataLoader):
             f"spectrometer\nFile: {self.filepath.stem}\nSamples:\n{table}"
         )
 
-    @property
-    def df(self) -> pd.DataFrame:
-        return self._create_dataframe()
-
 
 @dataclass(slots=True)
 class FTIRDataLoader(BaseDataLoader):
@@ -264,38 +224,35 @@ class FTIRDataLoader(BaseDataLoader):
     def __post_init__(self):
         super(FTIRDataLoader, self).__post_init__()
 
-    def load_data(self) -> Dict:
-        with open(self.filepath, "rb") as file:  # reading in binary
-            # spectrum resolution
-            file.seek(564)
-            num_wn_points = np.fromfile(file, np.int32, 1)[0]
-
-            # fetching the max and min wavenumbers
-            file.seek(576)
-            wavenumbers_max = np.fromfile(file, np.float32, 1)[0]
-            wavenumbers_min = np.fromfile(file, np.float32, 1)[0]
-
-            # Finding the place where the intensity starts
-            file.seek(288)
-            _check = 0
-            while _check != 3:
-                _check = np.fromfile(file, np.uint16, 1)[0]
-
-            # Locate the intensity position
-            file.seek(np.fromfile(file, np.uint16, 1)[0])
-            self.data = np.fromfile(file, np.float32, num_wn_points).tolist()
-
-            self.metadata = metadata_template(
-                filepath=self.filepath,
-                signal_metadata={
-                    "Wavenumbers": np.linspace(
-                        wavenumbers_min, wavenumbers_max, num_wn_points
-                    )[::-1]
-                    .astype(int)
-                    .tolist()  # noqa: E501
-                },
-            )
-        print(self)
+    def _load_metadata(self) -> None:
+        # Only the header is needed for the wavenumber axis
+        self._set_metadata(*read_spa_header(self.filepath))
+
+    def _load_signal(self) -> None:
+        # Memory-mapped read; the intensities are a read-only copy and the
+        # map is closed before read_spa returns
+        self._data, _, _ = read_spa(self.filepath)
+
+    def _load_all(self) -> None:
+        # read_spa returns the header values, so the file is opened once
+        self._data, wavenumbers_min, wavenumbers_max = read_spa(
+            self.filepath)
+        self._set_metadata(len(self._data), wavenumbers_min,
+                           wavenumbers_max)
+
+    def _set_metadata(self,
+                      num_points: int,
+                      wavenumbers_min: float,
+                      wavenumbers_max: float) -> None:
+        self.metadata = metadata_template(
+            filepath=self.filepath,
+            signal_metadata={
+                "Wavenumbers": np.linspace(
+                    wavenumbers_min, wavenumbers_max, num_points
+                )[::-1]
+                .astype(int)
+            },
+        )
 
     def _create_dataframe(self) -> pd.DataFrame:
         """
@@ -318,22 +275,12 @@ class FTIRDataLoader(BaseDataLoader):
         )
         return self._df
 
-<<<<<<< HEAD
-    def add_metadata(
-        self,
-        sample_name: Optional[str] = None,
-        internal_code: Optional[str] = None,
-        collected_by: Optional[str] = None,
-        comments: Optional[str] = None,
-    ) -> None:
-=======
     def add_metadata(self,
                      *,
                      sample_name: Optional[str] = None,
                      internal_code: Optional[str] = None,
                      collected_by: Optional[str] = None,
                      comments: Optional[str] = None) -> None:
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
         """
         Add or update metadata for a given sample identifier.
         """
@@ -345,6 +292,7 @@ class FTIRDataLoader(BaseDataLoader):
             self.metadata["Collected by"] = collected_by
         if comments is not None:
             self.metadata["Comments"] = comments
+        self._invalidate_df()
 
     def validate_data(self) -> None:
         if self.filepath.suffix.lower() != ".spa":
@@ -360,10 +308,6 @@ class FTIRDataLoader(BaseDataLoader):
         return f"Data generated from FTIR spectrometer\nFile: \
             {self.filepath.stem}"
 
-    @property
-    def df(self) -> pd.DataFrame:
-        return self._create_dataframe()
-
 
 @dataclass(slots=True)
 class NIRDataLoader(BaseDataLoader):
@@ -375,14 +319,15 @@ class NIRDataLoader(BaseDataLoader):
     def __post_init__(self):
         return super(NIRDataLoader, self).__post_init__()
 
-    def load_data(self) -> Dict:
+    def _load_metadata(self) -> None:
+        # The ppm axis is part of the signal block
+        self.metadata = metadata_template(filepath=self.filepath)
+
+    def _load_signal(self) -> None:
         data = np.loadtxt(self.filepath, skiprows=1, delimiter=",")
-        self.data = data[:, 1].astype(np.float32).tolist()
-        self.metadata = metadata_template(
-            filepath=self.filepath,
-            signal_metadata={"ppm": data[:, -1].astype(np.float32).tolist()},
-        )
-        print(self)
+        self._data = data[:, 1].astype(np.float32)
+        self.metadata["Signal Metadata"] = {
+            "ppm": data[:, -1].astype(np.float32)}
 
     def _create_dataframe(self) -> pd.DataFrame:
         """
@@ -424,6 +369,7 @@ class NIRDataLoader(BaseDataLoader):
             self.metadata["Collected by"] = collected_by
         if comments is not None:
             self.metadata["Comments"] = comments
+        self._invalidate_df()
 
     def validate_data(self) -> None:
         if self.filepath.suffix.lower() != ".txt":
@@ -439,10 +385,6 @@ class NIRDataLoader(BaseDataLoader):
         return f"Data generated from Bruker NMR (in .txt format)\
               \nFile: {self.filepath.stem}"
 
-    @property
-    def df(self) -> pd.DataFrame:
-        return self._create_dataframe()
-
 
 @dataclass(slots=True)
 class NMRDataLoader(BaseDataLoader):
@@ -470,14 +412,15 @@ class NMRDataLoader(BaseDataLoader):
     def __post_init__(self):
         super(NMRDataLoader, self).__post_init__()
 
-    def load_data(self) -> Dict:
+    def _load_metadata(self) -> None:
+        # The ppm axis is part of the signal block
+        self.metadata = metadata_template(filepath=self.filepath)
+
+    def _load_signal(self) -> None:
         data = np.loadtxt(self.filepath, skiprows=1, delimiter=",")
-        self.data = data[:, 1].astype(np.float32).tolist()
-        self.metadata = metadata_template(
-            filepath=self.filepath,
-            signal_metadata={"ppm": data[:, -1].astype(np.float32).tolist()},
-        )
-        print(self)
+        self._data = data[:, 1].astype(np.float32)
+        self.metadata["Signal Metadata"] = {
+            "ppm": data[:, -1].astype(np.float32)}
 
     def _create_dataframe(self) -> pd.DataFrame:
         """
@@ -517,6 +460,7 @@ class NMRDataLoader(BaseDataLoader):
             self.metadata["Collected by"] = collected_by
         if comments is not None:
             self.metadata["Comments"] = comments
+        self._invalidate_df()
 
     def validate_data(self) -> None:
         if self.filepath.suffix.lower() != ".txt":
@@ -531,7 +475,3 @@ class NMRDataLoader(BaseDataLoader):
         """
         return f"Data generated from Bruker NMR (in .txt format)\
               \nFile: {self.filepath.stem}"
-
-    @property
-    def df(self) -> pd.DataFrame:
-        return self._create_dataframe()
@@ -0,0 +1,243 @@
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+from itertools import islice
+import csv
+import mmap
+
+import numpy as np
+
+# Offsets in the header of Thermo Fisher (OMNIC) .spa files
+_SPA_NUM_POINTS = 564
+_SPA_WAVENUMBER_RANGE = 576
+_SPA_DIRECTORY = 288
+# Key of the directory entry pointing to the intensity block
+_SPA_INTENSITY_KEY = 3
+# Number of uint16 words of the directory scanned at a time
+_SPA_SCAN_WORDS = 2048
+
+
+def read_spa_header(filepath: Union[str, Path]) -> Tuple[int, float, float]:
+    """
+    Read only the header fields of a .spa file.
+
+    Returns:
+        tuple: `(num_points, wavenumbers_min, wavenumbers_max)`
+    """
+    with open(filepath, "rb") as file:
+        file.seek(_SPA_NUM_POINTS)
+        num_points = file.read(4)
+        file.seek(_SPA_WAVENUMBER_RANGE)
+        wavenumber_range = file.read(8)
+    if len(num_points) < 4 or len(wavenumber_range) < 8:
+        raise ValueError(f"Invalid SPA file: {filepath} is too short.")
+    wavenumbers_max, wavenumbers_min = np.frombuffer(wavenumber_range,
+                                                     "<f4").tolist()
+    return (int(np.frombuffer(num_points, "<i4")[0]),
+            wavenumbers_min, wavenumbers_max)
+
+
+def read_spa(filepath: Union[str, Path]) -> Tuple[np.ndarray, float, float]:
+    """
+    Read a Thermo Fisher .spa file through a memory map.
+
+    The file is mapped once and the directory block is scanned vectorially
+    for the entry of the intensity block, which is then copied out of the
+    map into a read-only array. The map (and its file descriptor) is
+    closed before returning, so loading many files does not keep them
+    open.
+
+    Args:
+        filepath: Path to the .spa file.
+
+    Returns:
+        tuple: `(intensities, wavenumbers_min, wavenumbers_max)`
+
+    Raises:
+        ValueError: If the file is too short or has no intensity block.
+    """
+    with open(filepath, "rb") as file:
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError(f"Invalid SPA file: {filepath} is empty.")
+
+    with buffer:
+        return _read_spa_buffer(buffer, filepath)
+
+
+def _read_spa_buffer(buffer: mmap.mmap,
+                     filepath: Union[str, Path]
+                     ) -> Tuple[np.ndarray, float, float]:
+    """
+    Parse a mapped .spa file. Every array returned is a copy, so the map
+    can be closed afterwards.
+    """
+    if len(buffer) < _SPA_WAVENUMBER_RANGE + 8:
+        raise ValueError(f"Invalid SPA file: {filepath} is too short.")
+
+    num_points = int(np.frombuffer(buffer, "<i4", 1, _SPA_NUM_POINTS)[0])
+    wavenumbers_max, wavenumbers_min = np.frombuffer(
+        buffer, "<f4", 2, _SPA_WAVENUMBER_RANGE).tolist()
+
+    # The directory is a sequence of uint16 words starting at offset 288;
+    # the word following the first key equal to 3 is the intensity offset.
+    words = np.frombuffer(buffer, "<u2",
+                          (len(buffer) - _SPA_DIRECTORY) // 2,
+                          _SPA_DIRECTORY)
+    intensity_offset = None
+    for start in range(0, len(words) - 1, _SPA_SCAN_WORDS):
+        hits = np.flatnonzero(
+            words[start:start + _SPA_SCAN_WORDS] == _SPA_INTENSITY_KEY)
+        hits = hits[start + hits + 1 < len(words)]
+        if hits.size:
+            intensity_offset = int(words[start + hits[0] + 1])
+            break
+    # Views on the map must be released before it can be closed
+    del words
+
+    if (intensity_offset is None
+            or intensity_offset + 4 * num_points > len(buffer)):
+        raise ValueError(f"Invalid SPA file: no intensity block found in "
+                         f"{filepath}.")
+
+    intensities = np.frombuffer(buffer, "<f4", num_points,
+                                intensity_offset).copy()
+    intensities.setflags(write=False)
+    return intensities, wavenumbers_min, wavenumbers_max
+
+
+def _repair_header(header: List[str]) -> List[str]:
+    """
+    Join header fields that were split on commas inside sample names.
+
+    Every sample column is followed by an empty field, so consecutive
+    non-empty fields belong to the same name.
+    """
+    correct_header = []
+    current_data = []
+    for data in header:
+        if data == "":
+            if current_data:
+                correct_header.append(",".join(current_data))
+                current_data = []
+            correct_header.append(data)
+        else:
+            current_data.append(data)
+    if current_data:
+        correct_header.append(",".join(current_data))
+    return correct_header
+
+
+def _numeric_lines(stream: Iterable[str]) -> Iterator[str]:
+    """
+    Yield the lines of the numeric block of a Cary Eclipse export.
+
+    Blank lines and the column label line are skipped; the block ends at
+    the first non-numeric line (e.g. the method footer).
+    """
+    started = False
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            float(line.split(",", 1)[0])
+        except ValueError:
+            if started:
+                return
+            continue
+        started = True
+        yield line
+
+
+def _header_columns(line: str) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Map every sample of a Cary Eclipse header line to its intensity columns.
+
+    The intensity column is the one following each
+    "<sample>_EX_<wavelength>" column. Returns
+    `{sample: [(column, excitation), ...]}` in file order.
+    """
+    header = _repair_header(next(csv.reader([line])))
+    columns = {}
+    for position, name in enumerate(header):
+        sample, sep, wavelength = name.rpartition("_EX_")
+        if not sep:
+            continue
+        columns.setdefault(sample.strip(), []).append(
+            (position + 1, int(wavelength.split(".")[0])))
+    return columns
+
+
+def read_cary_eclipse_header(
+        filepath: Union[str, Path]) -> List[Tuple[str, np.ndarray]]:
+    """
+    Read the sample names and excitation wavelengths of a Cary Eclipse
+    export from its first line only.
+
+    Returns:
+        list: `(sample_name, excitation)` in file order.
+    """
+    with open(filepath, "r") as rawfile:
+        columns = _header_columns(rawfile.readline())
+    return [(sample, np.array([wl for _, wl in cols], dtype=int))
+            for sample, cols in columns.items()]
+
+
+def read_cary_eclipse_csv(
+        filepath: Union[str, Path],
+        chunksize: int = 256
+) -> Tuple[np.ndarray, List[Tuple[str, np.ndarray, np.ndarray]]]:
+    """
+    Stream an Agilent Cary Eclipse EEM export in a single pass.
+
+    The header is repaired for sample names containing commas, then the
+    numeric block is parsed `chunksize` rows at a time with `np.loadtxt`.
+    Each chunk is split into per-sample float32 blocks right away, so the
+    file is never held in memory as text or as a whole-file DataFrame.
+
+    Args:
+        filepath: Path to the CSV file.
+        chunksize: Number of emission rows parsed per `np.loadtxt` call.
+
+    Returns:
+        tuple: `(emission, samples)` where `emission` holds the emission
+        wavelengths and `samples` is a list of
+        `(sample_name, excitation, data)` in file order, `data` being a
+        float32 array with excitation along the rows.
+    """
+    with open(filepath, "r") as rawfile:
+        columns = _header_columns(rawfile.readline())
+        if not columns:
+            raise ValueError(f"No excitation columns found in {filepath}.")
+
+        usecols = [0] + [col for cols in columns.values()
+                         for col, _ in cols]
+        emission_chunks = []
+        sample_chunks = {sample: [] for sample in columns}
+        lines = _numeric_lines(rawfile)
+        while True:
+            batch = list(islice(lines, chunksize))
+            if not batch:
+                break
+            block = np.loadtxt(batch, delimiter=",", usecols=usecols,
+                               ndmin=2)
+            emission_chunks.append(block[:, 0])
+            start = 1
+            for sample, cols in columns.items():
+                sample_chunks[sample].append(
+                    block[:, start:start + len(cols)].T.astype(np.float32))
+                start += len(cols)
+
+    if not emission_chunks:
+        raise ValueError(f"No data rows found in {filepath}.")
+
+    emission = np.concatenate(emission_chunks).astype(int)
+    samples = []
+    for sample, cols in columns.items():
+        chunks = sample_chunks.pop(sample)
+        data = (chunks[0] if len(chunks) == 1
+                else np.concatenate(chunks, axis=1))
+        samples.append((sample,
+                        np.array([wl for _, wl in cols], dtype=int),
+                        np.ascontiguousarray(data)))
+    return emission, samples
@@ -1,27 +1,59 @@
+from __future__ import annotations
 import sqlite3
-import json
 from spectradb.dataloaders import (FTIRDataLoader,
                                    FluorescenceDataLoader, 
                                    NMRDataLoader)
-from typing import Union, Literal, Optional, List
+from typing import (Union, Literal, Optional, List, Iterable, Iterator,
+                    Callable)
 from pathlib import Path
 from spectradb.types import DataLoaderType
-from contextlib import contextmanager
+from spectradb.dataloaders.base import BaseDataLoader
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import io
+import queue
+import threading
 from datetime import datetime, timedelta
 from dataclasses import dataclass
-import pandas as pd
 import os
 import shutil
 import numpy as np
-from itertools import product
-from spectradb.utils import spectrum, validate_dataframe
-import plotly.graph_objects as go
-
-
-def create_entries(obj):
+from itertools import product, islice, count
+from collections import OrderedDict
+from spectradb.utils import (validate_dataframe,
+                             decode_data, encode_data,
+                             decode_signal_metadata, encode_signal_metadata)
+from spectradb.utils.lazy import lazy_import
+from spectradb.utils.shards import (append_shard_rows, open_shard,
+                                    write_shard, copy_shard)
+from spectradb.utils.serialization import encode_array, decode_array
+from spectradb.utils.similarity import (SIMILARITY_METRICS, fit_pca,
+                                        similarity_vectors, top_k)
+from spectradb.preprocessing import Pipeline
+from spectradb.utils.export import (EXPORT_FORMATS, write_csv, write_npy,
+                                    write_npz, write_arrow)
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
+# pandas and the plotting stack are only imported on first use, so that
+# e.g. ingest worker processes start quickly.
+pd = lazy_import("pandas")
+
+
+def create_entries(obj,
+                   storage_format: Literal["json", "binary",
+                                           "shard"] = "json"):
     """
     Converts a data loader object into a dictionary suitable for database insertion.  # noqa: E501
+
+    The spectrum is serialized according to `storage_format`, either as
+    JSON text or as a binary float32 blob. For "shard" the `data` column is
+    left empty and the array is kept under `array` for the shard store.
     """
+    shard = storage_format == "shard"
     return {
         "instrument_id": obj.instrument_id,
         "measurement_date": obj.metadata["Measurement Date"],
@@ -44,57 +76,467 @@ def create_entries(obj):
             obj.metadata["Comments"]
             if obj.metadata["Comments"] is not None else ""
         ),
-        "data": json.dumps(obj.data),
-        "signal_metadata": json.dumps(obj.metadata["Signal Metadata"]),
+        "data": None if shard else encode_data(obj.data, storage_format),
+        **({"array": np.asarray(obj.data, dtype=np.float32)} if shard
+           else {}),
+        "signal_metadata": encode_signal_metadata(
+            obj.metadata["Signal Metadata"]),
         "date_added": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
     }
 
 
+def _flatten_loaders(
+        obj: Union[DataLoaderType, Iterable[DataLoaderType]]
+) -> Iterator[Union[DataLoaderType, "DummyClass"]]:
+    """
+    Lazily yields one object per sample from loaders or iterables of them.
+
+    A `FluorescenceDataLoader` holds several samples and is expanded into
+    one `DummyClass` per sample; other loaders are yielded unchanged.
+    """
+    if isinstance(obj, BaseDataLoader):
+        obj = [obj]
+
+    for instance in obj:
+        if isinstance(instance, FluorescenceDataLoader):
+            # I can use the dataloader with with _load_data_on_init
+            # as False. But just to simplify things,
+            # I decided to use a simple DummyClass.
+            for sample_id in instance._sample_id_map:
+                yield DummyClass(
+                    data=instance.data[sample_id],
+                    metadata=instance.metadata[sample_id],
+                    instrument_id=instance.instrument_id,
+                    filepath=instance.filepath,
+                )
+        else:
+            yield instance
+
+
+def _parse_file(filepath: Path,
+                storage_format: Literal["json", "binary", "shard"] = "json"
+                ) -> tuple[str, List[dict], Optional[str]]:
+    """
+    Parses one instrument file into database entries.
+
+    Runs inside the worker processes of `Database.ingest_directory`, so it
+    never raises: failures are returned as the third item of the tuple.
+    """
+    try:
+        loader_cls = _LOADERS_BY_SUFFIX[Path(filepath).suffix.lower()]
+        with redirect_stdout(io.StringIO()):
+            loader = loader_cls(filepath)
+        # Single-sample files carry no sample name, which would make
+        # every file of a batch collide on the uniqueness constraint.
+        if (not isinstance(loader, FluorescenceDataLoader)
+                and loader.metadata["Sample name"] is None):
+            loader.add_metadata(sample_name=Path(filepath).stem)
+        entries = [create_entries(sample, storage_format) | {
+                       "filepath": str(filepath)}
+                   for sample in _flatten_loaders(loader)]
+        return str(filepath), entries, None
+    except Exception as e:
+        return str(filepath), [], f"{type(e).__name__}: {e}"
+
+
+# Keys of the signal metadata holding the axis of each instrument type
+_SIGNAL_AXES = {
+    "NMR": "ppm",
+    "FTIR": "Wavenumbers",
+    "FL": ("Excitation", "Emission"),
+}
+
+
+# Secondary indexes of the measurements table: {name suffix: columns}
+_INDEXES = {
+    "sample_id": ("sample_id",),
+    "instrument_measurement": ("instrument_id", "measurement_id"),
+    "internal_code": ("internal_code",),
+    "measurement_date": ("measurement_date",),
+}
+
+# PRAGMAs that are per connection and may be set on read-only connections
+_READER_PRAGMAS = ("cache_size", "temp_store", "mmap_size")
+
+# PRAGMA presets of the connection profiles. page_size only takes effect
+# when the database file is created, so it is applied before the schema.
+_CONNECTION_PROFILES = {
+    # Bulk imports: large page cache, no fsync on every commit.
+    "ingest": {
+        "page_size": 16384,
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -262144,  # KiB, i.e. 256 MiB
+        "temp_store": "MEMORY",
+        "mmap_size": 0,
+    },
+    # Read-heavy work: memory-mapped reads alongside a running writer.
+    "analytics": {
+        "page_size": 16384,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -131072,  # KiB, i.e. 128 MiB
+        "temp_store": "MEMORY",
+        "mmap_size": 1 << 30,
+    },
+    # Durability first: rollback journal and fsync on every commit.
+    "safe": {
+        "page_size": 4096,
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "temp_store": "DEFAULT",
+        "mmap_size": 0,
+    },
+}
+
+
+def _print_duplicate_warning() -> None:
+    """Prints the warning shown when entries violate the uniqueness rule."""
+    print(
+        "\033[91m"  # Red color start
+        "┌───────────────────────────────────────────────┐\n"
+        "│      ❗**Duplicate Entry Detected**❗        │\n"
+        "│                                               │\n"
+        "│ The data you're trying to add already exists. │\n"
+        "│ Check the following for uniqueness:           │\n"
+        "│ • Instrument ID                               │\n"
+        "│ • Sample Name                                 │\n"
+        "│ • Internal Sample Code                        │\n"
+        "│                                               │\n"
+        "│ Please update the information and try again.  │\n"
+        "└───────────────────────────────────────────────┘\n"
+        "\033[0m"  # Reset color
+    )
+
+
+@contextmanager
+def _savepoint(cursor: sqlite3.Cursor, name: str = "chunk"):
+    """Runs the block in a savepoint, rolled back if the block raises."""
+    cursor.execute(f"SAVEPOINT {name}")
+    try:
+        yield
+    except BaseException:
+        cursor.execute(f"ROLLBACK TO {name}")
+        cursor.execute(f"RELEASE {name}")
+        raise
+    cursor.execute(f"RELEASE {name}")
+
+
+def _connection_state(connection: sqlite3.Connection) -> tuple:
+    """
+    Returns a value that changes whenever the database, as seen by
+    `connection`, is modified: `PRAGMA data_version` covers commits of
+    other connections and `total_changes` the writes of this one.
+    """
+    data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+    return connection, data_version, connection.total_changes
+
+
+def _shard_dir(database: Union[Path, str]) -> Path:
+    """Directory of the shard store of a database file."""
+    database = Path(database)
+    return database.parent / f"{database.stem}_shards"
+
+
+def _decode_projection(components: Optional[bytes]) -> np.ndarray | None:
+    """Decodes the stored PCA basis of a similarity index."""
+    return None if components is None else decode_array(components)
+
+
+def _apply_pipeline(matrix: np.ndarray,
+                    pipeline: Pipeline,
+                    fit: bool,
+                    spectrum_length: int = None) -> np.ndarray:
+    """
+    Runs a preprocessing pipeline on a matrix of flattened spectra.
+
+    With `spectrum_length` (the number of emission points of fluorescence
+    EEMs) every row is processed as a stack of spectra of that length.
+    """
+    if matrix.size == 0:
+        return matrix
+    spectra = (matrix if spectrum_length is None
+               else matrix.reshape(-1, spectrum_length))
+    spectra = (pipeline.fit_transform(spectra) if fit
+               else pipeline.transform(spectra))
+    return spectra.reshape(matrix.shape)
+
+
+def _axis_columns(axis) -> list:
+    """Column names of the analysis table for an axis from fetch_matrix."""
+    if axis is None:
+        return []
+    if isinstance(axis, tuple):
+        return [f"{ex}EX/{em}EM"
+                for ex, em in product(axis[0].tolist(), axis[1].tolist())]
+    return axis.tolist()
+
+
+_LOADERS_BY_SUFFIX = {
+    ".spa": FTIRDataLoader,
+    ".csv": FluorescenceDataLoader,
+    ".txt": NMRDataLoader,
+}
+
+
 class Database:
     """
     Spectroscopic SQLite database handler.
+
+    Args:
+        database: Path to the SQLite database file.
+        table_name: Name of the measurements table.
+        backup: Whether to periodically back up the database.
+        backup_interval: Minimum number of hours between two backups.
+        max_backups: Number of backups to keep.
+        backup_pages: Number of pages copied per step of a backup. -1 copies
+            the database in a single step.
+        backup_progress: Called as `backup_progress(status, remaining,
+            total)` after every step of a backup.
+        backup_in_background: Run periodic backups in a background thread
+            instead of blocking the commit that triggers them.
+        storage_format: How new spectra are written to the `data` column.
+            "json" stores them as text, "binary" as a little-endian float32
+            blob with a dtype/shape header. "shard" appends them to
+            memory-mapped `.npy` shards in `<database stem>_shards/`, one per
+            (instrument_id, metadata_id), and only keeps the row offset in
+            SQLite. Rows in any format are read transparently on fetch.
+        signal_metadata_cache_size: Maximum number of decoded axis
+            definitions kept in the in-process LRU cache. 0 disables it.
+        connection_profile: PRAGMA preset applied on every connection.
+            "ingest" favours bulk writes (WAL, synchronous=OFF, large page
+            cache), "analytics" favours reads (WAL, mmap, large page cache)
+            and "safe" favours durability (rollback journal,
+            synchronous=FULL). None keeps the SQLite defaults. See
+            `connection_settings` for the effective values.
+        readers: Size of the pool of read-only connections used by the
+            `fetch_*` methods. Each thread is handed its own connection
+            (threads beyond the pool size wait for one to be returned), so
+            reads run in parallel with each other and, under WAL, with
+            writes. 0 routes reads through the writer connection.
+        matrix_cache_size: Maximum number of `fetch_matrix(cache=True)`
+            results kept in memory, keyed by the arguments, the
+            preprocessing pipeline and the version of the table.
     """
 
-<<<<<<< HEAD
-    def __init__(
-        self,
-        database: Union[Path, str],
-        table_name: str = "measurements",
-        backup: bool = True,
-        backup_interval: int = True,
-        max_backups: int = 2,
-    ) -> None:
-=======
     def __init__(self,
                  database: Union[Path, str],
                  table_name: str = "measurements",
                  backup: bool = True,
                  backup_interval: int = 12,
-                 max_backups: int = 2
+                 max_backups: int = 2,
+                 backup_pages: int = 1024,
+                 backup_progress: Optional[Callable[[int, int, int],
+                                                    None]] = None,
+                 backup_in_background: bool = False,
+                 storage_format: Literal["json", "binary", "shard"] = "json",
+                 signal_metadata_cache_size: int = 128,
+                 connection_profile: Optional[
+                     Literal["ingest", "analytics", "safe"]] = None,
+                 readers: int = 0,
+                 matrix_cache_size: int = 8
                  ) -> None:
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
+        if storage_format not in ("json", "binary", "shard"):
+            raise ValueError(
+                "storage_format can only be 'json', 'binary' or 'shard'")
+        if (connection_profile is not None
+                and connection_profile not in _CONNECTION_PROFILES):
+            raise ValueError(
+                f"connection_profile can only be one of "
+                f"{list(_CONNECTION_PROFILES)} or None")
+
         self.database = database
         self.table_name = table_name
+        self.storage_format = storage_format
+        self.shard_dir = _shard_dir(database)
+        self.connection_profile = connection_profile
 
         self.backup = backup
         self.backup_dir = Path(database).parent / "database_backup"
         self.backup_interval = backup_interval
         self.max_backups = max_backups
+        self.backup_pages = backup_pages
+        self.backup_progress = backup_progress
+        self.backup_in_background = backup_in_background
         if self.backup:
             Path.mkdir(self.backup_dir, exist_ok=True)
+        self._last_backup_time = None
+        # _connection_state() of the writer at the time of the last backup
+        self._backup_state = None
+        self._backup_executor = None
+        self._backup_future = None
 
         self._connection = None
+        # All writes go through the single writer connection, one at a time
+        self._write_lock = threading.RLock()
+
+        self.readers = readers
+        self._read_pool = queue.Queue()
+        self._read_pool_lock = threading.Lock()
+        self._read_connections = []
+        self._thread_reader = threading.local()
+        # Names of the lookup tables of open `iter_samples` iterators
+        self._iter_lookup_ids = count()
+        # Event set by a caller to interrupt the queries of a thread
+        self._cancel_event = threading.local()
+
+        self.signal_metadata_cache_size = signal_metadata_cache_size
+        self._signal_metadata_cache = OrderedDict()
+        self._signal_metadata_cache_hits = 0
+        self._signal_metadata_cache_misses = 0
+        self._signal_metadata_lock = threading.RLock()
+        # (connection, data_version, fingerprint of signal_metadata) of the
+        # last check
+        self._signal_metadata_version = None
+        self.matrix_cache_size = matrix_cache_size
+        # {(fetch_matrix arguments, pipeline spec, table version): result}
+        self._matrix_cache = OrderedDict()
+        self._matrix_cache_lock = threading.Lock()
+        # {index_id: (version, measurement_ids, vectors)} of the similarity
+        # indexes loaded so far
+        self._similarity_cache = {}
 
     def __enter__(self):
-        self._connection = sqlite3.connect(self.database)
-        self.__create_table()
+        self._connect()
         return self
 
+    def _connect(self) -> None:
+        """Opens the connection and makes sure the schema exists."""
+        # Writes are serialized by `_write_lock`, so the writer connection
+        # may be shared between threads.
+        self._connection = sqlite3.connect(self.database,
+                                           check_same_thread=False)
+        self._connection.set_progress_handler(self._is_cancelled, 1000)
+        self._apply_connection_profile(self._connection)
+        # data_version is only comparable within one connection; keep the
+        # table fingerprint so a reconnect re-validates the cache.
+        if self._signal_metadata_version is not None:
+            self._signal_metadata_version = (
+                None, None, self._signal_metadata_version[2])
+        self.__create_table()
+
+    def _apply_connection_profile(self,
+                                  connection: sqlite3.Connection,
+                                  pragmas: tuple = None) -> None:
+        """
+        Applies the PRAGMAs of `connection_profile` to a connection.
+
+        Args:
+            connection: The connection to configure.
+            pragmas: Restricts the PRAGMAs applied. Defaults to all.
+        """
+        if self.connection_profile is None:
+            return
+        settings = _CONNECTION_PROFILES[self.connection_profile]
+        for pragma, value in settings.items():
+            if pragmas is not None and pragma not in pragmas:
+                continue
+            if pragma == "page_size" and connection.execute(
+                    "PRAGMA page_count").fetchone()[0]:
+                # Fixed once the file holds data (and for good under WAL).
+                continue
+            connection.execute(f"PRAGMA {pragma} = {value}")
+
+    def connection_settings(self) -> dict:
+        """
+        Returns the effective values of the PRAGMAs set by the connection
+        profiles, as reported by SQLite for the open connection.
+
+        The values may differ from the preset, e.g. `page_size` of an
+        existing database or `journal_mode` of an in-memory database.
+        """
+        if not self._connection:
+            raise RuntimeError(
+                "Database connection is not established. Use 'with' statement."
+            )  # noqa E501
+        return {pragma: self._connection.execute(
+                    f"PRAGMA {pragma}").fetchone()[0]
+                for pragma in _CONNECTION_PROFILES["safe"]}
+
+    def _is_cancelled(self) -> bool:
+        """
+        SQLite progress handler: aborts the running statement with
+        `sqlite3.OperationalError` once the cancel event of the calling
+        thread is set.
+        """
+        event = getattr(self._cancel_event, "event", None)
+        return event is not None and event.is_set()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self._connection:
-            self._connection.close()
+        self.close_connection()
 
-        self._connection = None
+    def _close_readers(self) -> None:
+        """Closes the read-only connections of the pool."""
+        with self._read_pool_lock:
+            for connection in self._read_connections:
+                connection.close()
+            self._read_connections = []
+            self._read_pool = queue.Queue()
+
+    def _checkout_reader(self) -> sqlite3.Connection:
+        """
+        Takes a read-only connection from the pool, opening a new one while
+        the pool holds fewer than `readers` connections.
+        """
+        with self._read_pool_lock:
+            pool = self._read_pool
+            try:
+                return pool.get_nowait()
+            except queue.Empty:
+                if len(self._read_connections) < self.readers:
+                    connection = self._open_reader()
+                    self._read_connections.append(connection)
+                    return connection
+        return pool.get()
+
+    def _open_reader(self) -> sqlite3.Connection:
+        """Opens a read-only connection to the database."""
+        uri = Path(self.database).resolve().as_uri() + "?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.set_progress_handler(self._is_cancelled, 1000)
+        self._apply_connection_profile(connection, _READER_PRAGMAS)
+        return connection
+
+    @contextmanager
+    def _read_cursor(self):
+        """
+        Context manager for read-only queries.
+
+        With `readers` > 0 the cursor comes from the read-only pool; the
+        calling thread keeps its connection for nested reads and returns
+        it to the pool when the outermost read ends. The outermost block
+        runs in one read transaction, so all its queries see the same
+        snapshot of the database. Otherwise reads go through `_get_cursor`.
+        """
+        if not self.readers:
+            with self._get_cursor() as cursor:
+                yield cursor
+            return
+
+        if not self._connection:
+            raise RuntimeError(
+                "Database connection is not established. Use 'with' statement."
+            )  # noqa E501
+
+        local = self._thread_reader
+        outermost = getattr(local, "connection", None) is None
+        if outermost:
+            local.connection = self._checkout_reader()
+        connection = local.connection
+        cursor = connection.cursor()
+        try:
+            if outermost:
+                cursor.execute("BEGIN")
+            yield cursor
+        finally:
+            cursor.close()
+            if outermost:
+                local.connection = None
+                if connection.in_transaction:
+                    connection.commit()
+                if connection in self._read_connections:
+                    self._read_pool.put(connection)
 
     @contextmanager
     def _get_cursor(self):
@@ -104,26 +546,13 @@ class Database:
                 "Database connection is not established. Use 'with' statement."
             )  # noqa E501
 
+        self._write_lock.acquire()
         cursor = self._connection.cursor()
         try:
             yield cursor
 
         except sqlite3.IntegrityError:
-            print(
-                "\033[91m"  # Red color start
-                "┌───────────────────────────────────────────────┐\n"
-                "│      ❗**Duplicate Entry Detected**❗        │\n"
-                "│                                               │\n"
-                "│ The data you're trying to add already exists. │\n"
-                "│ Check the following for uniqueness:           │\n"
-                "│ • Instrument ID                               │\n"
-                "│ • Sample Name                                 │\n"
-                "│ • Internal Sample Code                        │\n"
-                "│                                               │\n"
-                "│ Please update the information and try again.  │\n"
-                "└───────────────────────────────────────────────┘\n"
-                "\033[0m"  # Reset color
-            )
+            _print_duplicate_warning()
 
             self._connection.rollback()
 
@@ -132,59 +561,132 @@ class Database:
             raise e
         finally:
             cursor.close()
+            self._write_lock.release()
 
-    def _periodic_backup(self):
+    def _periodic_backup(self) -> None:
+        """
+        Backs up the database if `backup_interval` hours have passed since
+        the last backup and the database has changed since then.
+        """
         if not self.backup:
             return
 
         current_time = datetime.now()
-        latest_backup = max(
-<<<<<<< HEAD
-            self.backup_dir.glob("*.sqlite"), default=None, key=os.path.getctime
-        )
-
-        if latest_backup:
-            last_backup_time = datetime.fromtimestamp(os.path.getctime(latest_backup))
-            if (current_time - last_backup_time) < timedelta(
-                hours=self.backup_interval
-            ):  # noqa E51
+        if self._last_backup_time is None:
+            # Only looked up once; later backups are tracked in memory.
+            latest_backup = max(
+                self.backup_dir.glob(f"{Path(self.database).stem}_periodic_backup_*"),  # noqa E501
+                default=None,
+                key=os.path.getctime
+                )
+            self._last_backup_time = (
+                datetime.fromtimestamp(os.path.getctime(latest_backup))
+                if latest_backup else datetime.min)
+        if (current_time - self._last_backup_time) < timedelta(hours=self.backup_interval):  # noqa E501
+            return
+        if (self._backup_future is not None
+                and not self._backup_future.done()):
+            return
+        with self._get_cursor() as cursor:
+            if _connection_state(cursor.connection) == self._backup_state:
                 return
 
-        timestamp = current_time.strftime("%Y%m%d_%H%M%S")
-        backup_filename = (
-            f"{Path(self.database).stem}_periodic_backup_{timestamp}.sqlite"  # noqa E51
-        )
-        backup_path = self.backup_dir / backup_filename
-=======
-            self.backup_dir.glob(f"{Path(self.database).stem}_periodic_backup_*"),  # noqa E501
-            default=None,
-            key=os.path.getctime
-            )
-        if latest_backup:
-            last_backup_time = datetime.fromtimestamp(
-                os.path.getctime(latest_backup)
-            )
-            if (current_time - last_backup_time) < timedelta(hours=self.backup_interval):  # noqa E501
-                return
+        self.create_backup(background=self.backup_in_background)
+
+    def create_backup(
+            self,
+            target: Union[Path, str] = None,
+            *,
+            background: bool = False) -> Path:
+        """
+        Creates a consistent copy of the database with the SQLite backup
+        API.
 
-        timestamp = current_time.strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"{Path(self.database).stem}_periodic_backup_{timestamp}.sqlite"  # noqa E501
-        backup_path = self.backup_dir/backup_filename
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
+        Pages are copied `backup_pages` at a time and `backup_progress` is
+        called after every step. The copy is written to a temporary file
+        which is renamed on success, so an interrupted backup never leaves
+        a truncated file behind. Backups beyond `max_backups` are removed.
 
+        Args:
+            target: Path of the backup. Defaults to a timestamped file in
+                `backup_dir`.
+            background: Run the copy in a background thread, on its own
+                connection. Use `wait_for_backup` to wait for it.
+
+        Returns:
+            Path: The path of the backup.
+        """
+        if target is None:
+            Path.mkdir(self.backup_dir, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            backup_filename = f"{Path(self.database).stem}_periodic_backup_{timestamp}.sqlite"  # noqa E501
+            target = self.backup_dir/backup_filename
+        target = Path(target)
+
+        self.wait_for_backup()
+        # The backup is only recorded once the copy succeeded, so a failed
+        # one is retried by the next periodic backup.
+        started = datetime.now()
+        if not background:
+            with self._get_cursor() as cursor:
+                state = _connection_state(cursor.connection)
+                self._copy_database(self._connection, target)
+            self._backup_state, self._last_backup_time = state, started
+            return target
+
+        with self._get_cursor() as cursor:
+            state = _connection_state(cursor.connection)
+
+        def run():
+            source = sqlite3.connect(self.database)
+            try:
+                self._copy_database(source, target)
+            finally:
+                source.close()
+            self._backup_state, self._last_backup_time = state, started
+
+        if self._backup_executor is None:
+            self._backup_executor = ThreadPoolExecutor(
+                1, thread_name_prefix="spectradb-backup")
+        self._backup_future = self._backup_executor.submit(run)
+        return target
+
+    def _copy_database(self,
+                       source: sqlite3.Connection,
+                       target: Path) -> None:
+        """Copies `source` into `target` through a temporary file."""
+        partial_target = target.with_name(f".{target.name}.partial")
+        destination = sqlite3.connect(partial_target)
         try:
-            shutil.copy2(self.database, backup_path)
+            source.backup(destination,
+                          pages=self.backup_pages,
+                          progress=self.backup_progress)
+        finally:
+            destination.close()
+        os.replace(partial_target, target)
+        self._copy_shards(target)
+        if target.parent == self.backup_dir:
             self._manage_backups()
-        except Exception as e:
-            raise e
+
+    def wait_for_backup(self) -> None:
+        """
+        Waits for the running background backup, if any, and re-raises its
+        error.
+        """
+        if self._backup_future is not None:
+            future, self._backup_future = self._backup_future, None
+            future.result()
 
     def _manage_backups(self):
         backups = sorted(
-            self.backup_dir.glob(f"{Path(self.database).stem}_periodic_backup_*"),
+            (path for path in self.backup_dir.glob(
+                f"{Path(self.database).stem}_periodic_backup_*")
+             if path.is_file()),
             key=os.path.getctime,
         )
-        if len(backups) > self.max_backups:
-            os.remove(backups[0])
+        for backup in backups[:max(0, len(backups) - self.max_backups)]:
+            os.remove(backup)
+            shutil.rmtree(_shard_dir(backup), ignore_errors=True)
 
     def __create_table(self) -> None:
         """
@@ -220,8 +722,80 @@ class Database:
             UNIQUE(instrument_id, sample_name, internal_code, comments)
         );
 
+        -- Shard store: one row per (instrument_id, metadata_id) shard and
+        -- the position of every sharded measurement in its shard.
+        CREATE TABLE IF NOT EXISTS {self.table_name}_shards (
+        shard_id INTEGER PRIMARY KEY,
+        instrument_id TEXT,
+        metadata_id INTEGER,
+        row_shape TEXT,
+        n_points INTEGER,
+        n_rows INTEGER DEFAULT 0,
+        filename TEXT,
+        UNIQUE(instrument_id, metadata_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS {self.table_name}_shard_rows (
+        measurement_id INTEGER PRIMARY KEY,
+        shard_id INTEGER,
+        row INTEGER
+        );
+
+        CREATE TRIGGER IF NOT EXISTS {self.table_name}_shard_rows_cleanup
+        AFTER DELETE ON {self.table_name}
+        BEGIN
+            DELETE FROM {self.table_name}_shard_rows
+            WHERE measurement_id = OLD.measurement_id;
+        END;
+
+        -- Similarity indexes: one per (instrument_id, metadata_id) with the
+        -- optional PCA projection, and the unit vector of every indexed
+        -- measurement. `version` changes whenever the vectors do.
+        CREATE TABLE IF NOT EXISTS {self.table_name}_similarity_indexes (
+        index_id INTEGER PRIMARY KEY,
+        instrument_id TEXT,
+        metadata_id INTEGER,
+        metric TEXT,
+        n_points INTEGER,
+        n_components INTEGER,
+        components BLOB,
+        version INTEGER DEFAULT 0,
+        UNIQUE(instrument_id, metadata_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS {self.table_name}_similarity_vectors (
+        measurement_id INTEGER PRIMARY KEY,
+        index_id INTEGER,
+        vector BLOB
+        );
+
+        CREATE INDEX IF NOT EXISTS {self.table_name}_similarity_vectors_idx
+        ON {self.table_name}_similarity_vectors (index_id, measurement_id);
+
+        CREATE TRIGGER IF NOT EXISTS {self.table_name}_similarity_cleanup
+        AFTER DELETE ON {self.table_name}
+        BEGIN
+            DELETE FROM {self.table_name}_similarity_vectors
+            WHERE measurement_id = OLD.measurement_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {self.table_name}_similarity_added
+        AFTER INSERT ON {self.table_name}_similarity_vectors
+        BEGIN
+            UPDATE {self.table_name}_similarity_indexes
+            SET version = version + 1 WHERE index_id = NEW.index_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {self.table_name}_similarity_removed
+        AFTER DELETE ON {self.table_name}_similarity_vectors
+        BEGIN
+            UPDATE {self.table_name}_similarity_indexes
+            SET version = version + 1 WHERE index_id = OLD.index_id;
+        END;
+
         CREATE TRIGGER IF NOT EXISTS {trigger_name}
         AFTER INSERT ON {self.table_name}
+        WHEN NEW.sample_id IS NULL
         BEGIN
             UPDATE {self.table_name}_instrument_sample_count
             SET counter = counter + 1
@@ -235,41 +809,142 @@ class Database:
         END;
 
         """
+        # Secondary indexes are created with IF NOT EXISTS, so opening a
+        # database created by an older version upgrades it in place.
+        query += "".join(
+            f"""
+        CREATE INDEX IF NOT EXISTS {self.table_name}_{name}_idx
+        ON {self.table_name} ({', '.join(columns)});
+        """
+            for name, columns in _INDEXES.items())
         with self._get_cursor() as cursor:
+            # The trigger only serves writers that do not allocate sample
+            # ids themselves. Older databases have an unconditional trigger
+            # which would overwrite the allocated ids, so it is replaced.
+            cursor.execute(
+                "SELECT sql FROM sqlite_master "
+                "WHERE type = 'trigger' AND name = ?", (trigger_name,))
+            trigger = cursor.fetchone()
+            if trigger and "NEW.sample_id IS NULL" not in trigger[0]:
+                cursor.execute(f"DROP TRIGGER {trigger_name}")
             cursor.executescript(query)
 
+    def check_query_plans(self) -> dict:
+        """
+        Runs `EXPLAIN QUERY PLAN` on the lookups the managed indexes serve.
+
+        Returns:
+            dict: `{lookup: {"plan": <plan details>, "uses_index": bool}}`.
+            `uses_index` is False when SQLite falls back to a full table
+            scan or a temporary sort.
+        """
+        lookups = {
+            "sample_id": (f"SELECT * FROM {self.table_name} "
+                          "WHERE sample_id = ?", ("",)),
+            "instrument": (f"SELECT * FROM {self.table_name} "
+                           "WHERE instrument_id = ? "
+                           "ORDER BY measurement_id", ("",)),
+            "internal_code": (f"SELECT * FROM {self.table_name} "
+                              "WHERE internal_code = ?", ("",)),
+            "measurement_date": (f"SELECT * FROM {self.table_name} "
+                                 "WHERE measurement_date BETWEEN ? AND ?",
+                                 ("", "")),
+        }
+        plans = {}
+        with self._get_cursor() as cursor:
+            for name, (query, params) in lookups.items():
+                cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+                details = [row[-1] for row in cursor.fetchall()]
+                plans[name] = {
+                    "plan": "; ".join(details),
+                    "uses_index": not any(
+                        detail == f"SCAN {self.table_name}"
+                        or "TEMP B-TREE" in detail
+                        for detail in details),
+                }
+        return plans
+
     def add_sample(
-        self, obj: Union[DataLoaderType, List[DataLoaderType]], *, commit: bool = True
-    ) -> None:
+            self,
+            obj: Union[DataLoaderType, Iterable[DataLoaderType]],
+            *,
+            commit: bool = True,
+            chunksize: int = 500) -> None:
         """
         Adds one or more samples to the database.
 
+        The loaders are consumed lazily: multi-sample fluorescence loaders
+        are flattened on the fly and entries are serialized and written
+        `chunksize` rows at a time, so peak memory is bounded by the chunk
+        size rather than the batch size. The input is never modified.
+
         Args:
-            obj: A data loader object or iterable of data loader objects.
-            commit: Whether to commit immediately.
-        """
-
-        if isinstance(obj, (FluorescenceDataLoader, FTIRDataLoader, NMRDataLoader)):
-            obj = [obj]
-
-        for idx_obj, instance in enumerate(obj):
-            if isinstance(instance, FluorescenceDataLoader):
-                obj.pop(idx_obj)
-                for idx_sample, sample_id in enumerate(
-                    instance._sample_id_map
-                ):  # noqa: E501
-                    # I can use the dataloader with with _load_data_on_init
-                    # as False. But just to simplify things,
-                    # I decided to use a simple DummyClass.
-                    dummy = DummyClass(
-                        data=instance.data[sample_id],
-                        metadata=instance.metadata[sample_id],
-                        instrument_id=instance.instrument_id,
-                        filepath=instance.filepath,
-                    )
-                    obj.insert(idx_obj + idx_sample, dummy)
-
-        entries = list(map(create_entries, obj))
+            obj: A data loader object or any iterable (list, generator, ...)
+                of data loader objects.
+            commit: Whether to commit. Each chunk is committed as soon as
+                it has been written, so if an error interrupts the batch
+                the chunks written before it stay committed.
+            chunksize: Number of rows serialized and written at a time.
+
+        Entries that already exist (same instrument, sample name, internal
+        code and comments) are skipped with a warning; the rest of their
+        chunk and the following chunks are still written.
+        """
+        entries = (create_entries(sample, self.storage_format)
+                   for sample in _flatten_loaders(obj))
+        # Only the names are kept, so memory stays bounded by the chunk
+        skipped = []
+        with self._get_cursor() as cursor:
+            while chunk := list(islice(entries, chunksize)):
+                skipped += [entry["sample_name"] or entry["instrument_id"]
+                            for entry in self._insert_chunk(cursor, chunk)]
+                if commit:
+                    self._connection.commit()
+
+        if skipped:
+            _print_duplicate_warning()
+            print("Skipped: " + ", ".join(skipped))
+        if commit:
+            self._periodic_backup()
+
+    def _insert_chunk(self,
+                      cursor: sqlite3.Cursor,
+                      entries: List[dict]) -> List[dict]:
+        """
+        Inserts entries inside a savepoint. If they violate the uniqueness
+        constraint, the savepoint is rolled back and the entries are
+        retried one by one, so only the duplicates are left out. A
+        transaction of the caller is kept. Does not commit.
+
+        Returns:
+            list: The entries that were skipped as duplicates.
+        """
+        if not self._connection.in_transaction:
+            cursor.execute("BEGIN")
+        try:
+            with _savepoint(cursor):
+                self._insert_entries(cursor, entries)
+            return []
+        except sqlite3.IntegrityError:
+            pass
+        skipped = []
+        for entry in entries:
+            try:
+                with _savepoint(cursor):
+                    self._insert_entries(cursor, [entry])
+            except sqlite3.IntegrityError:
+                skipped.append(entry)
+        return skipped
+
+    def _insert_entries(self, cursor: sqlite3.Cursor, entries: List[dict]):
+        """
+        Inserts entries created by `create_entries` using the given cursor.
+
+        Registers the signal metadata the entries refer to and reserves a
+        block of sample ids per instrument with a single counter update, so
+        the ids are written directly by the INSERT instead of by the
+        per-row trigger. Does not commit.
+        """
         query1 = f"""
                 INSERT OR IGNORE INTO {self.table_name}_instrument_sample_count
                 (instrument_type, counter)
@@ -281,47 +956,414 @@ class Database:
                 VALUES (?)
                 """
 
+        query_reserve = f"""
+                UPDATE {self.table_name}_instrument_sample_count
+                SET counter = counter + ?
+                WHERE instrument_type = ?
+                """
+
+        query_counter = f"""
+                SELECT counter FROM {self.table_name}_instrument_sample_count
+                WHERE instrument_type = ?
+                """
+
         query3 = f"""
         INSERT INTO {self.table_name} (
-            instrument_id, measurement_date, sample_name,
+            sample_id, instrument_id, measurement_date, sample_name,
             internal_code, collected_by, comments,
             data, date_added, metadata_id
         ) VALUES (
-            :instrument_id, :measurement_date, :sample_name,
+            :sample_id, :instrument_id, :measurement_date, :sample_name,
             :internal_code, :collected_by, :comments,
             :data, :date_added,
             (SELECT metadata_id FROM signal_metadata
             WHERE metadata = :signal_metadata)
         )
         """
+        per_instrument = {}
+        for entry in entries:
+            per_instrument.setdefault(entry['instrument_id'], []).append(entry)
+
+        cursor.executemany(query1, [(instrument_id,)
+                                    for instrument_id in per_instrument])
+        for instrument_id, instrument_entries in per_instrument.items():
+            cursor.execute(query_reserve,
+                           (len(instrument_entries), instrument_id))
+            cursor.execute(query_counter, (instrument_id,))
+            first = cursor.fetchone()[0] - len(instrument_entries) + 1
+            for counter, entry in enumerate(instrument_entries, start=first):
+                entry['sample_id'] = f"{instrument_id}_{counter}"
+
+        cursor.executemany(query2, [(entry['signal_metadata'],)
+                                    for entry in entries])
+        cursor.executemany(query3, entries)
+        sharded = [entry for entry in entries if "array" in entry]
+        if sharded:
+            self._append_to_shards(cursor, sharded)
+        self._index_entries(cursor, entries)
+
+    def _index_entries(self,
+                       cursor: sqlite3.Cursor,
+                       entries: List[dict]) -> None:
+        """
+        Adds freshly inserted entries to the similarity indexes of their
+        (instrument_id, metadata_id), if any. Does not commit.
+        """
+        cursor.execute(f"""
+            SELECT instrument_id, metadata_id, index_id, metric, components
+            FROM {self.table_name}_similarity_indexes
+            """)
+        indexes = {(instrument_id, metadata_id): index
+                   for instrument_id, metadata_id, *index in cursor}
+        if not indexes:
+            return
+
+        groups = {}
+        for entry in entries:
+            groups.setdefault(
+                (entry["instrument_id"], entry["signal_metadata"]), []
+            ).append(entry)
+        for (instrument_id, signal_metadata), group in groups.items():
+            cursor.execute("SELECT metadata_id FROM signal_metadata "
+                           "WHERE metadata = ?", (signal_metadata,))
+            index = indexes.get((instrument_id, cursor.fetchone()[0]))
+            if index is None:
+                continue
+            index_id, metric, components = index
+            matrix = np.stack([
+                np.ravel(entry["array"] if "array" in entry
+                         else decode_data(entry["data"]))
+                for entry in group])
+            vectors = similarity_vectors(matrix, metric,
+                                         _decode_projection(components))
+            cursor.executemany(f"""
+                INSERT INTO {self.table_name}_similarity_vectors
+                (measurement_id, index_id, vector)
+                SELECT measurement_id, ?, ? FROM {self.table_name}
+                WHERE sample_id = ?
+                """, [(index_id, encode_array(vector), entry["sample_id"])
+                      for vector, entry in zip(vectors, group)])
+
+    def _append_to_shards(self,
+                          cursor: sqlite3.Cursor,
+                          entries: List[dict]) -> None:
+        """
+        Appends the arrays of freshly inserted entries to their shards and
+        records their positions. Does not commit.
+
+        Shard files are append-only and the committed row count lives in
+        SQLite, so rows appended by a transaction that is rolled back are
+        simply overwritten by the next append.
+        """
+        groups = {}
+        for entry in entries:
+            groups.setdefault(
+                (entry["instrument_id"], entry["signal_metadata"]), []
+            ).append(entry)
+
+        for (instrument_id, signal_metadata), group in groups.items():
+            cursor.execute("SELECT metadata_id FROM signal_metadata "
+                           "WHERE metadata = ?", (signal_metadata,))
+            metadata_id = cursor.fetchone()[0]
+            row_shape = group[0]["array"].shape
+            if any(entry["array"].shape != row_shape for entry in group):
+                raise ValueError("Spectra sharing signal metadata must "
+                                 "have the same shape.")
+            block = np.stack([entry["array"].ravel() for entry in group])
+
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO {self.table_name}_shards
+                (instrument_id, metadata_id, row_shape, n_points, filename)
+                VALUES (?, ?, ?, ?, ?)
+                """, (instrument_id, metadata_id,
+                      encode_signal_metadata({"shape": list(row_shape)}),
+                      block.shape[1], f"{instrument_id}_{metadata_id}.npy"))
+            cursor.execute(f"""
+                SELECT shard_id, n_rows, n_points, filename
+                FROM {self.table_name}_shards
+                WHERE instrument_id = ? AND metadata_id = ?
+                """, (instrument_id, metadata_id))
+            shard_id, n_rows, n_points, filename = cursor.fetchone()
+            if n_points != block.shape[1]:
+                raise ValueError(f"Shard {filename} holds spectra of "
+                                 f"{n_points} points, got {block.shape[1]}.")
+
+            append_shard_rows(self.shard_dir / filename, n_rows, block)
+            cursor.execute(f"""
+                UPDATE {self.table_name}_shards SET n_rows = ?
+                WHERE shard_id = ?
+                """, (n_rows + len(block), shard_id))
+            cursor.executemany(f"""
+                INSERT INTO {self.table_name}_shard_rows
+                (measurement_id, shard_id, row)
+                SELECT measurement_id, ?, ? FROM {self.table_name}
+                WHERE sample_id = ?
+                """, [(shard_id, n_rows + i, entry["sample_id"])
+                      for i, entry in enumerate(group)])
+
+    def _shard_groups(self, measurement_ids: List[int]) -> Iterator[tuple]:
+        """
+        Locates sharded measurements.
+
+        Yields:
+            tuple: `(positions, shard, rows, row_shape)` per shard, where
+            `positions` index into `measurement_ids`, `shard` is the
+            read-only memory map of the shard and `rows` the matching rows
+            of the shard.
+        """
+        with self._read_cursor() as outer:
+            # A separate cursor, as the caller may be iterating over one
+            cursor = outer.connection.cursor()
+            with self._lookup_table(cursor, measurement_ids) as lookup:
+                cursor.execute(f"""
+                    SELECT k.position, r.row, s.shard_id, s.filename,
+                           s.n_rows, s.n_points, s.row_shape
+                    FROM {lookup} AS k
+                    JOIN {self.table_name}_shard_rows AS r
+                    ON r.measurement_id = k.value
+                    JOIN {self.table_name}_shards AS s USING (shard_id)
+                    ORDER BY s.shard_id, r.row
+                    """)
+                located = cursor.fetchall()
+            cursor.close()
+
+        # Positions of the lookup table follow the order of the unique ids
+        index = {mid: i for i, mid in enumerate(dict.fromkeys(
+            measurement_ids))}
+        positions_of = {}
+        for i, mid in enumerate(measurement_ids):
+            positions_of.setdefault(index[mid], []).append(i)
+
+        shards = {}
+        for position, row, shard_id, *shard in located:
+            positions, rows, _ = shards.setdefault(shard_id, ([], [], shard))
+            for i in positions_of[position - 1]:
+                positions.append(i)
+                rows.append(row)
+        for positions, rows, (filename, n_rows, n_points,
+                              row_shape) in shards.values():
+            yield (np.array(positions),
+                   open_shard(self.shard_dir / filename, n_rows, n_points),
+                   np.array(rows),
+                   tuple(decode_signal_metadata(row_shape)["shape"]))
+
+    def _load_shard_data(self, measurement_ids: List[int]) -> dict:
+        """
+        Reads sharded spectra with their original shape.
+
+        Returns:
+            dict: `{measurement_id: np.ndarray}` for the sharded ids.
+        """
+        measurement_ids = [int(mid) for mid in measurement_ids]
+        arrays = {}
+        for positions, shard, rows, row_shape in self._shard_groups(
+                measurement_ids):
+            block = np.asarray(shard[rows]).reshape(-1, *row_shape)
+            for position, array in zip(positions, block):
+                arrays[measurement_ids[position]] = array
+        return arrays
+
+    def _attach_shard_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Fills the empty `data` cells of sharded rows with their arrays.
+        """
+        if "data" not in df or "measurement_id" not in df:
+            return df
+        missing = df["data"].isna().to_numpy()
+        if not missing.any():
+            return df
+        arrays = self._load_shard_data(df["measurement_id"][missing])
+        values = df["data"].tolist()
+        for i, mid in zip(np.flatnonzero(missing),
+                          df["measurement_id"][missing]):
+            values[i] = arrays.get(int(mid))
+        df["data"] = pd.Series(values, index=df.index, dtype=object)
+        return df
+
+    def _decode_into(self, matrix: np.ndarray, values: list,
+                     measurement_ids: list) -> None:
+        """
+        Decodes the `data` values of matrix rows into `matrix`; sharded
+        rows (empty `data`) are copied straight from their shards.
+        """
+        sharded = []
+        for i, value in enumerate(values):
+            if value is None:
+                sharded.append(i)
+                continue
+            try:
+                matrix[i] = np.ravel(decode_data(value))
+            except ValueError:
+                raise ValueError("Unable to stack data array due to "
+                                 "inconsistent lengths")
+        if not sharded:
+            return
+        ids = [measurement_ids[i] for i in sharded]
+        found = np.zeros(len(sharded), dtype=bool)
+        for positions, shard, rows, _ in self._shard_groups(ids):
+            if shard.shape[1] != matrix.shape[1]:
+                raise ValueError("Unable to stack data array due to "
+                                 "inconsistent lengths")
+            matrix[np.asarray(sharded)[positions]] = shard[rows]
+            found[positions] = True
+        if not found.all():
+            raise ValueError("Measurements without data: "
+                             f"{np.asarray(ids)[~found].tolist()}")
+
+    def compact_shards(self) -> int:
+        """
+        Rewrites the shards holding rows of deleted measurements.
+
+        Live rows are copied in chunks into a new shard file, the positions
+        are updated in one transaction and the old file is removed once the
+        transaction is committed, so a crash at any point leaves a
+        consistent store (at worst with an orphaned file).
+
+        Returns:
+            int: Number of rows reclaimed.
+        """
+        self.wait_for_backup()
+        reclaimed = 0
         with self._get_cursor() as cursor:
-<<<<<<< HEAD
-            cursor.executemany(query1, [(inst_ins.instrument_id,) for inst_ins in obj])
-            if commit:
+            cursor.execute(f"""
+                SELECT s.shard_id, s.filename, s.n_rows, s.n_points,
+                       COUNT(r.measurement_id)
+                FROM {self.table_name}_shards AS s
+                LEFT JOIN {self.table_name}_shard_rows AS r USING (shard_id)
+                GROUP BY s.shard_id
+                """)
+            for shard_id, filename, n_rows, n_points, n_live in (
+                    cursor.fetchall()):
+                if n_live == n_rows:
+                    continue
+                cursor.execute(f"""
+                    SELECT measurement_id, row
+                    FROM {self.table_name}_shard_rows
+                    WHERE shard_id = ? ORDER BY row
+                    """, (shard_id,))
+                ids, rows = zip(*cursor.fetchall()) if n_live else ((), ())
+                shard = open_shard(self.shard_dir / filename, n_rows,
+                                   n_points)
+                stem, _, generation = Path(filename).stem.partition(".")
+                new_filename = f"{stem}.{int(generation or 0) + 1}.npy"
+                write_shard(self.shard_dir / new_filename,
+                            (shard[list(rows[start:start + 4096])]
+                             for start in range(0, n_live, 4096)),
+                            n_live, n_points)
+                del shard
+                cursor.executemany(f"""
+                    UPDATE {self.table_name}_shard_rows SET row = ?
+                    WHERE measurement_id = ?
+                    """, [(row, mid) for row, mid in enumerate(ids)])
+                cursor.execute(f"""
+                    UPDATE {self.table_name}_shards
+                    SET n_rows = ?, filename = ? WHERE shard_id = ?
+                    """, (n_live, new_filename, shard_id))
                 self._connection.commit()
-=======
-            cursor.executemany(query1, [(inst_ins.instrument_id,)
-                                        for inst_ins in obj])
-            cursor.executemany(query2, [(entry['signal_metadata'],)
-                                        for entry in entries])
-            cursor.executemany(query3, entries)
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
+                os.remove(self.shard_dir / filename)
+                reclaimed += n_rows - n_live
+        return reclaimed
 
-            if commit:
-                self._periodic_backup()
-                self._connection.commit()
+    def _copy_shards(self, target: Path) -> None:
+        """
+        Copies the shards referenced by the database backup `target` next
+        to it, truncated to the row counts of that snapshot.
+        """
+        with sqlite3.connect(target) as snapshot:
+            try:
+                shards = snapshot.execute(f"""
+                    SELECT filename, n_rows, n_points
+                    FROM {self.table_name}_shards
+                    """).fetchall()
+            except sqlite3.OperationalError:
+                shards = []
+        snapshot.close()
+        for filename, n_rows, n_points in shards:
+            copy_shard(self.shard_dir / filename,
+                       _shard_dir(target) / filename, n_rows, n_points)
+
+    def ingest_directory(
+            self,
+            path: Union[Path, str],
+            pattern: str = "*",
+            *,
+            workers: int = None,
+            chunksize: int = 200) -> dict:
+        """
+        Parses every instrument file in a directory and adds it to the database.
+
+        Files are parsed in a process pool and the parsed entries are
+        streamed back to this process, which is the only writer and commits
+        them in transactions of `chunksize` rows. A file that fails to parse,
+        or a sample that already exists, is reported instead of aborting the
+        batch. Single-sample files without a sample name are named after
+        their file stem.
+
+        Args:
+            path: Directory to search.
+            pattern: Glob pattern relative to `path`, e.g. "*.spa" or
+                "**/*.csv". Files with unsupported extensions are skipped.
+            workers: Number of worker processes. Defaults to the number of
+                CPUs; with 1 the files are parsed in this process.
+            chunksize: Number of rows written per transaction.
+
+        Returns:
+            dict: `{"added": <number of rows>, "failed": {filepath: reason}}`
+        """
+        files = sorted(file for file in Path(path).glob(pattern)
+                       if file.suffix.lower() in _LOADERS_BY_SUFFIX
+                       and file.is_file())
+        parse = partial(_parse_file, storage_format=self.storage_format)
+
+        report = {"added": 0, "failed": {}}
+        buffer = []
+        if workers == 1:
+            results = map(parse, files)
+            self._write_parsed(results, buffer, report, chunksize)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(parse, files,
+                                       chunksize=max(1, chunksize // 10))
+                self._write_parsed(results, buffer, report, chunksize)
+
+        self._write_chunk(buffer, report)
+        if report["added"]:
+            self._periodic_backup()
+        return report
+
+    def _write_parsed(self, results, buffer, report, chunksize):
+        """Collects parsed files into `buffer` and writes full chunks."""
+        for filepath, entries, error in results:
+            if error is not None:
+                report["failed"][filepath] = error
+                continue
+            buffer.extend(entries)
+            if len(buffer) >= chunksize:
+                self._write_chunk(buffer, report)
+
+    def _write_chunk(self, buffer: List[dict], report: dict) -> None:
+        """
+        Writes and commits the buffered entries in a single transaction.
+
+        Duplicates are left out by `_insert_chunk` and end up in the
+        report; the other rows of the chunk are written.
+        """
+        if not buffer:
+            return
+        with self._get_cursor() as cursor:
+            skipped = self._insert_chunk(cursor, buffer)
+            self._connection.commit()
+        report["added"] += len(buffer) - len(skipped)
+        for entry in skipped:
+            report["failed"][entry["filepath"]] = (
+                f"Duplicate entry: {entry['sample_name']}")
+        buffer.clear()
 
     def remove_sample(
-<<<<<<< HEAD
-        self, sample_id: str | List[str], *, commit: bool = False
-    ) -> None:
-        self._periodic_backup()
-=======
             self,
             sample_id: str | List[str],
             *,
             commit: bool = False) -> None:
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
 
         if isinstance(sample_id, str):
             sample_id = [sample_id]
@@ -337,75 +1379,173 @@ class Database:
         with self._get_cursor() as cursor:
             cursor.execute(query, sample_id)
             if commit:
-                self._periodic_backup()
                 self._connection.commit()
+        if commit:
+            self._periodic_backup()
+
+    def migrate_storage(
+            self,
+            storage_format: Literal["json", "binary"] = None,
+            *,
+            chunksize: int = 500,
+            vacuum: bool = False) -> int:
+        """
+        Rewrites the stored spectra in place using the given storage format.
+
+        Rows are converted in chunks so only `chunksize` spectra are held in
+        memory at once. Rows already in the target format are left untouched.
+
+        Args:
+            storage_format: Target format. Defaults to the format of this
+                `Database` instance.
+            chunksize: Number of rows converted per `executemany` call.
+            vacuum: Whether to run `VACUUM` afterwards so that the freed
+                pages are given back to the file system.
+
+        Returns:
+            int: Number of rows that were rewritten.
+        """
+        storage_format = storage_format or self.storage_format
+        if storage_format not in ("json", "binary"):
+            raise ValueError("storage_format can only be 'json' or 'binary'")
+
+        source_type = "text" if storage_format == "binary" else "blob"
+        update_query = f"""
+            UPDATE {self.table_name} SET data = ?
+            WHERE measurement_id = ?
+            """
+        n_rows = 0
+        with self._get_cursor() as cursor:
+            cursor.execute(f"""
+                SELECT measurement_id FROM {self.table_name}
+                WHERE typeof(data) = ?
+                """, (source_type,))
+            ids = [row[0] for row in cursor.fetchall()]
+
+            for start in range(0, len(ids), chunksize):
+                chunk = ids[start:start + chunksize]
+                placeholders = ", ".join("?" for _ in chunk)
+                cursor.execute(f"""
+                    SELECT measurement_id, data FROM {self.table_name}
+                    WHERE measurement_id IN ({placeholders})
+                    """, chunk)
+                cursor.executemany(
+                    update_query,
+                    [(encode_data(decode_data(data), storage_format), mid)
+                     for mid, data in cursor.fetchall()])
+                n_rows += len(chunk)
+            self._connection.commit()
+
+        if vacuum:
+            self._connection.execute("VACUUM")
+        return n_rows
 
     def open_connection(self) -> None:
         """Open a connection to the database."""
         if self._connection is not None:
             raise RuntimeError("Connection is already open.")
-        self._connection = sqlite3.connect(self.database)
-        self.__create_table()
+        self._connect()
 
     def close_connection(self) -> None:
-        """Close the database connection."""
-        if self._connection:
-            self._connection.close()
-            self._connection = None
+        """
+        Close the database connection and the read-only pool, after the
+        running background backup has finished.
+        """
+        try:
+            self.wait_for_backup()
+        finally:
+            if self._backup_executor is not None:
+                self._backup_executor.shutdown()
+                self._backup_executor = None
+            self._close_readers()
+            self.clear_matrix_cache()
+            if self._connection:
+                self._connection.close()
+                self._connection = None
 
     def fetch_instrument_data(
         self, instrument_type: Literal["NMR", "FTIR", "FL"]
     ) -> pd.DataFrame:  # noqa: E501
         query = f"SELECT * FROM {self.table_name} WHERE instrument_id = ? ORDER BY measurement_id"  # noqa: E501
-        with self._get_cursor() as cursor:
+        with self._read_cursor() as cursor:
             cursor.execute(query, (instrument_type,))
             data = cursor.fetchall()
-        return pd.DataFrame(data, columns=[col[0] for col in cursor.description])
+        return self._attach_shard_data(
+            pd.DataFrame(data, columns=[col[0] for col in cursor.description]))
 
-<<<<<<< HEAD
-    def fetch_sample_data(
-        self, sample_info: Union[str, List[str]], col_name: str = "sample_name"
-    ) -> pd.DataFrame:
-=======
     def fetch_sample_data(self,
                           sample_info: str | List[str],
                           table_name: str = None,
                           col_name: str = "sample_name",
                           ordered: bool = False) -> pd.DataFrame:
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
+        """
+        Fetches the rows whose `col_name` matches any of `sample_info`.
+
+        The requested values are loaded into a temporary table and joined
+        against, so lists of any size are supported (a plain `IN (?, ...)`
+        list is limited by SQLite's host parameter limit).
+
+        Args:
+            sample_info: Value(s) to look up.
+            table_name: Table to query. Defaults to `table_name`.
+            col_name: Column to match.
+            ordered: Return the rows in the order of `sample_info` (by the
+                first occurrence of repeated values).
+        """
         if isinstance(sample_info, str):
             sample_info = [sample_info]
 
         target_table = table_name or self.table_name
-        # Base query preparation
-        placeholders = ', '.join('?' for _ in sample_info)
-
-        if ordered:
-            # SQL with order preservation (slow)
-            query = f"""
-            SELECT *
-            FROM {target_table}
-            WHERE {col_name} IN ({placeholders})
-            ORDER BY CASE {col_name}
-                    {' '.join(f"WHEN '{sample}' THEN {i}" for
-                              i, sample in enumerate(sample_info))}
-                    END
-            """
-        else:
-            # Standard query (much faster)
-            query = f"""SELECT * FROM {target_table}
-                    WHERE {col_name} IN ({placeholders})"""
+        with self._read_cursor() as cursor:
+            with self._lookup_table(cursor, sample_info) as lookup:
+                cursor.execute(f"""
+                    SELECT t.*
+                    FROM {lookup} AS k
+                    JOIN {target_table} AS t ON t.{col_name} = k.value
+                    {'ORDER BY k.position, t.measurement_id'
+                     if ordered else ''}
+                    """)
+                data = cursor.fetchall()
+                columns = [col[0] for col in cursor.description]
+
+        return self._attach_shard_data(pd.DataFrame(data, columns=columns))
 
-        with self._get_cursor() as cursor:
-            cursor.execute(query, tuple(sample_info))
-            data = cursor.fetchall()
-<<<<<<< HEAD
-        return pd.DataFrame(data, columns=[col[0] for col in cursor.description])
-=======
+    @contextmanager
+    def _lookup_table(self, cursor: sqlite3.Cursor, values: Iterable):
+        """
+        Fills the connection's temporary lookup table with `values`.
 
-        return pd.DataFrame(data, columns=[col[0]
-                                           for col in cursor.description])
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
+        Yields the table name; its `position` column keeps the order of the
+        first occurrence of every value. The table is emptied afterwards
+        and the transaction opened by filling it is ended, leaving any
+        transaction of the caller untouched.
+        """
+        connection = cursor.connection
+        in_transaction = connection.in_transaction
+        self._fill_lookup_table(cursor, "temp._lookup_values", values)
+        try:
+            yield "temp._lookup_values"
+        finally:
+            cursor.execute("DELETE FROM temp._lookup_values")
+            if not in_transaction:
+                connection.commit()
+
+    @staticmethod
+    def _fill_lookup_table(cursor: sqlite3.Cursor,
+                           table: str,
+                           values: Iterable) -> None:
+        """
+        Creates the temporary lookup table `table` if needed and inserts
+        the unique `values`, numbered by `position` in order of first
+        occurrence. Does not commit.
+        """
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+            position INTEGER PRIMARY KEY,
+            value UNIQUE
+            )""")
+        cursor.executemany(f"INSERT INTO {table} (value) VALUES (?)",
+                           ((value,) for value in dict.fromkeys(values)))
 
     def get_data_by_instrument_and_sample(
         self,
@@ -415,14 +1555,15 @@ class Database:
         if not isinstance(sample_name, str):
             sample_name = str(sample_name)
         query = f"SELECT * FROM {self.table_name} WHERE instrument_id = ? AND sample_name = ?"  # noqa: E501
-        with self._get_cursor() as cursor:
+        with self._read_cursor() as cursor:
             cursor.execute(query, (instrument_type, sample_name))
             data = cursor.fetchall()
-        return pd.DataFrame(data, columns=[col[0] for col in cursor.description])
+        return self._attach_shard_data(
+            pd.DataFrame(data, columns=[col[0] for col in cursor.description]))
 
     def execute_custom_query(self, query: str, params: Optional[tuple] = None) -> tuple:
         if query.strip().lower().startswith("select"):
-            with self._get_cursor() as cursor:
+            with self._read_cursor() as cursor:
                 cursor.execute(query, params or ())
                 results = cursor.fetchall()
                 column_names = [description[0] for description in cursor.description]
@@ -430,149 +1571,871 @@ class Database:
         else:
             ValueError("Only SELECT queries are allowed with this method.")
 
-    def transform_data_for_analysis(
-<<<<<<< HEAD
-        self,
-        instrument_type: Literal["NMR", "FTIR", "FL"],
-        reference_sample_id: str = None,
-        output_format: Literal["df", "csv"] = "df",
-=======
+    def iter_samples(
             self,
-            instrument_type: Literal["NMR",
-                                     "FTIR",
-                                     "FL"],
-            sample_ids: List[str] = None,
-            reference_sample_id: str = None,
-            output_format: Literal["df",
-                                   "csv"] = "df"
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
-    ) -> dict | None:
-        if sample_ids:
-            df = self.fetch_sample_data(
-                sample_info=sample_ids,
-                col_name="sample_id"
-            )
+            instrument_type: Literal["NMR", "FTIR", "FL"] = None,
+            *,
+            sample_ids: str | List[str] = None,
+            metadata_id: int = None,
+            measured_between: tuple[str, str] = None,
+            chunksize: int = 1000,
+            as_numpy: bool = False,
+            dtype: np.dtype = np.float32,
+            preprocess: Pipeline = None
+    ) -> Iterator[pd.DataFrame | tuple[np.ndarray, pd.DataFrame]]:
+        """
+        Iterates over the matching measurements in chunks.
+
+        Rows are pulled with `fetchmany`, so memory is bounded by
+        `chunksize` regardless of the size of the table. No lock is held
+        between chunks: with `readers` > 0 the iterator reads through a
+        read-only connection of its own (closed once the iterator is
+        exhausted or closed; writes proceed meanwhile under WAL), otherwise
+        the writer connection is locked while each chunk is fetched.
+
+        Args:
+            instrument_type: Restricts to one instrument type.
+            sample_ids: Restricts to the given sample id(s).
+            metadata_id: Restricts to one axis definition, which guarantees
+                equal spectrum lengths in `as_numpy` mode.
+            measured_between: `(start, end)` bounds (inclusive) on
+                `measurement_date`.
+            chunksize: Maximum number of rows per chunk.
+            as_numpy: Yield decoded arrays instead of DataFrames.
+            dtype: dtype of the arrays in `as_numpy` mode.
+            preprocess: Fitted pipeline applied to every chunk in
+                `as_numpy` mode, see `fetch_matrix`.
+
+        Yields:
+            pd.DataFrame: Chunks with the columns of the table, as returned
+            by `fetch_instrument_data`. In `as_numpy` mode,
+            `(matrix, rows)` tuples where `matrix` holds one decoded
+            (flattened) spectrum per row and `rows` has `sample_id`,
+            `sample_name`, `internal_code` and `metadata_id`.
+        """
+        if isinstance(sample_ids, str):
+            sample_ids = [sample_ids]
+        if preprocess is not None and not as_numpy:
+            raise ValueError("preprocess requires as_numpy=True")
+        if preprocess is not None and not preprocess.fitted:
+            raise RuntimeError("Chunks are preprocessed one at a time, fit "
+                               "the pipeline first.")
+
+        if not self._connection:
+            raise RuntimeError(
+                "Database connection is not established. Use 'with' statement."
+            )  # noqa E501
+
+        if self.readers:
+            # A read-only connection of its own, closed with the iterator
+            connection, lock = self._open_reader(), nullcontext()
         else:
-            df = self.fetch_instrument_data(instrument_type)
+            # The writer connection, locked while fetching each chunk only
+            connection, lock = self._connection, self._write_lock
+        lookup = (f"temp._iter_lookup_{next(self._iter_lookup_ids)}"
+                  if sample_ids else None)
+        cursor = connection.cursor()
+        try:
+            with lock:
+                self._fill_iter_lookup(cursor, lookup, sample_ids)
+                cursor.execute(*self._iter_query(
+                    instrument_type, metadata_id, measured_between,
+                    as_numpy, lookup))
+                names = [col[0] for col in cursor.description]
+
+            while True:
+                with lock:
+                    rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                if not as_numpy:
+                    yield self._attach_shard_data(
+                        pd.DataFrame(rows, columns=names))
+                    continue
+                *meta, measurement_ids, data = zip(*rows)
+                yield (self._decode_chunk(measurement_ids, data, dtype,
+                                          preprocess),
+                       pd.DataFrame(dict(zip(names[:-2], meta))))
+        finally:
+            with lock:
+                cursor.close()
+                if lookup:
+                    connection.execute(f"DROP TABLE IF EXISTS {lookup}")
+            if self.readers:
+                connection.close()
+
+    def _fill_iter_lookup(self,
+                          cursor: sqlite3.Cursor,
+                          lookup: Optional[str],
+                          sample_ids: Optional[List[str]]) -> None:
+        """
+        Fills the lookup table `lookup` of an `iter_samples` iterator, if
+        any, and ends the transaction this opens. A transaction of the
+        caller is kept.
+        """
+        if lookup is None:
+            return
+        in_transaction = cursor.connection.in_transaction
+        self._fill_lookup_table(cursor, lookup, sample_ids)
+        if not in_transaction:
+            cursor.connection.commit()
+
+    def _iter_query(self,
+                    instrument_type: Optional[str],
+                    metadata_id: Optional[int],
+                    measured_between: Optional[tuple[str, str]],
+                    as_numpy: bool,
+                    lookup: Optional[str]) -> tuple[str, list]:
+        """
+        Builds the query of `iter_samples`.
+
+        Returns:
+            tuple: `(query, params)`. With `lookup`, the rows are restricted
+            to the sample ids of that lookup table.
+        """
+        conditions, params = [], []
+        if instrument_type is not None:
+            conditions.append("instrument_id = ?")
+            params.append(instrument_type)
+        if metadata_id is not None:
+            conditions.append("metadata_id = ?")
+            params.append(metadata_id)
+        if measured_between is not None:
+            conditions.append("measurement_date BETWEEN ? AND ?")
+            params += list(measured_between)
+
+        columns = ("t.sample_id, t.sample_name, t.internal_code, "
+                   "t.metadata_id, t.measurement_id, t.data"
+                   if as_numpy else "t.*")
+        join = (f"JOIN {lookup} AS k ON k.value = t.sample_id"
+                if lookup else "")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"""
+            SELECT {columns} FROM {self.table_name} AS t {join}
+            {where} ORDER BY t.measurement_id
+            """, params
+
+    def _decode_chunk(self,
+                      measurement_ids: tuple,
+                      data: tuple,
+                      dtype: np.dtype,
+                      preprocess: Optional[Pipeline]) -> np.ndarray:
+        """
+        Decodes a chunk of `iter_samples` into a matrix of flattened
+        spectra, loading sharded rows from their shards, and runs the
+        fitted pipeline on it.
+        """
+        if None in data:
+            sharded = self._load_shard_data(
+                [mid for mid, value in zip(measurement_ids, data)
+                 if value is None])
+            data = [sharded.get(mid) if value is None else value
+                    for mid, value in zip(measurement_ids, data)]
+        try:
+            matrix = np.stack([np.ravel(decode_data(value))
+                               for value in data]).astype(dtype, copy=False)
+        except ValueError:
+            raise ValueError("Unable to stack data array due to "
+                             "inconsistent lengths, filter by "
+                             "metadata_id")
+        if preprocess is not None:
+            matrix = _apply_pipeline(
+                matrix, preprocess, fit=False,
+                spectrum_length=np.shape(decode_data(data[0]))[-1])
+        return matrix
+
+    def _fetch_signal_metadata(self, metadata_ids) -> dict:
+        """
+        Fetches and decodes several signal metadata entries.
+
+        Entries are served from the LRU cache when possible; the remaining
+        ones are resolved in a single query and added to the cache.
 
-        instrument_config = {
-            "NMR": "ppm",
-            "FTIR": "Wavenumbers",
-            "FL": ("Excitation", "Emission"),
+        Args:
+            metadata_ids: Iterable of `metadata_id` values.
+
+        Returns:
+            dict: `{metadata_id: signal metadata}` with the axes decoded as
+            read-only `np.ndarray`.
+        """
+        # The reader is taken before the lock, as in every other read path,
+        # so a thread holding the lock never waits for a pooled connection.
+        with self._read_cursor(), self._signal_metadata_lock:
+            return self._fetch_signal_metadata_locked(metadata_ids)
+
+    def _fetch_signal_metadata_locked(self, metadata_ids) -> dict:
+        self._validate_signal_metadata_cache()
+        cache = self._signal_metadata_cache
+
+        decoded = {}
+        missing = []
+        for metadata_id in dict.fromkeys(int(mid) for mid in metadata_ids):
+            if metadata_id in cache:
+                cache.move_to_end(metadata_id)
+                decoded[metadata_id] = cache[metadata_id]
+                self._signal_metadata_cache_hits += 1
+            else:
+                missing.append(metadata_id)
+                self._signal_metadata_cache_misses += 1
+        if not missing:
+            return decoded
+
+        placeholders = ", ".join("?" for _ in missing)
+        query = f"""
+            SELECT metadata_id, metadata
+            FROM signal_metadata
+            WHERE metadata_id IN ({placeholders})
+            """
+        with self._read_cursor() as cursor:
+            cursor.execute(query, missing)
+            rows = cursor.fetchall()
+
+        for metadata_id, text in rows:
+            signal_metadata = decode_signal_metadata(text)
+            for axis in signal_metadata.values():
+                if isinstance(axis, np.ndarray):
+                    axis.flags.writeable = False
+            decoded[metadata_id] = signal_metadata
+            if self.signal_metadata_cache_size > 0:
+                cache[metadata_id] = signal_metadata
+                if len(cache) > self.signal_metadata_cache_size:
+                    cache.popitem(last=False)
+        return decoded
+
+    def _validate_signal_metadata_cache(self) -> None:
+        """
+        Clears the cache if the signal_metadata table has changed.
+
+        `PRAGMA data_version` only changes when another connection commits,
+        so the table itself is only inspected after such a commit. Writes
+        through the same connection only add new entries and keep the cache
+        valid. As data_version is per connection, switching between pooled
+        readers always inspects the table.
+        """
+        with self._read_cursor() as cursor:
+            connection = cursor.connection
+            data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
+            version = self._signal_metadata_version
+            if (version is not None and version[0] is connection
+                    and version[1] == data_version):
+                return
+            fingerprint = cursor.execute(
+                "SELECT COUNT(*), MAX(metadata_id) FROM signal_metadata"
+            ).fetchone()
+
+        if version is None or version[2] != fingerprint:
+            self._signal_metadata_cache.clear()
+        self._signal_metadata_version = (connection, data_version,
+                                         fingerprint)
+
+    def clear_signal_metadata_cache(self) -> None:
+        """Empties the signal metadata cache and resets its counters."""
+        with self._signal_metadata_lock:
+            self._signal_metadata_cache.clear()
+            self._signal_metadata_cache_hits = 0
+            self._signal_metadata_cache_misses = 0
+            self._signal_metadata_version = None
+
+    def signal_metadata_cache_info(self) -> dict:
+        """
+        Returns the statistics of the signal metadata cache.
+
+        Returns:
+            dict: `hits`, `misses`, `size` and `maxsize` of the cache.
+        """
+        return {
+            "hits": self._signal_metadata_cache_hits,
+            "misses": self._signal_metadata_cache_misses,
+            "size": len(self._signal_metadata_cache),
+            "maxsize": self.signal_metadata_cache_size,
         }
 
-        key = instrument_config[instrument_type]
+    def fetch_matrix(
+            self,
+            instrument_type: Literal["NMR", "FTIR", "FL"],
+            sample_ids: str | List[str] = None,
+            dtype: np.dtype = np.float32,
+            reference_sample_id: str = None,
+            *,
+            preprocess: Pipeline = None,
+            cache: bool = False
+    ) -> tuple[np.ndarray, np.ndarray | tuple, pd.DataFrame]:
+        """
+        Fetches spectra of one instrument type as a contiguous matrix.
 
-        df = self._parse_data(df, reference_sample_id, key)
+        A single `(n_samples, n_points)` array is allocated up front and each
+        row is decoded straight into its slot, so no per-spectrum Python
+        lists or pandas object columns are created. Only samples sharing the
+        signal metadata (axis definition) of the reference sample are
+        returned. Fluorescence EEMs are flattened row-wise (excitation-major).
 
-        if output_format == "csv":
-            output_dir = Path(self.database).parent / "csv_export"
-            output_dir.mkdir(parents=True, exist_ok=True)
-            df.to_csv(output_dir / f"{instrument_type}.csv", index=False)
-            return None
+        Args:
+            instrument_type: The instrument type to fetch.
+            sample_ids: Optional sample id(s) to restrict the fetch to.
+            dtype: dtype of the returned matrix.
+            reference_sample_id: Sample whose axis definition is used.
+                Defaults to the first matching measurement.
+            preprocess: Pipeline fitted on and applied to the matrix in
+                place, e.g. `Pipeline(SNV(), SavitzkyGolay(deriv=1))`.
+                Fluorescence EEMs are processed per emission spectrum.
+            cache: Serve the result from (and store it in) the in-memory
+                cache, keyed by the arguments, `preprocess.spec` and the
+                version of the table. Cached matrices are read-only.
+
+        Returns:
+            tuple: `(matrix, axis, rows)` where `axis` is the axis vector
+            (a tuple of excitation and emission vectors for "FL") and
+            `rows` is a DataFrame with `sample_id`, `sample_name` and
+            `internal_code` for every row of the matrix.
+        """
+        if cache and self.matrix_cache_size > 0:
+            # The version is read on the connection the fetch goes through
+            # (nested reads reuse it), so reads through the pool do not
+            # wait for the writer.
+            with self._read_cursor() as cursor:
+                key = (instrument_type,
+                       (sample_ids,) if isinstance(sample_ids, str)
+                       else None if sample_ids is None
+                       else tuple(sample_ids),
+                       np.dtype(dtype).str, reference_sample_id,
+                       None if preprocess is None else preprocess.spec,
+                       _connection_state(cursor.connection))
+                with self._matrix_cache_lock:
+                    cached = self._matrix_cache.get(key)
+                    if cached is not None:
+                        self._matrix_cache.move_to_end(key)
+                if cached is None:
+                    matrix, axis, rows = self.fetch_matrix(
+                        instrument_type, sample_ids, dtype,
+                        reference_sample_id, preprocess=preprocess)
+                    matrix.setflags(write=False)
+                    cached = (matrix, axis, rows,
+                              None if preprocess is None
+                              else preprocess.get_state())
+                    with self._matrix_cache_lock:
+                        self._matrix_cache[key] = cached
+                        while (len(self._matrix_cache)
+                               > self.matrix_cache_size):
+                            self._matrix_cache.popitem(last=False)
+                elif preprocess is not None:
+                    # Leave the pipeline fitted as a fetch would
+                    preprocess.set_state(cached[3])
+            matrix, axis, rows, _ = cached
+            return matrix, axis, rows.copy()
+
+        with self._read_cursor() as cursor:
+            selection = self._matrix_selection(cursor, instrument_type,
+                                               sample_ids,
+                                               reference_sample_id)
+            if selection is None:
+                return np.empty((0, 0), dtype=dtype), None, pd.DataFrame(
+                    columns=["sample_id", "sample_name", "internal_code"])
+            conditions, params, axis, n_samples, n_points = selection
+
+            matrix = np.empty((n_samples, n_points), dtype=dtype)
+            cursor.execute(f"""
+                SELECT sample_id, sample_name, internal_code, measurement_id,
+                       data
+                FROM {self.table_name}
+                WHERE {conditions}
+                ORDER BY measurement_id
+                """, params)
+            rows = cursor.fetchall()
+            if len(rows) != n_samples:
+                raise RuntimeError("The table changed during the fetch.")
+            sample_id_col, name_col, code_col, ids, data = (
+                map(list, zip(*rows)) if rows else ([], [], [], [], []))
+            self._decode_into(matrix, data, ids)
+
+        rows_meta = pd.DataFrame({"sample_id": sample_id_col,
+                                  "sample_name": name_col,
+                                  "internal_code": code_col})
+        if preprocess is not None:
+            matrix = _apply_pipeline(
+                matrix, preprocess, fit=True,
+                spectrum_length=(len(axis[1]) if isinstance(axis, tuple)
+                                 else None))
+        return matrix, axis, rows_meta
+
+    def clear_matrix_cache(self) -> None:
+        """Empties the cache of `fetch_matrix(cache=True)`."""
+        with self._matrix_cache_lock:
+            self._matrix_cache.clear()
+
+    def _matrix_selection(
+            self,
+            cursor: sqlite3.Cursor,
+            instrument_type: Literal["NMR", "FTIR", "FL"],
+            sample_ids: str | List[str] = None,
+            reference_sample_id: str = None) -> tuple | None:
+        """
+        Resolves the rows and the axis of a matrix fetch.
 
-        return df
+        Returns:
+            tuple: `(conditions, params, axis, n_samples, n_points)` where
+            `conditions`/`params` select the rows sharing the axis
+            definition of the reference sample, or None when nothing
+            matches.
+        """
+        if isinstance(sample_ids, str):
+            sample_ids = [sample_ids]
 
-    def _parse_data(
-        self, df: pd.DataFrame, reference_id: Optional[str], metadata_key: str | tuple
-    ) -> pd.DataFrame:
-        if reference_id:
-            ref_sample = df[df.sample_id == reference_id].iloc[0]
-<<<<<<< HEAD
-            ref_metadata = json.loads(ref_sample["signal_metadata"])
-        else:
-            ref_metadata = json.loads(df.iloc[0]["signal_metadata"])
-=======
-            ref_metadata_id = ref_sample['metadata_id']
+        conditions = "instrument_id = ?"
+        params = [instrument_type]
+        if sample_ids:
+            conditions += (" AND sample_id IN "
+                           f"({', '.join('?' for _ in sample_ids)})")
+            params += list(sample_ids)
+
+        if reference_sample_id:
+            cursor.execute(f"""
+                SELECT metadata_id FROM {self.table_name}
+                WHERE sample_id = ?
+                """, (reference_sample_id,))
         else:
-            ref_metadata_id = df.iloc[0]['metadata_id']
-        query = """
-            SELECT metadata
-            FROM signal_metadata
-            WHERE metadata_id = ?
-            """
+            cursor.execute(f"""
+                SELECT metadata_id FROM {self.table_name}
+                WHERE {conditions}
+                ORDER BY measurement_id LIMIT 1
+                """, params)
+        ref = cursor.fetchone()
+        if ref is None:
+            return None
+        ref_metadata_id = ref[0]
+
+        axis, n_points = self._signal_axis(instrument_type, ref_metadata_id)
+
+        conditions += " AND metadata_id = ?"
+        params.append(ref_metadata_id)
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {self.table_name} WHERE {conditions}",
+            params)
+        n_samples = cursor.fetchone()[0]
+        return conditions, params, axis, n_samples, n_points
+
+    def _signal_axis(self,
+                     instrument_type: Literal["NMR", "FTIR", "FL"],
+                     metadata_id: int) -> tuple:
+        """
+        Returns:
+            tuple: `(axis, n_points)` of a signal metadata entry, `axis`
+            being a tuple of excitation and emission vectors for "FL" and
+            `n_points` the length of the flattened spectra.
+        """
+        signal_metadata = self._fetch_signal_metadata(
+            [metadata_id])[metadata_id]
+        key = _SIGNAL_AXES[instrument_type]
+        if isinstance(key, tuple):
+            axis = tuple(signal_metadata[k] for k in key)
+            return axis, int(np.prod([len(a) for a in axis]))
+        axis = signal_metadata[key]
+        return axis, len(axis)
+
+    def build_similarity_index(
+            self,
+            instrument_type: Literal["NMR", "FTIR", "FL"],
+            *,
+            metadata_id: int = None,
+            metric: Literal["cosine", "correlation"] = "cosine",
+            n_components: int = None,
+            chunksize: int = 1000) -> int:
+        """
+        Builds (or rebuilds) the similarity index of an instrument type.
+
+        One index is kept per (instrument_id, metadata_id), i.e. per axis
+        definition. Every spectrum is stored as a unit-length float32
+        vector (optionally projected on the first `n_components` principal
+        components of the indexed spectra), so a similarity query is a
+        single matrix product. The indexes are stored in the database and
+        kept up to date by `add_sample` and `remove_sample`.
+
+        Args:
+            instrument_type: The instrument type to index.
+            metadata_id: Restricts to one axis definition. Defaults to all
+                of them.
+            metric: "cosine" or "correlation" (Pearson correlation of the
+                spectra).
+            n_components: Number of PCA components. Defaults to no
+                projection.
+            chunksize: Number of spectra decoded at a time.
+
+        Returns:
+            int: Number of indexed spectra.
+        """
+        if metric not in SIMILARITY_METRICS:
+            raise ValueError(
+                f"metric can only be one of {SIMILARITY_METRICS}")
+
+        indexed = 0
+        # The write lock is held throughout, so no sample can be added
+        # between reading the spectra and registering the index.
         with self._get_cursor() as cursor:
-            cursor.execute(query, (int(ref_metadata_id),))
-            ref_metadata = json.loads(cursor.fetchone()[0])
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
-
-        if isinstance(metadata_key, tuple):
-            ref_data = {key: ref_metadata[key] for key in metadata_key}
-            columns = [
-                f"{ex}EX/{em}EM"
-<<<<<<< HEAD
-                for ex, em in product(
-                    ref_data[metadata_key[0]], ref_data[metadata_key[1]]
-                )
-            ]
-            is_valid = lambda meta: all(  # noqa E731
-                len(meta[key]) == len(ref_data[key]) for key in metadata_key
-            )
-            transform_fn = lambda df: np.array(
-                df.data.map(json.loads).tolist()  # noqa E731
-            ).reshape(df.shape[0], -1)
-=======
-                for ex, em in
-                product(ref_data[metadata_key[0]], ref_data[metadata_key[1]])
-                ]
-            # is_valid = lambda meta: all(  # noqa E731
-            #     len(meta[key]) == len(ref_data[key]) for key in metadata_key
-            #     )
-            transform_fn = lambda df: np.array(df  # noqa E731
-                                               .data
-                                               .map(json.loads)
-                                               .tolist()
-                                               ).reshape(df.shape[0],
-                                                         -1)
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
+            if metadata_id is None:
+                cursor.execute(f"""
+                    SELECT DISTINCT metadata_id FROM {self.table_name}
+                    WHERE instrument_id = ?
+                    """, (instrument_type,))
+                metadata_ids = [row[0] for row in cursor.fetchall()]
+            else:
+                metadata_ids = [metadata_id]
+
+            for group_id in metadata_ids:
+                _, n_points = self._signal_axis(instrument_type, group_id)
+                cursor.execute(f"""
+                    SELECT measurement_id, data FROM {self.table_name}
+                    WHERE instrument_id = ? AND metadata_id = ?
+                    ORDER BY measurement_id
+                    """, (instrument_type, group_id))
+                ids, blocks = [], []
+                while rows := cursor.fetchmany(chunksize):
+                    block_ids, data = map(list, zip(*rows))
+                    block = np.empty((len(rows), n_points),
+                                     dtype=np.float32)
+                    self._decode_into(block, data, block_ids)
+                    ids += block_ids
+                    blocks.append(block)
+                if not ids:
+                    continue
+                matrix = np.concatenate(blocks)
+                components = (fit_pca(matrix, n_components, metric)
+                              if n_components else None)
+                vectors = similarity_vectors(matrix, metric, components)
+
+                cursor.execute(f"""
+                    INSERT INTO {self.table_name}_similarity_indexes
+                    (instrument_id, metadata_id, metric, n_points,
+                     n_components, components)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (instrument_id, metadata_id) DO UPDATE SET
+                    metric = excluded.metric, n_points = excluded.n_points,
+                    n_components = excluded.n_components,
+                    components = excluded.components,
+                    version = version + 1
+                    """, (instrument_type, group_id, metric, n_points,
+                          n_components,
+                          None if components is None
+                          else encode_array(components)))
+                cursor.execute(f"""
+                    SELECT index_id FROM {self.table_name}_similarity_indexes
+                    WHERE instrument_id = ? AND metadata_id = ?
+                    """, (instrument_type, group_id))
+                index_id = cursor.fetchone()[0]
+                cursor.execute(f"""
+                    DELETE FROM {self.table_name}_similarity_vectors
+                    WHERE index_id = ?
+                    """, (index_id,))
+                cursor.executemany(f"""
+                    INSERT INTO {self.table_name}_similarity_vectors
+                    (measurement_id, index_id, vector) VALUES (?, ?, ?)
+                    """, [(mid, index_id, encode_array(vector))
+                          for mid, vector in zip(ids, vectors)])
+                indexed += len(ids)
+            self._connection.commit()
+        return indexed
+
+    def _similarity_queries(
+            self,
+            query,
+            instrument_type: Optional[str],
+            metadata_id: Optional[int]) -> List[tuple]:
+        """
+        Resolves the spectra of a similarity query.
 
-        else:
-            ref_data = ref_metadata[metadata_key]
-            columns = ref_data
-<<<<<<< HEAD
-            is_valid = lambda meta: len(meta[metadata_key]) == len(
-                ref_data
-            )  # noqa E731
-            transform_fn = lambda df: np.vstack(
-                df.data.map(json.loads).tolist()  # noqa E731
-            )
+        Returns:
+            list: `(instrument_id, metadata_id, spectrum)` per query
+            spectrum, `metadata_id` being None when it is left to be
+            matched on the length of the spectrum.
+        """
+        if isinstance(query, str) or (
+                isinstance(query, (list, tuple)) and query
+                and all(isinstance(q, str) for q in query)):
+            sample_ids = [query] if isinstance(query, str) else list(query)
+            df = self.fetch_sample_data(sample_ids, col_name="sample_id",
+                                        ordered=True)
+            missing = set(sample_ids) - set(df["sample_id"])
+            if missing:
+                raise ValueError(f"Unknown sample ids: {sorted(missing)}")
+            return [(instrument_id, mid, np.ravel(decode_data(data)))
+                    for instrument_id, mid, data in zip(
+                        df["instrument_id"], df["metadata_id"], df["data"])]
+
+        if isinstance(query, np.ndarray):
+            if instrument_type is None:
+                raise ValueError("instrument_type is required for array "
+                                 "queries")
+            if query.ndim == 1:
+                query = query[np.newaxis]
+            return [(instrument_type, metadata_id, spectrum)
+                    for spectrum in query.reshape(len(query), -1)]
+
+        queries = []
+        with self._read_cursor() as cursor:
+            for sample in _flatten_loaders(query):
+                # Accessing the data loads the signal metadata of lazy
+                # loaders
+                spectrum = np.ravel(np.asarray(sample.data, dtype=np.float32))
+                cursor.execute(
+                    "SELECT metadata_id FROM signal_metadata "
+                    "WHERE metadata = ?",
+                    (encode_signal_metadata(
+                        sample.metadata["Signal Metadata"]),))
+                row = cursor.fetchone()
+                queries.append((sample.instrument_id,
+                                -1 if row is None else row[0],
+                                spectrum))
+        return queries
+
+    def _load_similarity_index(self,
+                               cursor: sqlite3.Cursor,
+                               index_id: int) -> tuple:
+        """
+        Returns:
+            tuple: `(measurement_ids, vectors)` of a similarity index,
+            served from memory as long as its version is unchanged.
+        """
+        cursor.execute(f"""
+            SELECT version, n_points, n_components
+            FROM {self.table_name}_similarity_indexes WHERE index_id = ?
+            """, (index_id,))
+        version, n_points, n_components = cursor.fetchone()
+        cached = self._similarity_cache.get(index_id)
+        if cached is None or cached[0] != version:
+            cursor.execute(f"""
+                SELECT measurement_id, vector
+                FROM {self.table_name}_similarity_vectors
+                WHERE index_id = ? ORDER BY measurement_id
+                """, (index_id,))
+            rows = cursor.fetchall()
+            vectors = np.empty((len(rows), n_components or n_points),
+                               dtype=np.float32)
+            for i, (_, vector) in enumerate(rows):
+                vectors[i] = decode_array(vector)
+            cached = (version,
+                      np.array([row[0] for row in rows], dtype=np.int64),
+                      vectors)
+            self._similarity_cache[index_id] = cached
+        return cached[1], cached[2]
+
+    def find_similar(
+            self,
+            query: Union[str, List[str], np.ndarray,
+                         DataLoaderType, Iterable[DataLoaderType]],
+            k: int = 5,
+            *,
+            instrument_type: Literal["NMR", "FTIR", "FL"] = None,
+            metadata_id: int = None) -> pd.DataFrame:
+        """
+        Finds the `k` most similar stored spectra of each query spectrum.
 
-        df_filtered = df[df["signal_metadata"].apply(lambda x: is_valid(json.loads(x)))]
-        data = transform_fn(df_filtered)
-        return pd.concat(
-            objs=[
-                df_filtered[["sample_name", "internal_code"]],
-                pd.DataFrame(data, columns=columns),
-            ],
-            axis=1,
-        )
+        Queries are matched against the index of their (instrument_id,
+        metadata_id), see `build_similarity_index`, with one batched matrix
+        product per index, using the metric the index was built with.
 
-    def create_spectrum(
-        self,
-        sample_id: str | List[str],
-    ) -> go.Figure:
-        df = self.fetch_sample_data(sample_info=sample_id, col_name="sample_id")
-        if len(df.instrument_id.unique()) != 1:
-            raise TypeError("Only one type of spectroscopic method allowed.")
-=======
-            # is_valid = lambda meta: len(meta[metadata_key]) == len(ref_data)  # noqa E731
-            transform_fn = lambda df: np.vstack(df  # noqa E731
-                                                .data
-                                                .map(json.loads)
-                                                .tolist())
+        Args:
+            query: Sample id(s) of stored spectra, data loader(s), or an
+                array of one spectrum per row (`(n_queries, n_points)`, or
+                `(n_queries, n_excitation, n_emission)` for "FL").
+            k: Number of neighbours per query spectrum.
+            instrument_type: Instrument type of array queries.
+            metadata_id: Axis definition of array queries. Defaults to the
+                only index of `instrument_type` with spectra of the same
+                length.
+
+        Returns:
+            pd.DataFrame: `query` (position of the query spectrum), `rank`,
+            `sample_id`, `sample_name`, `internal_code` and `score`, best
+            matches first.
+        """
+        queries = self._similarity_queries(query, instrument_type,
+                                           metadata_id)
+        with self._read_cursor() as cursor:
+            cursor.execute(f"""
+                SELECT index_id, instrument_id, metadata_id, metric,
+                       n_points, components
+                FROM {self.table_name}_similarity_indexes
+                """)
+            indexes = cursor.fetchall()
+
+            groups = {}
+            for position, (instrument_id, mid, spectrum) in enumerate(
+                    queries):
+                candidates = [
+                    index for index in indexes
+                    if index[1] == instrument_id
+                    and (index[2] == mid if mid is not None
+                         else index[4] == len(spectrum))]
+                if len(candidates) != 1:
+                    raise ValueError(
+                        f"No similarity index matches query {position} "
+                        f"({instrument_id}, metadata_id={mid}); build one "
+                        "with build_similarity_index or pass metadata_id"
+                        if not candidates else
+                        f"Several similarity indexes match query "
+                        f"{position}, pass metadata_id")
+                groups.setdefault(candidates[0], []).append(position)
+
+            hits = []
+            for (index_id, _, _, metric, n_points,
+                 components), positions in groups.items():
+                if any(len(queries[p][2]) != n_points for p in positions):
+                    raise ValueError("Query spectra must have "
+                                     f"{n_points} points")
+                ids, vectors = self._load_similarity_index(cursor, index_id)
+                query_vectors = similarity_vectors(
+                    np.stack([queries[p][2] for p in positions]), metric,
+                    _decode_projection(components))
+                indices, scores = top_k(vectors, query_vectors, k)
+                for position, row_indices, row_scores in zip(
+                        positions, indices, scores):
+                    hits += [(position, rank, ids[i], score)
+                             for rank, (i, score) in enumerate(
+                                 zip(row_indices, row_scores.tolist()),
+                                 start=1)]
+
+            hit_ids = list(dict.fromkeys(int(hit[2]) for hit in hits))
+            with self._lookup_table(cursor, hit_ids) as lookup:
+                cursor.execute(f"""
+                    SELECT t.measurement_id, t.sample_id, t.sample_name,
+                           t.internal_code
+                    FROM {lookup} AS k
+                    JOIN {self.table_name} AS t
+                    ON t.measurement_id = k.value
+                    """)
+                samples = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        hits.sort(key=lambda hit: hit[:2])
+        return pd.DataFrame(
+            [(position, rank, *samples[int(mid)], score)
+             for position, rank, mid, score in hits],
+            columns=["query", "rank", "sample_id", "sample_name",
+                     "internal_code", "score"])
 
-        df_filtered = df[df['metadata_id'] == ref_metadata_id]
+    def transform_data_for_analysis(
+            self,
+            instrument_type: Literal["NMR",
+                                     "FTIR",
+                                     "FL"],
+            sample_ids: List[str] = None,
+            reference_sample_id: str = None,
+            output_format: Literal["df", "csv", "parquet",
+                                   "arrow", "npz", "npy"] = "df",
+            *,
+            chunksize: int = 1000,
+            output_dir: Union[Path, str] = None,
+            preprocess: Pipeline = None,
+            cache: bool = False
+    ) -> pd.DataFrame | Path:
+        """
+        Builds the wide analysis table of one instrument type: `sample_name`,
+        `internal_code` and one column per axis point ("<ex>EX/<em>EM" for
+        fluorescence).
 
-        try:
-            data = transform_fn(df_filtered)
-        except ValueError:
-            raise ValueError("Unable to stack data array due to "
-                             "inconsistent lengths")
+        File outputs are written `chunksize` rows at a time, so the full
+        matrix never sits in memory:
+
+        - "csv": text table, in `csv_export/`.
+        - "parquet" / "arrow": the same table as Parquet or Arrow IPC with
+          float32 columns (requires pyarrow).
+        - "npz": archive with the float32 matrix (`data`), the axis arrays
+          and `sample_id`/`sample_name`/`internal_code`.
+        - "npy": the float32 matrix as `.npy`, with the axis arrays and
+          labels in an `.axis.npz` sidecar.
 
-        return pd.concat(
-            objs=[df_filtered[['sample_name', 'internal_code']],
-                  pd.DataFrame(data, columns=columns)],
-            axis=1)
+        Args:
+            instrument_type: The instrument type to export.
+            sample_ids: Optional sample ids to restrict to.
+            reference_sample_id: Sample whose axis definition is used.
+            output_format: "df" returns the DataFrame, other values write a
+                file named after the instrument type.
+            chunksize: Rows per chunk of file outputs.
+            output_dir: Directory of file outputs. Defaults to
+                `csv_export/` for "csv" and `export/` otherwise, next to
+                the database.
+            preprocess: Pipeline run on the spectra, see `fetch_matrix`.
+                File outputs are processed chunk by chunk, so steps that
+                learn from the data (MSC without a reference) must be
+                fitted beforehand.
+            cache: Cache the matrix of the "df" output, see `fetch_matrix`.
+
+        Returns:
+            pd.DataFrame | Path: The table, or the path of the written file.
+        """
+        if output_format == "df":
+            matrix, axis, rows = self.fetch_matrix(
+                instrument_type,
+                sample_ids=sample_ids,
+                dtype=np.float64,
+                reference_sample_id=reference_sample_id,
+                preprocess=preprocess,
+                cache=cache)
+            return pd.concat(
+                objs=[rows[['sample_name', 'internal_code']],
+                      pd.DataFrame(matrix,
+                                   columns=_axis_columns(axis))],
+                axis=1)
+
+        if output_format not in EXPORT_FORMATS:
+            raise ValueError(f"output_format can only be 'df' or one of "
+                             f"{list(EXPORT_FORMATS)}")
+        if preprocess is not None and not preprocess.fitted:
+            raise RuntimeError("File outputs are preprocessed chunk by "
+                               "chunk, fit the pipeline first.")
+        if output_dir is None:
+            output_dir = Path(self.database).parent / (
+                "csv_export" if output_format == "csv" else "export")
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / f"{instrument_type}{EXPORT_FORMATS[output_format]}"
+
+        with self._read_cursor() as cursor:
+            selection = self._matrix_selection(cursor, instrument_type,
+                                               sample_ids,
+                                               reference_sample_id)
+            if selection is None:
+                conditions, params, axis, n_samples, n_points = (
+                    "0", [], None, 0, 0)
+            else:
+                conditions, params, axis, n_samples, n_points = selection
+            key = _SIGNAL_AXES[instrument_type]
+            axis_arrays = ({} if axis is None
+                           else dict(zip(key, axis)) if isinstance(key, tuple)
+                           else {key: axis})
+            columns = _axis_columns(axis)
+            emission = len(axis[1]) if isinstance(axis, tuple) else None
+
+            cursor.execute(f"""
+                SELECT sample_id, sample_name, internal_code, measurement_id,
+                       data
+                FROM {self.table_name}
+                WHERE {conditions}
+                ORDER BY measurement_id
+                """, params)
+            # Text output keeps the float64 formatting of the "df" output
+            dtype = np.float64 if output_format == "csv" else np.float32
+
+            def chunks():
+                while rows := cursor.fetchmany(chunksize):
+                    matrix = np.empty((len(rows), n_points), dtype=dtype)
+                    self._decode_into(matrix, [r[4] for r in rows],
+                                      [r[3] for r in rows])
+                    if preprocess is not None:
+                        matrix = _apply_pipeline(matrix, preprocess,
+                                                 fit=False,
+                                                 spectrum_length=emission)
+                    yield matrix, {"sample_id": [r[0] for r in rows],
+                                   "sample_name": [r[1] for r in rows],
+                                   "internal_code": [r[2] for r in rows]}
+
+            if output_format == "csv":
+                write_csv(path, chunks(), columns)
+            elif output_format == "npy":
+                write_npy(path, chunks(), (n_samples, n_points), axis_arrays)
+            elif output_format == "npz":
+                write_npz(path, chunks(), (n_samples, n_points), axis_arrays)
+            else:
+                write_arrow(path, chunks(), columns, axis_arrays,
+                            output_format)
+        return path
 
     @validate_dataframe
     def return_dataloader(self,
@@ -593,7 +2456,6 @@ class Database:
                 col_name="sample_id",
                 ordered=True
             )
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
 
         loaders = {
             "NMR": (NMRDataLoader, Path("dummy.txt")),
@@ -601,58 +2463,28 @@ class Database:
             "FTIR": (FTIRDataLoader, Path("dummy.spa")),
         }
 
-        dataloaders = []
+        # All axis definitions are resolved in one query and decoded once;
+        # loaders sharing a metadata_id share the same axis arrays.
+        signal_metadata = self._fetch_signal_metadata(
+            df.metadata_id.unique())
 
-        query = """
-            SELECT metadata
-            FROM signal_metadata
-            WHERE metadata_id = ?
-            """
-        for row in df.itertuples():
-<<<<<<< HEAD
+        dataloaders = []
+        for ins_type, sample_name, data, metadata_id in zip(
+                df.instrument_id, df.sample_name, df.data, df.metadata_id):
+            cls, dummyfile = loaders[ins_type]
             dummy_dl_ins = cls(dummyfile, _load_data_on_init=False)
-            dummy_dl_ins.data = json.loads(row.data)
-            dummy_dl_ins.metadata = {
-                "Sample name": row.sample_name,
-                "Signal Metadata": json.loads(row.signal_metadata),
+            metadata = {
+                "Sample name": sample_name,
+                "Signal Metadata": dict(signal_metadata[int(metadata_id)])
             }
-            dummy_objs.append(dummy_dl_ins)
-        return spectrum(dummy_objs)
-=======
-            ins_type = row.instrument_id
-
-            with self._get_cursor() as cursor:
-                cursor.execute(query, (int(row.metadata_id),))
-                signal_metadata = json.loads(cursor.fetchone()[0])
-
-            cls, dummyfile = loaders[ins_type]
             if ins_type in ["NMR", "FTIR"]:
-                dummy_dl_ins = cls(dummyfile,
-                                   _load_data_on_init=False)
-                dummy_dl_ins.data = json.loads(row.data)
-
-                with self._get_cursor() as cursor:
-                    cursor.execute(query, (int(row.metadata_id),))
-                    signal_metadata = json.loads(cursor.fetchone()[0])
-
-                dummy_dl_ins.metadata = {
-                    "Sample name": row.sample_name,
-                    "Signal Metadata": signal_metadata
-                }
-                dataloaders.append(dummy_dl_ins)
+                dummy_dl_ins.data = decode_data(data)
+                dummy_dl_ins.metadata = metadata
 
             elif ins_type in ["FL"]:
-                dummy_dl_ins = cls(dummyfile,
-                                   _load_data_on_init=False)
-                dummy_dl_ins.data['S1'] = json.loads(row.data)
-                with self._get_cursor() as cursor:
-                    cursor.execute(query, (int(row.metadata_id),))
-                    signal_metadata = json.loads(cursor.fetchone()[0])
-                dummy_dl_ins.metadata['S1'] = {
-                        "Sample name": row.sample_name,
-                        "Signal Metadata": signal_metadata
-                    }
-                dataloaders.append(dummy_dl_ins)
+                dummy_dl_ins.data['S1'] = decode_data(data)
+                dummy_dl_ins.metadata['S1'] = metadata
+            dataloaders.append(dummy_dl_ins)
 
         if len(dataloaders) == 1:
             return dataloaders[0]
@@ -663,8 +2495,27 @@ class Database:
                         sample_ids: str | List[str] = None,
                         table_name: str = None,
                         df: pd.DataFrame = None,
-                        fl_plot_type: Literal["1D", "2D"] = "2D"
+                        fl_plot_type: Literal["1D", "2D"] = "2D",
+                        max_points: int = None,
+                        downsample_method: Literal["minmax",
+                                                   "lttb"] = "minmax"
                         ) -> go.Figure:
+        """
+        Plots the spectra of the given samples.
+
+        Args:
+            sample_ids: Sample id(s) to plot.
+            table_name: Table to read from. Defaults to `table_name`.
+            df: Rows to plot instead of fetching `sample_ids`.
+            fl_plot_type: "1D" or "2D" plot for fluorescence data.
+            max_points: Point budget per FTIR/NMR trace. When set, traces
+                are downsampled with `downsample_method` and rendered with
+                WebGL; use `spectradb.utils.zoom_spectrum` with the loaders
+                from `return_dataloader` to re-render a zoomed range.
+            downsample_method: "minmax" or "lttb".
+        """
+        from spectradb.utils import spectrum
+
         dataloaders = self.return_dataloader(sample_ids=sample_ids,
                                              table_name=table_name,
                                              df=df)
@@ -676,7 +2527,9 @@ class Database:
 
         if isinstance(dataloaders[0],
                       (NMRDataLoader, FTIRDataLoader)):
-            return spectrum(dataloaders)
+            return spectrum(dataloaders,
+                            max_points=max_points,
+                            method=downsample_method)
         elif isinstance(dataloaders[0], FluorescenceDataLoader):
             objs = {f"obj{i}": obj for i, obj in enumerate(dataloaders,
                                                            start=1)}
@@ -686,7 +2539,6 @@ class Database:
                 objs,
                 identifier=ids,
                 plot_type=fl_plot_type)
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
 
 
 @dataclass(slots=True)
@@ -697,7 +2549,7 @@ class DummyClass:
     One class per row.
     """  # noqa: E501
 
-    data: list
+    data: np.ndarray
     metadata: dict
     instrument_id: str
     filepath: str
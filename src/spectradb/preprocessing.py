@@ -0,0 +1,270 @@
+"""
+Vectorized preprocessing of spectra.
+
+Every step works on a whole `(n_samples, n_points)` matrix at once, one
+spectrum per row, and writes its result back into the matrix. Steps are
+chained with `Pipeline`, which can be passed to `Database.fetch_matrix`,
+`Database.iter_samples` and `Database.transform_data_for_analysis` to run
+during the fetch.
+"""
+from abc import ABC, abstractmethod
+from copy import deepcopy
+from dataclasses import dataclass, field, fields
+from hashlib import sha1
+from math import factorial
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+
+@dataclass(slots=True)
+class PreprocessingStep(ABC):
+    """
+    Base class of the preprocessing steps.
+
+    `transform` modifies the matrix it is given in place (it must be a
+    writable floating point array) and returns it. Steps that learn from
+    the data (e.g. the MSC reference) do so in `fit`.
+    """
+
+    def fit(self, matrix: np.ndarray) -> "PreprocessingStep":
+        return self
+
+    @abstractmethod
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        pass
+
+    @property
+    def fitted(self) -> bool:
+        return True
+
+    @property
+    def spec(self) -> str:
+        """Text identifying the step and its parameters."""
+        params = ", ".join(f"{field.name}={getattr(self, field.name)!r}"
+                           for field in fields(self) if field.init)
+        return f"{type(self).__name__}({params})"
+
+
+@dataclass(slots=True)
+class SNV(PreprocessingStep):
+    """
+    Standard normal variate: centers every spectrum and scales it to unit
+    standard deviation.
+    """
+    ddof: int = 1
+
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        matrix -= matrix.mean(axis=1, keepdims=True)
+        std = matrix.std(axis=1, ddof=self.ddof, keepdims=True)
+        np.divide(matrix, std, out=matrix, where=std > 0)
+        return matrix
+
+
+@dataclass(slots=True)
+class MSC(PreprocessingStep):
+    """
+    Multiplicative scatter correction.
+
+    Every spectrum is regressed on the reference spectrum
+    (`x = a + b * reference`) and replaced by `(x - a) / b`. Without a
+    `reference`, the mean spectrum of the matrix given to `fit` is used.
+    """
+    reference: Optional[np.ndarray] = None
+    mean_spectrum: Optional[np.ndarray] = field(default=None, init=False,
+                                                repr=False)
+
+    def fit(self, matrix: np.ndarray) -> "MSC":
+        if self.reference is None:
+            self.mean_spectrum = matrix.mean(axis=0)
+        return self
+
+    @property
+    def fitted(self) -> bool:
+        return (self.reference is not None
+                or self.mean_spectrum is not None)
+
+    @property
+    def spec(self) -> str:
+        if self.reference is None:
+            return "MSC(reference=None)"
+        reference = np.ascontiguousarray(self.reference, dtype=np.float64)
+        return f"MSC(reference={sha1(reference.tobytes()).hexdigest()})"
+
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        if not self.fitted:
+            raise RuntimeError("MSC has no reference, call fit first or "
+                               "pass one.")
+        reference = np.asarray(self.reference if self.reference is not None
+                               else self.mean_spectrum, dtype=matrix.dtype)
+        if reference.shape != matrix.shape[1:]:
+            raise ValueError(f"The MSC reference has {reference.size} "
+                             f"points, got spectra of {matrix.shape[1]}.")
+        centered = reference - reference.mean()
+        slope = ((matrix @ centered) / (centered @ centered))[:, np.newaxis]
+        intercept = (matrix.mean(axis=1, keepdims=True)
+                     - slope * reference.mean())
+        matrix -= intercept
+        np.divide(matrix, slope, out=matrix, where=slope != 0)
+        return matrix
+
+
+@dataclass(slots=True)
+class SavitzkyGolay(PreprocessingStep):
+    """
+    Savitzky-Golay smoothing or derivative.
+
+    The filter is applied as one matrix product over sliding windows. At
+    the edges a polynomial is fitted to the first/last window, as in
+    `scipy.signal.savgol_filter` with `mode="interp"`.
+    """
+    window_length: int = 11
+    polyorder: int = 2
+    deriv: int = 0
+    delta: float = 1.0
+
+    def __post_init__(self):
+        if self.window_length % 2 == 0 or self.window_length < 1:
+            raise ValueError("window_length must be a positive odd number")
+        if not self.deriv <= self.polyorder < self.window_length:
+            raise ValueError("Savitzky-Golay requires "
+                             "deriv <= polyorder < window_length")
+
+    def _filters(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: `(window_length, window_length)` matrix whose row
+            `i` gives the filtered value at position `i` of a window.
+        """
+        half = self.window_length // 2
+        positions = np.arange(-half, half + 1, dtype=np.float64)
+        powers = np.arange(self.polyorder + 1)
+        fit = np.linalg.pinv(positions[:, np.newaxis] ** powers)
+        # d-th derivative of t**k evaluated at every position
+        scale = np.array([factorial(k) / factorial(k - self.deriv)
+                          if k >= self.deriv else 0.0 for k in powers])
+        derivative = scale * positions[:, np.newaxis] ** np.maximum(
+            powers - self.deriv, 0)
+        return derivative @ fit / self.delta ** self.deriv
+
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        n_points = matrix.shape[1]
+        if n_points < self.window_length:
+            raise ValueError(f"Spectra of {n_points} points are shorter "
+                             f"than the window ({self.window_length}).")
+        half = self.window_length // 2
+        filters = self._filters().astype(matrix.dtype)
+        windows = np.lib.stride_tricks.sliding_window_view(
+            matrix, self.window_length, axis=1)
+        left = matrix[:, :self.window_length] @ filters[:half].T
+        right = matrix[:, -self.window_length:] @ filters[half + 1:].T
+        matrix[:, half:n_points - half] = windows @ filters[half]
+        matrix[:, :half] = left
+        matrix[:, n_points - half:] = right
+        return matrix
+
+
+@dataclass(slots=True)
+class PolynomialBaseline(PreprocessingStep):
+    """
+    Baseline correction: subtracts the least-squares polynomial of
+    `degree` fitted to every spectrum.
+    """
+    degree: int = 1
+
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        # Positions scaled to [-1, 1] keep the Vandermonde matrix
+        # well conditioned
+        positions = np.linspace(-1, 1, matrix.shape[1])
+        vander = np.vander(positions, self.degree + 1)
+        projection = (np.linalg.pinv(vander).T @ vander.T).astype(
+            matrix.dtype)
+        matrix -= matrix @ projection
+        return matrix
+
+
+class Pipeline:
+    """
+    A sequence of preprocessing steps applied in order.
+
+    Example:
+        >>> pipeline = Pipeline(SNV(), SavitzkyGolay(15, 2, deriv=1))
+        >>> matrix = pipeline.fit_transform(matrix)
+    """
+
+    def __init__(self, *steps: PreprocessingStep):
+        for step in steps:
+            if not isinstance(step, PreprocessingStep):
+                raise TypeError(f"{step!r} is not a preprocessing step")
+        self.steps = list(steps)
+
+    def __repr__(self) -> str:
+        return f"Pipeline({', '.join(step.spec for step in self.steps)})"
+
+    @property
+    def spec(self) -> tuple:
+        """Identifies the pipeline, e.g. as part of a cache key."""
+        return tuple(step.spec for step in self.steps)
+
+    @property
+    def fitted(self) -> bool:
+        return all(step.fitted for step in self.steps)
+
+    def get_state(self) -> list:
+        """Copies of the parameters and fitted attributes of the steps."""
+        return [{field.name: deepcopy(getattr(step, field.name))
+                 for field in fields(step)} for step in self.steps]
+
+    def set_state(self, state: list) -> None:
+        """Restores the steps from `get_state` of an equal pipeline."""
+        for step, values in zip(self.steps, state, strict=True):
+            for name, value in values.items():
+                setattr(step, name, deepcopy(value))
+
+    def fit_transform(self,
+                      matrix: np.ndarray,
+                      copy: bool = False) -> np.ndarray:
+        """
+        Fits every step on the output of the previous one and transforms
+        the matrix, in place unless `copy` is set.
+        """
+        matrix = _as_float_matrix(matrix, copy)
+        for step in self.steps:
+            matrix = step.fit(matrix).transform(matrix)
+        return matrix
+
+    def transform(self,
+                  matrix: np.ndarray,
+                  copy: bool = False) -> np.ndarray:
+        """
+        Transforms the matrix with the already fitted steps, in place
+        unless `copy` is set.
+        """
+        if not self.fitted:
+            raise RuntimeError("The pipeline has unfitted steps, call "
+                               "fit_transform first.")
+        matrix = _as_float_matrix(matrix, copy)
+        for step in self.steps:
+            matrix = step.transform(matrix)
+        return matrix
+
+    def transform_chunks(
+            self, chunks: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """Transforms an iterable of matrices chunk by chunk, in place."""
+        for chunk in chunks:
+            yield self.transform(chunk)
+
+    __call__ = fit_transform
+
+
+def _as_float_matrix(matrix: np.ndarray, copy: bool) -> np.ndarray:
+    matrix = np.asarray(matrix)
+    if matrix.ndim != 2:
+        raise ValueError("Preprocessing expects a (n_samples, n_points) "
+                         "matrix.")
+    if (copy or not np.issubdtype(matrix.dtype, np.floating)
+            or not matrix.flags.writeable):
+        dtype = (matrix.dtype if np.issubdtype(matrix.dtype, np.floating)
+                 else np.float32)
+        matrix = matrix.astype(dtype)
+    return matrix
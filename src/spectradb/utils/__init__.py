@@ -1,12 +1,24 @@
-from .utils import spectrum
-<<<<<<< HEAD
-
-__all__ = ["spectrum"]
-=======
+from .downsampling import downsample
 from .decorators import validate_dataframe
+from .serialization import (decode_data, encode_data,
+                            decode_signal_metadata, encode_signal_metadata)
+
+
+def __getattr__(name):
+    # The plotting helpers pull in plotly, so they are imported on demand
+    if name in ("spectrum", "zoom_spectrum"):
+        from . import utils
+        return getattr(utils, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
     "spectrum",
-    "validate_dataframe"
+    "zoom_spectrum",
+    "downsample",
+    "validate_dataframe",
+    "decode_data",
+    "encode_data",
+    "decode_signal_metadata",
+    "encode_signal_metadata"
 ]
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
@@ -1,4 +1,5 @@
-import json
+import struct
+from .serialization import decode_data
 
 
 def validate_dataframe(method):
@@ -24,10 +25,10 @@ def validate_dataframe(method):
                 raise ValueError(f"Missing required columns:{missing_columns}")  # noqa E51
             # Validate data parsing
             try:
-                # Attempt to parse first row's data
-                json.loads(df.iloc[0].data)
-            except (json.JSONDecodeError, TypeError):
-                raise ValueError("Invalid JSON in data column")
+                # Attempt to parse first row's data (JSON or binary)
+                decode_data(df.iloc[0].data)
+            except (ValueError, TypeError, struct.error):
+                raise ValueError("Invalid data encoding in data column")
 
         return method(self, *args, **kwargs)
     return wrapper
@@ -0,0 +1,81 @@
+from typing import Literal, Tuple
+
+import numpy as np
+
+
+def _bucket_view(y: np.ndarray, n_buckets: int) -> Tuple[np.ndarray, int]:
+    """
+    Reshape `y` into `(n_buckets, size)`, padding the tail with its last
+    value so every bucket has the same size.
+    """
+    size = -(-len(y) // n_buckets)
+    padded = np.pad(y, (0, size * n_buckets - len(y)), mode="edge")
+    return padded.reshape(n_buckets, size), size
+
+
+def _minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of the minimum and maximum of every bucket."""
+    n_buckets = max(1, (max_points - 2) // 2)
+    buckets, size = _bucket_view(y, n_buckets)
+    offsets = np.arange(n_buckets) * size
+    indices = np.concatenate([offsets + buckets.argmin(axis=1),
+                              offsets + buckets.argmax(axis=1),
+                              [0, len(y) - 1]])
+    return np.unique(np.minimum(indices, len(y) - 1))
+
+
+def _lttb_indices(x: np.ndarray, y: np.ndarray,
+                  max_points: int) -> np.ndarray:
+    """
+    Indices picked by a vectorized variant of Largest-Triangle-Three-Buckets.
+
+    Classic LTTB anchors each triangle on the point selected in the
+    previous bucket, which is inherently sequential. Here both anchors are
+    the means of the neighbouring buckets, so all buckets are resolved in
+    one pass.
+    """
+    n_buckets = max(1, max_points - 2)
+    inner_x, inner_y = x[1:-1], y[1:-1]
+    bx, size = _bucket_view(inner_x, n_buckets)
+    by, _ = _bucket_view(inner_y, n_buckets)
+
+    mean_x = np.concatenate([[x[0]], bx.mean(axis=1), [x[-1]]])
+    mean_y = np.concatenate([[y[0]], by.mean(axis=1), [y[-1]]])
+    ax, ay = mean_x[:-2, None], mean_y[:-2, None]
+    cx, cy = mean_x[2:, None], mean_y[2:, None]
+    # Twice the triangle area; the constant factor does not change argmax
+    area = np.abs((ax - cx) * (by - ay) - (ax - bx) * (cy - ay))
+    picked = np.arange(n_buckets) * size + area.argmax(axis=1)
+    picked = np.minimum(picked, len(inner_y) - 1) + 1
+    return np.unique(np.concatenate([[0], picked, [len(y) - 1]]))
+
+
+def downsample(x, y, max_points: int,
+               method: Literal["minmax", "lttb"] = "minmax"
+               ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce a line to at most `max_points` points while keeping its shape.
+
+    Args:
+        x: Axis values.
+        y: Signal values, same length as `x`.
+        max_points: Point budget of the result.
+        method: "minmax" keeps the extrema of every bucket, so peaks are
+            never clipped; "lttb" keeps the point forming the largest
+            triangle with the neighbouring buckets, which follows the
+            visual shape more closely.
+
+    Returns:
+        tuple: `(x, y)` of the kept points, in their original order. Lines
+        within the budget are returned unchanged.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    if len(y) <= max_points or max_points < 3:
+        return x, y
+    if method == "minmax":
+        indices = _minmax_indices(y, max_points)
+    elif method == "lttb":
+        indices = _lttb_indices(x.astype(float), y.astype(float), max_points)
+    else:
+        raise ValueError("method can only be 'minmax' or 'lttb'")
+    return x[indices], y[indices]
@@ -0,0 +1,166 @@
+import json
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from spectradb.utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+# Chunks of an export: (matrix, labels) where labels maps "sample_id",
+# "sample_name" and "internal_code" to one value per matrix row.
+Chunk = Tuple[np.ndarray, Dict[str, list]]
+
+EXPORT_FORMATS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+    "npz": ".npz",
+    "npy": ".npy",
+}
+
+_LABELS = ("sample_id", "sample_name", "internal_code")
+
+
+def _label_array(values: list) -> np.ndarray:
+    """Text labels as a unicode array, loadable without pickle."""
+    return np.array(["" if v is None else str(v) for v in values], dtype=str)
+
+
+def _checked_rows(chunks: Iterable[Chunk], n_rows: int) -> Iterator[Chunk]:
+    """Passes the chunks through, checking that they hold `n_rows` rows."""
+    written = 0
+    for block, labels in chunks:
+        written += len(block)
+        if written > n_rows:
+            raise ValueError(f"The chunks hold more than the {n_rows} rows "
+                             "of the header.")
+        yield block, labels
+    if written != n_rows:
+        raise ValueError(f"The chunks hold {written} rows, the header has "
+                         f"{n_rows}.")
+
+
+def write_csv(path: Path, chunks: Iterable[Chunk], columns: list) -> None:
+    """Appends every chunk to a CSV file with `sample_name`,
+    `internal_code` and one column per axis point."""
+    header = True
+    with open(path, "w", newline="") as file:
+        for matrix, labels in chunks:
+            df = pd.DataFrame(matrix, columns=columns)
+            df.insert(0, "internal_code", labels["internal_code"])
+            df.insert(0, "sample_name", labels["sample_name"])
+            df.to_csv(file, index=False, header=header)
+            header = False
+        if header:
+            pd.DataFrame(columns=["sample_name", "internal_code",
+                                  *columns]).to_csv(file, index=False)
+
+
+def write_npy(path: Path, chunks: Iterable[Chunk], shape: tuple,
+              axis: Dict[str, np.ndarray]) -> Path:
+    """
+    Writes the matrix into a memory-mapped `.npy` file chunk by chunk, and
+    the axis and row labels into an `.axis.npz` sidecar.
+
+    Returns:
+        Path: The path of the sidecar.
+    """
+    sidecar = path.with_suffix(".axis.npz")
+    labels = {name: [] for name in _LABELS}
+    chunks = _checked_rows(chunks, shape[0])
+    try:
+        if shape[0] == 0:
+            np.save(path, np.empty(shape, dtype=np.float32))
+            for _ in chunks:
+                pass
+        else:
+            matrix = np.lib.format.open_memmap(path, mode="w+",
+                                               dtype=np.float32, shape=shape)
+            start = 0
+            for block, block_labels in chunks:
+                matrix[start:start + len(block)] = block
+                start += len(block)
+                for name in _LABELS:
+                    labels[name] += block_labels[name]
+            matrix.flush()
+            del matrix
+    except ValueError:
+        # The header no longer matches the data
+        path.unlink(missing_ok=True)
+        raise
+    np.savez(sidecar, **axis,
+             **{name: _label_array(values)
+                for name, values in labels.items()})
+    return sidecar
+
+
+def write_npz(path: Path, chunks: Iterable[Chunk], shape: tuple,
+              axis: Dict[str, np.ndarray]) -> None:
+    """
+    Writes an `.npz` archive with the matrix under `data`, the axis arrays
+    and the row labels. The `data` member is streamed into the archive
+    chunk by chunk, so the matrix is never held in memory.
+    """
+    labels = {name: [] for name in _LABELS}
+    with zipfile.ZipFile(path, "w", allowZip64=True) as archive:
+        try:
+            with archive.open("data.npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array_header_2_0(member, {
+                    "descr": np.lib.format.dtype_to_descr(np.dtype("<f4")),
+                    "fortran_order": False,
+                    "shape": shape,
+                })
+                for block, block_labels in _checked_rows(chunks, shape[0]):
+                    member.write(
+                        np.ascontiguousarray(block, "<f4").tobytes())
+                    for name in _LABELS:
+                        labels[name] += block_labels[name]
+        except ValueError:
+            archive.close()
+            path.unlink(missing_ok=True)
+            raise
+
+        arrays = {**axis, **{name: _label_array(values)
+                             for name, values in labels.items()}}
+        for name, array in arrays.items():
+            with archive.open(f"{name}.npy", "w") as member:
+                np.lib.format.write_array(member, np.asarray(array),
+                                          allow_pickle=False)
+
+
+def write_arrow(path: Path, chunks: Iterable[Chunk], columns: List[str],
+                axis: Dict[str, np.ndarray],
+                file_format: str = "parquet") -> None:
+    """
+    Writes a Parquet or Arrow IPC file with `sample_name`, `internal_code`
+    and one float32 column per axis point, one row group (record batch) per
+    chunk. The axis is stored in the schema metadata under
+    `spectradb.axis`.
+    """
+    try:
+        import pyarrow as pa
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(f"pyarrow is required for the '{file_format}' "
+                          "format. Use 'npz' or 'npy' instead.")
+
+    schema = pa.schema(
+        [pa.field("sample_name", pa.string()),
+         pa.field("internal_code", pa.string())]
+        + [pa.field(str(column), pa.float32()) for column in columns],
+        metadata={"spectradb.axis": json.dumps(
+            {name: np.asarray(values).tolist()
+             for name, values in axis.items()})})
+    writer = (pq.ParquetWriter(path, schema) if file_format == "parquet"
+              else pa.ipc.new_file(path, schema))
+    with writer:
+        for block, labels in chunks:
+            block = np.asfortranarray(block, dtype=np.float32)
+            arrays = [pa.array(labels["sample_name"], pa.string()),
+                      pa.array(labels["internal_code"], pa.string())]
+            arrays += [pa.array(block[:, j]) for j in range(block.shape[1])]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
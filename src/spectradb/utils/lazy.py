@@ -0,0 +1,30 @@
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access.
+
+    Lets heavy dependencies (pandas, plotly) be bound at module level, as
+    `pd = lazy_import("pandas")`, without paying their import time until
+    they are actually used. Modules using it need
+    `from __future__ import annotations` so that annotations such as
+    `pd.DataFrame` are not evaluated at import.
+    """
+
+    __slots__ = ("_name",)
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        # import_module is a sys.modules lookup once the module is loaded
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}'>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Returns a `LazyModule` for the module `name`."""
+    return LazyModule(name)
@@ -0,0 +1,118 @@
+import json
+import struct
+from typing import Union
+
+import numpy as np
+
+# Every binary spectrum starts with this header:
+#   magic (4 bytes) | dtype code (2 bytes) | ndim (uint8) | shape (uint32 * ndim)
+# followed by the raw little-endian array buffer.
+_MAGIC = b"SDB\x01"
+_HEADER = struct.Struct("<4s2sB")
+_DTYPES = {
+    b"f4": np.dtype("<f4"),
+    b"f8": np.dtype("<f8"),
+}
+_DTYPE_CODES = {dtype: code for code, dtype in _DTYPES.items()}
+
+
+def encode_array(data, dtype: np.dtype = np.float32) -> bytes:
+    """
+    Serialize spectral data into a self-describing binary blob.
+
+    Args:
+        data: Array-like spectral data (1D spectrum or 2D EEM).
+        dtype: Floating point type used for storage. Defaults to float32.
+
+    Returns:
+        bytes: Header (dtype and shape) followed by the raw little-endian
+        array buffer.
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported storage dtype: {dtype}")
+    array = np.ascontiguousarray(data, dtype=dtype)
+    header = _HEADER.pack(_MAGIC, _DTYPE_CODES[dtype], array.ndim)
+    shape = struct.pack(f"<{array.ndim}I", *array.shape)
+    return header + shape + array.tobytes()
+
+
+def decode_array(blob: Union[bytes, memoryview]) -> np.ndarray:
+    """
+    Deserialize a blob created by `encode_array`.
+
+    The returned array is a read-only view on the blob (no copy is made).
+
+    Args:
+        blob: Binary blob as returned by sqlite.
+
+    Returns:
+        np.ndarray: The decoded array with its original shape.
+    """
+    magic, code, ndim = _HEADER.unpack_from(blob)
+    if magic != _MAGIC or code not in _DTYPES:
+        raise ValueError("Invalid binary spectrum header.")
+    shape = struct.unpack_from(f"<{ndim}I", blob, _HEADER.size)
+    return np.frombuffer(blob,
+                         dtype=_DTYPES[code],
+                         offset=_HEADER.size + 4 * ndim).reshape(shape)
+
+
+def is_binary(value) -> bool:
+    """Check whether a stored `data` value uses the binary format."""
+    return (isinstance(value, (bytes, memoryview))
+            and bytes(value[:len(_MAGIC)]) == _MAGIC)
+
+
+def decode_data(value: Union[str, bytes]) -> np.ndarray:
+    """
+    Decode a value of the `data` column regardless of its storage format.
+
+    JSON text is parsed with `json.loads` while binary blobs are decoded
+    with `np.frombuffer`, so tables holding both formats can be read
+    transparently. Both return a float32 `np.ndarray`. Arrays (spectra
+    read from the shard store) are returned as they are.
+    """
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, (bytes, memoryview)):
+        return decode_array(value)
+    return np.asarray(json.loads(value), dtype=np.float32)
+
+
+def encode_data(data, storage_format: str = "json") -> Union[str, bytes]:
+    """
+    Encode spectral data for the `data` column.
+
+    Args:
+        data: Array-like spectral data.
+        storage_format: Either "json" (text) or "binary" (float32 blob).
+    """
+    if storage_format == "binary":
+        return encode_array(data)
+    elif storage_format == "json":
+        if isinstance(data, np.ndarray):
+            data = data.tolist()
+        return json.dumps(data)
+    raise ValueError("storage_format can only be 'json' or 'binary'")
+
+
+def encode_signal_metadata(signal_metadata: dict) -> str:
+    """
+    Serialize signal metadata (axis definitions) to JSON text.
+
+    Array axes are converted to lists here, at the database edge, so that
+    equal axes always produce the same text and deduplicate in the
+    `signal_metadata` table.
+    """
+    return json.dumps({key: value.tolist() if isinstance(value, np.ndarray)
+                       else value
+                       for key, value in signal_metadata.items()})
+
+
+def decode_signal_metadata(text: str) -> dict:
+    """
+    Parse signal metadata JSON text, returning every axis as `np.ndarray`.
+    """
+    return {key: np.asarray(value) if isinstance(value, list) else value
+            for key, value in json.loads(text).items()}
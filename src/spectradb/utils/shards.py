@@ -0,0 +1,87 @@
+import struct
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+# Shards are .npy files (format 1.0) with a header padded to a fixed size,
+# so the row count can be rewritten in place as rows are appended and the
+# data always starts at the same offset.
+SHARD_HEADER_SIZE = 128
+_MAGIC = b"\x93NUMPY\x01\x00"
+_COPY_BLOCK = 1 << 24
+
+
+def _shard_header(n_rows: int, n_points: int) -> bytes:
+    header = ("{'descr': '<f4', 'fortran_order': False, "
+              f"'shape': ({n_rows}, {n_points}), }}")
+    padding = SHARD_HEADER_SIZE - len(_MAGIC) - 2 - len(header) - 1
+    return (_MAGIC + struct.pack("<H", len(header) + padding + 1)
+            + header.encode("latin1") + b" " * padding + b"\n")
+
+
+def append_shard_rows(path: Path, n_rows: int, block: np.ndarray) -> None:
+    """
+    Append rows to a shard, creating it if needed.
+
+    Anything stored beyond the first `n_rows` rows (left behind by a
+    transaction that was rolled back) is discarded first.
+
+    Args:
+        path: Path of the shard.
+        n_rows: Number of committed rows of the shard.
+        block: `(k, n_points)` array of the rows to append.
+    """
+    block = np.ascontiguousarray(block, dtype="<f4")
+    n_points = block.shape[1]
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(_shard_header(0, n_points))
+    with open(path, "r+b") as file:
+        file.truncate(SHARD_HEADER_SIZE + 4 * n_rows * n_points)
+        file.seek(0, 2)
+        file.write(block.tobytes())
+        file.seek(0)
+        file.write(_shard_header(n_rows + len(block), n_points))
+
+
+def open_shard(path: Path, n_rows: int, n_points: int) -> np.ndarray:
+    """
+    Memory-map the first `n_rows` rows of a shard (read-only).
+    """
+    if n_rows == 0:
+        return np.empty((0, n_points), dtype="<f4")
+    return np.memmap(path, dtype="<f4", mode="r",
+                     offset=SHARD_HEADER_SIZE, shape=(n_rows, n_points))
+
+
+def write_shard(path: Path, blocks: Iterable[np.ndarray], n_rows: int,
+                n_points: int) -> None:
+    """
+    Write a new shard of `n_rows` rows from `(k, n_points)` blocks.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(_shard_header(n_rows, n_points))
+        for block in blocks:
+            file.write(np.ascontiguousarray(block, dtype="<f4").tobytes())
+
+
+def copy_shard(source: Path, target: Path, n_rows: int,
+               n_points: int) -> None:
+    """
+    Copy the first `n_rows` rows of a shard, e.g. to match the row count
+    of a database snapshot.
+    """
+    remaining = 4 * n_rows * n_points
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        dst.write(_shard_header(n_rows, n_points))
+        src.seek(SHARD_HEADER_SIZE)
+        while remaining:
+            chunk = src.read(min(remaining, _COPY_BLOCK))
+            if not chunk:
+                raise ValueError(f"Shard {source} is shorter than its "
+                                 f"{n_rows} registered rows.")
+            dst.write(chunk)
+            remaining -= len(chunk)
@@ -0,0 +1,114 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+SIMILARITY_METRICS = ("cosine", "correlation")
+# Number of query spectra scored per matrix product
+_QUERY_BATCH = 256
+
+
+def _scored_matrix(matrix: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Copy of the spectra whose normalized dot products give the metric:
+    the spectra themselves for "cosine", the row-centered spectra for
+    "correlation".
+    """
+    if metric not in SIMILARITY_METRICS:
+        raise ValueError(f"metric can only be one of {SIMILARITY_METRICS}")
+    vectors = np.array(matrix, dtype=np.float32, ndmin=2)
+    if metric == "correlation":
+        vectors -= vectors.mean(axis=1, keepdims=True)
+    return vectors
+
+
+def fit_pca(matrix: np.ndarray,
+            n_components: int,
+            metric: str = "cosine") -> np.ndarray:
+    """
+    Fit a PCA projection with a thin SVD.
+
+    The SVD is computed on the vectors that are scored (row-centered for
+    "correlation") without subtracting the column mean, so projecting on
+    all the components preserves dot products exactly and truncating only
+    drops the directions of least energy.
+
+    Args:
+        matrix: `(n_samples, n_points)` training spectra.
+        n_components: Number of principal components kept.
+        metric: "cosine" or "correlation".
+
+    Returns:
+        np.ndarray: `(n_components, n_points)` float32 basis.
+    """
+    if not 0 < n_components <= min(matrix.shape):
+        raise ValueError(f"n_components must be between 1 and "
+                         f"{min(matrix.shape)}, got {n_components}")
+    _, _, vt = np.linalg.svd(
+        _scored_matrix(matrix, metric).astype(np.float64),
+        full_matrices=False)
+    return vt[:n_components].astype(np.float32)
+
+
+def similarity_vectors(matrix: np.ndarray,
+                       metric: str = "cosine",
+                       components: Optional[np.ndarray] = None
+                       ) -> np.ndarray:
+    """
+    Turn spectra into unit-length float32 vectors.
+
+    The dot product of two vectors is then the cosine similarity of the
+    spectra, or their Pearson correlation for "correlation" (rows are
+    mean-centered first). With `components` (see `fit_pca`) the vectors
+    are projected on the PCA basis before normalization.
+
+    Args:
+        matrix: `(n_samples, n_points)` spectra.
+        metric: "cosine" or "correlation".
+        components: `(n_components, n_points)` PCA basis.
+
+    Returns:
+        np.ndarray: `(n_samples, n_features)` float32 vectors; spectra of
+        zero norm are left as zero vectors.
+    """
+    vectors = _scored_matrix(matrix, metric)
+    if components is not None:
+        vectors = vectors @ components.T
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def top_k(index: np.ndarray,
+          queries: np.ndarray,
+          k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the `k` best scoring rows of `index` for each query.
+
+    Queries are scored in batches with one matrix product each, and only
+    the `k` best scores per query are sorted.
+
+    Args:
+        index: `(n_samples, n_features)` unit vectors.
+        queries: `(n_queries, n_features)` unit vectors.
+        k: Number of neighbours per query (capped at `n_samples`).
+
+    Returns:
+        tuple: `(indices, scores)`, both `(n_queries, k)`, best first.
+    """
+    k = min(k, len(index))
+    indices = np.empty((len(queries), k), dtype=np.intp)
+    scores = np.empty((len(queries), k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+    for start in range(0, len(queries), _QUERY_BATCH):
+        batch = queries[start:start + _QUERY_BATCH] @ index.T
+        best = (np.argpartition(-batch, k - 1, axis=1)[:, :k]
+                if k < len(index) else
+                np.broadcast_to(np.arange(k), batch.shape))
+        best_scores = np.take_along_axis(batch, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        indices[start:start + len(batch)] = np.take_along_axis(
+            best, order, axis=1)
+        scores[start:start + len(batch)] = np.take_along_axis(
+            best_scores, order, axis=1)
+    return indices, scores
@@ -4,10 +4,12 @@ from spectradb.dataloaders import (
     NMRDataLoader,
 )  # noqa: E501
 import plotly.graph_objects as go
+import plotly.io as pio
 from typing import Union, Literal, Iterable, Dict, List, overload
 import plotly_express as px
-import pandas as pd
 from functools import singledispatch
+import numpy as np
+from spectradb.utils.downsampling import downsample
 
 
 @singledispatch
@@ -22,6 +24,11 @@ def spectrum(obj, **kwargs):
     Keyword Arguments:
     - identifier: (Optional) A string or list of strings
     - plot_type: (Optional) Type of plot either "1D" or "2D" (default is "1D").
+    - max_points: (Optional, FTIR/NMR) Point budget per trace. When set, the
+      traces are downsampled and rendered with WebGL (`go.Scattergl`);
+      see `zoom_spectrum` to re-render a zoomed range at full detail.
+    - method: (Optional, FTIR/NMR) Downsampling method, "minmax" (default)
+      or "lttb".
 
     Raises:
     TypeError: If the object type is unsupported or incorrectly passed.
@@ -35,13 +42,17 @@ def spectrum(obj, **kwargs):
 
 
 @spectrum.register
-def _(obj: FTIRDataLoader) -> go.Figure:
-    return _plot_spectrum_NMR_FTIR(obj)
+def _(obj: FTIRDataLoader, *,
+      max_points: int = None,
+      method: Literal["minmax", "lttb"] = "minmax") -> go.Figure:
+    return _plot_spectrum_NMR_FTIR(obj, max_points, method)
 
 
 @spectrum.register
-def _(obj: NMRDataLoader) -> go.Figure:
-    return _plot_spectrum_NMR_FTIR(obj)
+def _(obj: NMRDataLoader, *,
+      max_points: int = None,
+      method: Literal["minmax", "lttb"] = "minmax") -> go.Figure:
+    return _plot_spectrum_NMR_FTIR(obj, max_points, method)
 
 
 @overload
@@ -50,9 +61,11 @@ def _(obj: tuple):
 
 
 @spectrum.register
-def _(obj: list) -> go.Figure:
+def _(obj: list, *,
+      max_points: int = None,
+      method: Literal["minmax", "lttb"] = "minmax") -> go.Figure:
     if all(isinstance(o, (FTIRDataLoader, NMRDataLoader)) for o in obj):
-        return _plot_spectrum_NMR_FTIR(obj)
+        return _plot_spectrum_NMR_FTIR(obj, max_points, method)
     raise TypeError("Unsupported iterable type")
 
 
@@ -77,31 +90,15 @@ def _(obj: dict, *,
 
 
 def _plot_fluorescence_spectrum(
-<<<<<<< HEAD
-    obj: FluorescenceDataLoader, identifier: str, plot_type: Literal["1D", "2D"]
-) -> go.Figure:
-    """
-    Plot fluorescence spectrum using either 1D or 2D representation.
-=======
         obj: FluorescenceDataLoader | Dict[str, FluorescenceDataLoader],
         identifier: str | List[str] | Dict[str, List[str]] | Dict[str, str],
         plot_type: str) -> go.Figure | List[go.Figure]:
     if plot_type not in ["1D", "2D"]:
         raise ValueError("Type of plot can only be 1D or 2D")
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
 
     if not isinstance(obj, dict):
         obj = {"obj1": obj}
 
-<<<<<<< HEAD
-    Returns:
-        go.Figure: A plotly figure object.
-    """  # noqa: E501
-    # fetching the data from the object
-    data = obj.data[identifier]
-    em = obj.metadata[identifier]["Signal Metadata"]["Emission"]
-    ex = obj.metadata[identifier]["Signal Metadata"]["Excitation"]
-=======
     if isinstance(identifier, (str, list)):
         identifier = {"obj1": [identifier] if isinstance(identifier, str)
                       else identifier}
@@ -124,64 +121,19 @@ def _plot_fluorescence_spectrum(
             ex = dataloader.metadata[id_]['Signal Metadata']['Excitation']  # noqa E501
             name = dataloader.metadata[id_]['Sample name']
             plot_data.append((data, em, ex, name))
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
 
     if plot_type == "1D":
-<<<<<<< HEAD
-        df = (
-            pd.DataFrame(data, columns=em)
-            .assign(Excitation=ex)
-            .melt(id_vars=["Excitation"], value_name="Intensity", var_name="Emission")
-        )
-        fig = px.line(df, x="Emission", y="Intensity", line_group="Excitation")
-        fig.update_traces(line=dict(width=1.2, color="rgb(49,130,189)"))
-=======
-        combined_df = pd.concat([(pd.DataFrame(data, columns=em)
-                                  .assign(Excitation=ex, Identifier=name)
-                                  .melt(id_vars=['Excitation', 'Identifier'],
-                                        value_name='Intensity',
-                                        var_name='Emission'))
-                                for data, em, ex, name in plot_data],
-                                ignore_index=True)
-        single_identifier = (combined_df['Identifier'].nunique() == 1)
-        fig = px.line(
-            combined_df,
-            x="Emission",
-            y="Intensity",
-            line_group="Excitation",
-            **({"color": "Identifier"} if not single_identifier else {})
-        )
-        fig.update_traces(line=dict(width=1.5))
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
-        return fig
+        return _excitation_lines_figure(plot_data)
 
     elif plot_type == "2D":
-<<<<<<< HEAD
-        fig = go.Figure()
-        fig.add_trace(
-            go.Contour(
-=======
         figures = []
         for data, em, ex, name in plot_data:
             fig = go.Figure()
             fig.add_trace(go.Contour(
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
                 z=data,
                 x=em,
                 y=ex,
                 colorscale="Cividis",
-<<<<<<< HEAD
-                colorbar=dict(title="Intensity"),
-            )
-        )
-
-        fig.update_xaxes(nticks=10, title_text="Emission")
-        fig.update_yaxes(nticks=10, title_text="Excitation")
-        fig.update_layout(height=500, width=600)
-        return fig
-    else:
-        raise TypeError("Type of plot can only be 1D or 2D.")
-=======
                 colorbar=dict(title="Intensity")
             ))
             fig.update_xaxes(nticks=10, title_text='Emission')
@@ -195,13 +147,75 @@ def _plot_fluorescence_spectrum(
         if len(figures) == 1:
             return figures[0]
         return figures
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
+
+
+def _axis_labels(obj: Union[FTIRDataLoader, NMRDataLoader]) -> tuple:
+    """Returns the x (signal metadata key) and y labels of a loader."""
+    if isinstance(obj, FTIRDataLoader):
+        return "Wavenumbers", "Transmittance"
+    elif isinstance(obj, NMRDataLoader):
+        return "ppm", "Intensity"
+    raise TypeError(
+        "The object shuold be an instance of `FTIRDataLoader` or `NMRDataLoader`."
+    )  # noqa E501
+
+
+def _excitation_lines_figure(plot_data: list) -> go.Figure:
+    """
+    Build the 1D fluorescence plot: one line per excitation wavelength.
+
+    The traces are emitted straight from the rows of every EEM array, with
+    the same styling `px.line(..., line_group="Excitation",
+    color="Identifier")` would give, but without building and regrouping a
+    long-format DataFrame.
+
+    Args:
+        plot_data: `(data, emission, excitation, name)` per EEM.
+    """
+    names = list(dict.fromkeys(name for *_, name in plot_data))
+    single_identifier = len(names) == 1
+    # Colours of the active template, as plotly express would pick them
+    colorway = (pio.templates[pio.templates.default].layout.colorway
+                or px.colors.qualitative.Plotly)
+    colors = {name: colorway[i % len(colorway)]
+              for i, name in enumerate(names)}
+
+    traces = []
+    for data, em, ex, name in plot_data:
+        data = np.asarray(data)
+        label = "" if single_identifier else name
+        hover_prefix = "" if single_identifier else f"Identifier={name}<br>"
+        for i, excitation in enumerate(ex):
+            traces.append(go.Scatter(
+                x=em,
+                y=data[i],
+                mode="lines",
+                name=label,
+                legendgroup=label,
+                showlegend=not single_identifier and i == 0,
+                line=dict(color=colors[name], dash="solid", width=1.5),
+                hovertemplate=(f"{hover_prefix}Excitation={excitation}<br>"
+                               "Emission=%{x}<br>"
+                               "Intensity=%{y}<extra></extra>"),
+            ))
+    fig = go.Figure(data=traces)
+    fig.update_layout(
+        legend=dict(tracegroupgap=0,
+                    **({} if single_identifier
+                       else {"title": {"text": "Identifier"}})),
+        margin=dict(t=60),
+        xaxis_title_text="Emission",
+        yaxis_title_text="Intensity",
+    )
+    return fig
 
 
 def _plot_spectrum_NMR_FTIR(
     obj: Union[
         FTIRDataLoader, NMRDataLoader, Iterable[FTIRDataLoader], Iterable[NMRDataLoader]
-    ]
+    ],
+    max_points: int = None,
+    method: Literal["minmax", "lttb"] = "minmax"
 ) -> go.Figure:
     """
     Create a spectral plot from FTIR or NMR data.
@@ -209,6 +223,9 @@ def _plot_spectrum_NMR_FTIR(
     Args:
         obj (Union[FTIRDataLoader, NMRDataLoader]): Data loader object
         with spectral data.
+        max_points: Point budget per trace. When set, every trace is
+        downsampled with `method` and drawn with `go.Scattergl`.
+        method: Downsampling method, "minmax" or "lttb".
 
     Returns:
         go.Figure: Plotly figure with the spectral plot.
@@ -219,16 +236,8 @@ def _plot_spectrum_NMR_FTIR(
     # Checking types of objects and updating the plot labels
     if isinstance(obj, (FTIRDataLoader, NMRDataLoader)):
         obj = [obj]
-    if isinstance(obj[0], FTIRDataLoader):
-        x_label = "Wavenumbers"
-        y_label = "Transmittance"
-    elif isinstance(obj[0], NMRDataLoader):
-        x_label = "ppm"
-        y_label = "Intensity"
-    else:
-        raise TypeError(
-            "The object shuold be an instance of `FTIRDataLoader` or `NMRDataLoader`."
-        )  # noqa E501
+    x_label, y_label = _axis_labels(obj[0])
+    trace_type = go.Scatter if max_points is None else go.Scattergl
 
     # Creating a figure
     fig = go.Figure()
@@ -239,10 +248,13 @@ def _plot_spectrum_NMR_FTIR(
         # is provided in the original file
         if i == 0:
             reverse_x = x_data[1] < x_data[0]
+        y_data = object.data
+        if max_points is not None:
+            x_data, y_data = downsample(x_data, y_data, max_points, method)
         fig.add_trace(
-            go.Scatter(
+            trace_type(
                 x=x_data,
-                y=object.data,
+                y=y_data,
                 mode="lines",
                 name=(
                     object.metadata["Sample name"]
@@ -257,102 +269,6 @@ def _plot_spectrum_NMR_FTIR(
     if reverse_x:
         fig.update_layout(xaxis_autorange="reversed")
 
-<<<<<<< HEAD
-    # updating the figure
-    fig.update_layout(height=500, width=600, plot_bgcolor="white", showlegend=True)
-    for axis in ["xaxis", "yaxis"]:
-        fig.update_layout(
-            {
-                axis: dict(
-                    mirror=True,
-                    title=x_label if axis == "xaxis" else y_label,
-                    ticks="outside",
-                    showline=True,
-                    linecolor="black",
-                    showgrid=False,
-                    nticks=10 if axis == "xaxis" else 5,
-                )
-            }
-        )
-    return fig
-
-
-@overload
-def spectrum(
-    obj: Union[
-        FTIRDataLoader, NMRDataLoader, Iterable[FTIRDataLoader], Iterable[NMRDataLoader]
-    ]
-) -> go.Figure: ...
-
-
-@overload
-def spectrum(
-    obj: FluorescenceDataLoader, identifier: str, plot_type: Literal["1D", "2D"]
-) -> go.Figure: ...
-
-
-def spectrum(
-    obj: Union[
-        FTIRDataLoader,
-        NMRDataLoader,
-        FluorescenceDataLoader,
-        Iterable[FTIRDataLoader],
-        Iterable[NMRDataLoader],
-    ],
-    identifier: Optional[str] = None,
-    plot_type: Optional[str] = None,
-) -> go.Figure:
-    """
-    Create a spectral plot from FTIR, NMR, or Fluorescence data.
-
-    Args:
-        obj: The data loader object. Can be FTIRDataLoader, NMRDataLoader, or FluorescenceDataLoader.
-        identifier (str, optional): The identifier for the sample (only required for FluorescenceDataLoader).
-        plot_type (str, optional): The type of plot to generate ("1D" or "2D", only required for FluorescenceDataLoader).
-
-    Returns:
-        go.Figure: A plotly figure object.
-
-    Raises:
-        TypeError: If the object type is unsupported.
-        ValueError: If identifier or plot_type is missing for FluorescenceDataLoader.
-    """  # noqa: E501
-    # Checking if the provided object is an iterable or an element
-    if not isinstance(obj, abc.Iterable):
-        obj = [obj]
-
-    # if it's an iterable we need to make sure they are of same type
-    # Also need to make sure the user accidentally doesn't pass
-    # mutliple Fluorescence objects. It's clear from the
-    # function's type hints but just to make sure its robust.
-    else:
-        if not all(isinstance(object, type(obj[0])) for object in obj):
-            raise TypeError(
-                "Objects should all be of the same type "
-                "(either FTIRDataLoader or NMRDataLoader)"
-            )
-        elif isinstance(obj[0], FluorescenceDataLoader) and len(obj) > 1:
-            raise TypeError(
-                "Multiple FluorescencenDataLoader objects " "not supported."
-            )
-
-    # if the object is of type FTIR or NMR
-    if isinstance(obj[0], (FTIRDataLoader, NMRDataLoader)):
-        return _plot_spectrum_NMR_FTIR(obj)
-
-    # If the object is of type Fluorescence
-    elif isinstance(obj[0], FluorescenceDataLoader):
-        if not identifier or not plot_type:
-            raise ValueError(
-                "Identifier or plot_type must be provided "
-                "for FluorescenceDataLoader object."
-            )
-        return _plot_fluorescence_spectrum(obj[0], identifier, plot_type)
-
-    # Raising an error if its none of above
-    else:
-        raise TypeError(f"Unsupported object type: {type(obj[0])}")
-=======
 # Update all traces with the same hover template
     for trace in fig.data:
         trace.hovertemplate = 'Name: %{data.name}<br>' + \
@@ -376,4 +292,48 @@ def spectrum(
                 nticks=10 if axis == 'xaxis' else 5
             )})
     return fig
->>>>>>> a64c8437b8c6743b1f6032e236cc0d4e99dbc3ac
+
+
+def zoom_spectrum(
+    fig: go.Figure,
+    obj: Union[
+        FTIRDataLoader, NMRDataLoader, Iterable[FTIRDataLoader], Iterable[NMRDataLoader]
+    ],
+    x_range: tuple = None,
+    max_points: int = 5000,
+    method: Literal["minmax", "lttb"] = "minmax"
+) -> go.Figure:
+    """
+    Re-render the traces of a downsampled FTIR/NMR figure for an x range.
+
+    The traces are rebuilt from the full data of the loaders the figure was
+    created from, restricted to `x_range` and downsampled to `max_points`,
+    so zooming in reveals the full detail. With a `go.FigureWidget` it can
+    be hooked to the axis range, e.g.
+    `fig.layout.on_change(lambda _, r: zoom_spectrum(fig, obj, r),
+    "xaxis.range")`.
+
+    Args:
+        fig: Figure created by `spectrum` from `obj`.
+        obj: The data loader(s) the figure was created from, in order.
+        x_range: `(start, end)` in axis units, in any order. None restores
+            the whole range.
+        max_points: Point budget per trace.
+        method: Downsampling method, "minmax" or "lttb".
+
+    Returns:
+        go.Figure: `fig`, updated in place.
+    """
+    if isinstance(obj, (FTIRDataLoader, NMRDataLoader)):
+        obj = [obj]
+    x_label, _ = _axis_labels(obj[0])
+    with fig.batch_update():
+        for trace, object in zip(fig.data, obj):
+            x_data = np.asarray(object.metadata["Signal Metadata"][x_label])
+            y_data = np.asarray(object.data)
+            if x_range is not None:
+                low, high = sorted(x_range)
+                mask = (x_data >= low) & (x_data <= high)
+                x_data, y_data = x_data[mask], y_data[mask]
+            trace.x, trace.y = downsample(x_data, y_data, max_points, method)
+    return fig
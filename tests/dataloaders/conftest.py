@@ -1,4 +1,5 @@
 import pytest
+import struct
 from pathlib import Path
 
 path = Path(__file__).parent
@@ -34,4 +35,13 @@ def edge_case_csv_file(tmp_path_factory):
 
 @pytest.fixture(scope="session")
 def spa_file(tmp_path_factory):
-    pass
+    # Minimal .spa layout: number of points at 564, max/min wavenumbers
+    # at 576 and a directory at 288 whose key 3 points to the intensities.
+    content = bytearray(1024)
+    struct.pack_into("<i", content, 564, 4)
+    struct.pack_into("<2f", content, 576, 4000.0, 1000.0)
+    struct.pack_into("<4H", content, 288, 1, 0, 3, 900)
+    struct.pack_into("<4f", content, 900, 0.1, 0.2, 0.3, 0.4)
+    file = tmp_path_factory.mktemp("data")/"example.spa"
+    file.write_bytes(bytes(content))
+    return file
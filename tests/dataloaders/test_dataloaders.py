@@ -1,4 +1,6 @@
-from spectradb.dataloaders import FluorescenceDataLoader, NMRDataLoader
+from spectradb.dataloaders import (FluorescenceDataLoader, NMRDataLoader,
+                                   FTIRDataLoader)
+from spectradb.dataloaders.parsers import read_spa, read_cary_eclipse_csv
 from datetime import datetime
 import os
 from numpy.testing import assert_array_almost_equal, assert_equal
@@ -6,6 +8,15 @@ import pytest
 import numpy as np
 
 
+def _as_lists(metadata):
+    # Loaders keep their axes as arrays; compare them as plain lists.
+    signal_metadata = metadata["Signal Metadata"]
+    assert all(isinstance(axis, np.ndarray)
+               for axis in signal_metadata.values())
+    return metadata | {"Signal Metadata": {key: axis.tolist() for key, axis
+                                           in signal_metadata.items()}}
+
+
 class TestNMRDataLoader:
     @pytest.fixture(autouse=True)
     def setup(self, txt_file, wrong_format):
@@ -17,7 +28,8 @@ class TestNMRDataLoader:
         assert self.dataloader.filepath == self.txt_file
 
     def test_NMR_data(self):
-        assert self.dataloader.data == [5000.0, 5500.0]
+        assert isinstance(self.dataloader.data, np.ndarray)
+        assert_array_almost_equal(self.dataloader.data, [5000.0, 5500.0])
 
     def test_NMR_metadata(self):
         assert_array_almost_equal(
@@ -52,7 +64,8 @@ class TestFTIRDataLoader:
         assert self.dataloader.filepath == self.txt_file
 
     def test_NMR_data(self):
-        assert self.dataloader.data == [5000.0, 5500.0]
+        assert isinstance(self.dataloader.data, np.ndarray)
+        assert_array_almost_equal(self.dataloader.data, [5000.0, 5500.0])
 
     def test_NMR_metadata(self):
         assert_array_almost_equal(
@@ -76,6 +89,64 @@ class TestFTIRDataLoader:
             NMRDataLoader(filepath=self.wrong_format)
 
 
+class TestSPAParser:
+    def test_read_spa(self, spa_file):
+        data, wn_min, wn_max = read_spa(spa_file)
+        assert_array_almost_equal(data, [0.1, 0.2, 0.3, 0.4])
+        assert not data.flags.writeable
+        assert (wn_min, wn_max) == (1000.0, 4000.0)
+
+    def test_FTIR_dataloader(self, spa_file):
+        dataloader = FTIRDataLoader(spa_file)
+        assert_array_almost_equal(dataloader.data, [0.1, 0.2, 0.3, 0.4])
+        assert_equal(dataloader.metadata["Signal Metadata"]["Wavenumbers"],
+                     [4000, 3000, 2000, 1000])
+
+    @pytest.mark.skipif(not os.path.isdir("/proc/self/fd"),
+                        reason="needs /proc/self/fd")
+    def test_no_file_descriptor_left_open(self, spa_file, tmp_path):
+        def open_fds():
+            return len(os.listdir("/proc/self/fd"))
+
+        before = open_fds()
+        loaders = [FTIRDataLoader(spa_file) for _ in range(50)]
+        broken = tmp_path/"broken.spa"
+        broken.write_bytes(b"\0" * 600)
+        with pytest.raises(ValueError):
+            read_spa(broken)
+        assert open_fds() == before
+        assert_array_almost_equal(loaders[-1].data, [0.1, 0.2, 0.3, 0.4])
+
+    def test_read_spa_invalid(self, tmp_path):
+        file = tmp_path/"broken.spa"
+        file.write_bytes(b"not a spa file")
+        with pytest.raises(ValueError, match="Invalid SPA file"):
+            read_spa(file)
+
+
+class TestCaryEclipseParser:
+    def test_chunked_read(self, csv_file):
+        emission, samples = read_cary_eclipse_csv(csv_file)
+        _, chunked = read_cary_eclipse_csv(csv_file, chunksize=1)
+        assert_equal(emission, [210, 215, 220])
+        assert [s[0] for s in samples] == ["Sample1", "Sample2",
+                                           "Sample3", "Sample4"]
+        for (_, ex, data), (_, _, chunked_data) in zip(samples, chunked):
+            assert_equal(ex, [200, 205])
+            assert data.dtype == np.float32
+            assert data.flags.c_contiguous
+            assert_array_almost_equal(data, chunked_data)
+
+    def test_footer_is_ignored(self, csv_file, tmp_path):
+        file = tmp_path/"footer.csv"
+        file.write_text(csv_file.read_text()
+                        + "\nScan Software Version,1.2\nMethod,EEM\n")
+        _, samples = read_cary_eclipse_csv(file)
+        assert_array_almost_equal(samples[3][2],
+                                  [[18.34862328, 0, 0],
+                                   [4.796163082, 4.878048897, 0]])
+
+
 class TestFluorescenceDataLoader():
     @pytest.fixture(autouse=True)
     def setup(self, csv_file, wrong_format, edge_case_csv_file):
@@ -116,7 +187,7 @@ class TestFluorescenceDataLoader():
         for objs, file, name in zip([self.dataloader, self.dataloader_edge_case],  # noqa: E501
                                     [self.csv_file, self.edge_case],
                                     ["Test.csv", "edgecase_FL.csv"]):
-            assert objs.metadata["S2"] == {
+            assert _as_lists(objs.metadata["S2"]) == {
                 "Measurement Date": datetime.fromtimestamp(
                     os.path.getmtime(file)).strftime("%Y-%m-%d"),
                 "Filename": name,
@@ -129,7 +200,7 @@ class TestFluorescenceDataLoader():
                 },
                 "Comments": None}
 
-            assert objs.metadata["S3"] == {
+            assert _as_lists(objs.metadata["S3"]) == {
                 "Measurement Date": datetime.fromtimestamp(
                     os.path.getmtime(file)).strftime("%Y-%m-%d"),
                 "Filename": name,
@@ -142,7 +213,7 @@ class TestFluorescenceDataLoader():
                 },
                 "Comments": None}
 
-            assert objs.metadata["S4"] == {
+            assert _as_lists(objs.metadata["S4"]) == {
                 "Measurement Date": datetime.fromtimestamp(
                     os.path.getmtime(file)).strftime("%Y-%m-%d"),
                 "Filename": name,
@@ -155,7 +226,7 @@ class TestFluorescenceDataLoader():
                 },
                 "Comments": None}
 
-        assert self.dataloader_edge_case.metadata["S1"] == {
+        assert _as_lists(self.dataloader_edge_case.metadata["S1"]) == {
             "Measurement Date": datetime.fromtimestamp(
                 os.path.getmtime(self.edge_case)).strftime("%Y-%m-%d"),
             "Filename": "edgecase_FL.csv",
@@ -168,7 +239,7 @@ class TestFluorescenceDataLoader():
             },
             "Comments": None}
 
-        assert self.dataloader.metadata["S1"] == {
+        assert _as_lists(self.dataloader.metadata["S1"]) == {
             "Measurement Date": datetime.fromtimestamp(
                 os.path.getmtime(self.csv_file)).strftime("%Y-%m-%d"),
             "Filename": "Test.csv",
@@ -225,3 +296,67 @@ class TestFluorescenceDataLoader():
                       "Sample3",
                       "Sample4"])
         )
+
+
+class TestLazyLoading:
+    def test_FL_lazy(self, csv_file):
+        dataloader = FluorescenceDataLoader(csv_file, lazy=True)
+        assert not dataloader._signal_loaded
+        assert list(dataloader._sample_id_map.values()) == [
+            "Sample1", "Sample2", "Sample3", "Sample4"]
+        assert dataloader.metadata["S1"]["Signal Metadata"]["Emission"] is None
+
+        dataloader.add_metadata(identifier="S2", sample_name="Renamed")
+        dataloader.delete_measurement("S3")
+        assert not dataloader._signal_loaded
+
+        assert list(dataloader.data) == ["S1", "S2", "S4"]
+        assert_array_almost_equal(dataloader.data["S4"],
+                                  [[18.34862328, 0, 0],
+                                   [4.796163082, 4.878048897, 0]])
+        assert dataloader.metadata["S2"]["Sample name"] == "Renamed"
+        assert_equal(dataloader.metadata["S2"]["Signal Metadata"]["Emission"],
+                     [210, 215, 220])
+
+    def test_NMR_FTIR_lazy(self, txt_file, spa_file):
+        nmr = NMRDataLoader(txt_file, lazy=True)
+        assert nmr.metadata["Signal Metadata"] is None
+        assert_array_almost_equal(nmr.data, [5000.0, 5500.0])
+        assert_array_almost_equal(nmr.metadata["Signal Metadata"]["ppm"],
+                                  [16.4, 16.3])
+
+        ftir = FTIRDataLoader(spa_file, lazy=True)
+        assert_equal(ftir.metadata["Signal Metadata"]["Wavenumbers"],
+                     [4000, 3000, 2000, 1000])
+        assert not ftir._signal_loaded
+        assert_array_almost_equal(ftir.data, [0.1, 0.2, 0.3, 0.4])
+
+    def test_eager_loading_reads_files_once(self, monkeypatch, csv_file,
+                                            spa_file):
+        from spectradb.dataloaders import dataloader
+
+        def header_read(filepath):
+            raise AssertionError(f"{filepath} was read twice")
+
+        monkeypatch.setattr(dataloader, "read_spa_header", header_read)
+        monkeypatch.setattr(dataloader, "read_cary_eclipse_header",
+                            header_read)
+        ftir = FTIRDataLoader(spa_file)
+        assert_equal(ftir.metadata["Signal Metadata"]["Wavenumbers"],
+                     [4000, 3000, 2000, 1000])
+        fl = FluorescenceDataLoader(csv_file)
+        assert list(fl._sample_id_map.values()) == [
+            "Sample1", "Sample2", "Sample3", "Sample4"]
+        assert_equal(fl.metadata["S4"]["Signal Metadata"]["Excitation"],
+                     [200, 205])
+
+    def test_df_is_cached(self, csv_file):
+        dataloader = FluorescenceDataLoader(csv_file, lazy=True)
+        df = dataloader.df
+        assert dataloader.df is df
+        dataloader.add_metadata(identifier="S1", comments="changed")
+        assert dataloader.df is not df
+        assert dataloader.df.loc["S1", "Comments"] == "changed"
+        df = dataloader.df
+        dataloader.delete_measurement("S4")
+        assert list(dataloader.df.index) == ["S1", "S2", "S3"]
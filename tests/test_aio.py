@@ -0,0 +1,111 @@
+from spectradb import AsyncDatabase
+from spectradb.dataloaders import FluorescenceDataLoader, NMRDataLoader
+from pathlib import Path
+import asyncio
+import time
+import pytest
+
+path = Path(__file__).parent
+
+SLOW_QUERY = """
+    SELECT COUNT(*) FROM (
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+        SELECT i FROM n)
+    """
+
+
+@pytest.fixture
+def txt_file(tmp_path):
+    file = tmp_path/"example.txt"
+    file.write_text("Title\n 1, 5000, 555, 16.4\n 2, 5500, 555, 16.3")
+    return file
+
+
+@pytest.fixture
+def database(tmp_path):
+    return tmp_path/"database.sqlite"
+
+
+def test_async_roundtrip(txt_file, database):
+    async def main():
+        async with AsyncDatabase(database, backup=False) as db:
+            await db.add_sample([NMRDataLoader(txt_file),
+                                 FluorescenceDataLoader(
+                                     path/"dataloaders"/"Test.csv")])
+            fl, nmr = await asyncio.gather(
+                db.fetch_instrument_data("FL"),
+                db.fetch_sample_data("NMR_1", col_name="sample_id"))
+            await db.remove_sample("FL_1", commit=True)
+            return len(fl), len(nmr), len(await db.fetch_instrument_data("FL"))
+
+    assert asyncio.run(main()) == (4, 1, 3)
+
+
+def test_concurrency_limit(database):
+    async def main():
+        async with AsyncDatabase(database, backup=False, max_workers=4,
+                                 max_concurrency=1) as db:
+            running, peak = 0, 0
+            original = db.database.execute_custom_query
+
+            def tracked(*args):
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                time.sleep(0.01)
+                running -= 1
+                return original(*args)
+
+            db.database.execute_custom_query = tracked
+            await asyncio.gather(*(db.execute_custom_query("SELECT 1")
+                                   for _ in range(8)))
+            return peak
+
+    assert asyncio.run(main()) == 1
+
+
+def test_cancellation_interrupts_query(database):
+    async def main():
+        async with AsyncDatabase(database, backup=False,
+                                 max_workers=1) as db:
+            task = asyncio.create_task(db.execute_custom_query(SLOW_QUERY))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # The single worker is free again once the query is interrupted
+            start = time.perf_counter()
+            rows, _ = await db.execute_custom_query("SELECT 1")
+            return rows, time.perf_counter() - start
+
+    rows, elapsed = asyncio.run(main())
+    assert rows == [(1,)]
+    assert elapsed < 2
+
+
+def test_cancelled_calls_keep_their_slot(database):
+    async def main():
+        async with AsyncDatabase(database, backup=False, max_workers=4,
+                                 max_concurrency=1) as db:
+            running, peak = 0, 0
+            original = db.database.execute_custom_query
+
+            def tracked(*args):
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                # Not interruptible, the worker keeps running after cancel
+                time.sleep(0.2)
+                running -= 1
+                return original(*args)
+
+            db.database.execute_custom_query = tracked
+            task = asyncio.create_task(db.execute_custom_query("SELECT 1"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await db.execute_custom_query("SELECT 1")
+            return peak
+
+    assert asyncio.run(main()) == 1
@@ -0,0 +1,27 @@
+import subprocess
+import sys
+
+
+def _loaded_after(code):
+    script = (f"import sys\n{code}\n"
+              "print(sorted(m for m in ('pandas', 'plotly', "
+              "'plotly_express') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", script],
+                            capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_import_does_not_load_pandas_or_plotly():
+    assert _loaded_after(
+        "import spectradb\n"
+        "from spectradb import Database, AsyncDatabase\n"
+        "from spectradb.dataloaders import FTIRDataLoader") == "[]"
+
+
+def test_plotting_and_pandas_load_on_first_use():
+    assert _loaded_after(
+        "from spectradb.utils import spectrum") == (
+            "['plotly', 'plotly_express']")
+    assert _loaded_after(
+        "import spectradb.main as main\n"
+        "main.pd.DataFrame()") == "['pandas']"
@@ -1 +1,854 @@
 from spectradb import Database
+from spectradb.dataloaders import FluorescenceDataLoader, NMRDataLoader
+from numpy.testing import assert_array_almost_equal
+from pathlib import Path
+import numpy as np
+import pytest
+import sqlite3
+import threading
+
+path = Path(__file__).parent
+
+
+@pytest.fixture
+def txt_file(tmp_path):
+    file = tmp_path/"example.txt"
+    file.write_text("Title\n 1, 5000, 555, 16.4\n 2, 5500, 555, 16.3")
+    return file
+
+
+@pytest.fixture
+def csv_file():
+    return path/"dataloaders"/"Test.csv"
+
+
+@pytest.fixture
+def database(tmp_path):
+    return tmp_path/"database.sqlite"
+
+
+class TestBinaryStorage:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.nmr = NMRDataLoader(txt_file)
+        self.nmr.add_metadata(sample_name="NMR sample")
+        self.fl = FluorescenceDataLoader(csv_file)
+        self.database = database
+
+    def test_binary_roundtrip(self):
+        with Database(self.database, backup=False,
+                      storage_format="binary") as db:
+            db.add_sample([self.nmr, self.fl])
+            raw, _ = db.execute_custom_query(
+                "SELECT typeof(data) FROM measurements")
+            assert {r[0] for r in raw} == {"blob"}
+
+            nmr = db.return_dataloader(sample_ids="NMR_1")
+            assert isinstance(nmr.data, np.ndarray)
+            assert_array_almost_equal(nmr.data, [5000.0, 5500.0])
+
+            fl = db.return_dataloader(sample_ids="FL_2")
+            assert fl.data['S1'].shape == (2, 3)
+            assert_array_almost_equal(fl.data['S1'],
+                                      [[2.958580017, 8.902077675, 0],
+                                       [4.866179943, 0, -7.211538315]])
+
+            df = db.transform_data_for_analysis("FL")
+            assert df.shape == (4, 8)
+
+    def test_invalid_storage_format(self):
+        with pytest.raises(ValueError):
+            Database(self.database, backup=False, storage_format="xml")
+
+    def test_migrate_storage(self):
+        with Database(self.database, backup=False) as db:
+            db.add_sample([self.nmr, self.fl])
+            expected = db.transform_data_for_analysis("FL")
+
+        with Database(self.database, backup=False,
+                      storage_format="binary") as db:
+            assert db.migrate_storage(chunksize=2) == 5
+            raw, _ = db.execute_custom_query(
+                "SELECT typeof(data) FROM measurements")
+            assert {r[0] for r in raw} == {"blob"}
+            assert db.migrate_storage() == 0
+            assert_array_almost_equal(
+                db.transform_data_for_analysis("FL").iloc[:, 2:],
+                expected.iloc[:, 2:])
+
+            assert db.migrate_storage("json") == 5
+            raw, _ = db.execute_custom_query(
+                "SELECT typeof(data) FROM measurements")
+            assert {r[0] for r in raw} == {"text"}
+
+
+class TestFetchMatrix:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.db = Database(database, backup=False, storage_format="binary")
+        with self.db as db:
+            db.add_sample([NMRDataLoader(txt_file),
+                           FluorescenceDataLoader(csv_file)])
+
+    def test_fetch_matrix_fl(self):
+        with self.db as db:
+            matrix, (ex, em), rows = db.fetch_matrix("FL")
+        assert matrix.dtype == np.float32
+        assert matrix.shape == (4, 6)
+        assert matrix.flags.c_contiguous
+        assert ex.tolist() == [200, 205]
+        assert em.tolist() == [210, 215, 220]
+        assert rows.sample_id.tolist() == ["FL_1", "FL_2", "FL_3", "FL_4"]
+        assert_array_almost_equal(matrix[1],
+                                  [2.958580017, 8.902077675, 0,
+                                   4.866179943, 0, -7.211538315])
+
+    def test_fetch_matrix_subset(self):
+        with self.db as db:
+            matrix, axis, rows = db.fetch_matrix(
+                "FL", sample_ids=["FL_3", "FL_1"], dtype=np.float64)
+            empty, _, _ = db.fetch_matrix("FTIR")
+        assert matrix.dtype == np.float64
+        assert rows.sample_id.tolist() == ["FL_1", "FL_3"]
+        assert empty.shape == (0, 0)
+
+    def test_fetch_matrix_nmr(self):
+        with self.db as db:
+            matrix, axis, rows = db.fetch_matrix("NMR")
+        assert_array_almost_equal(axis, [16.4, 16.3])
+        assert_array_almost_equal(matrix, [[5000.0, 5500.0]])
+
+
+class TestIngestDirectory:
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, csv_file, database):
+        self.folder = tmp_path/"raw"
+        self.folder.mkdir()
+        for i in range(3):
+            (self.folder/f"nmr_{i}.txt").write_text(
+                f"Title\n 1, {i}, 555, 16.4\n 2, {i + 1}, 555, 16.3")
+        (self.folder/"broken.spa").write_bytes(b"not a spa file")
+        (self.folder/"fl.csv").write_text(csv_file.read_text())
+        (self.folder/"notes.md").write_text("ignored")
+        self.database = database
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_ingest_directory(self, workers):
+        with Database(self.database, backup=False) as db:
+            report = db.ingest_directory(self.folder, workers=workers,
+                                         chunksize=2)
+            assert report["added"] == 7
+            assert list(report["failed"]) == [str(self.folder/"broken.spa")]
+            assert len(db.fetch_instrument_data("NMR")) == 3
+            assert len(db.fetch_instrument_data("FL")) == 4
+
+    def test_ingest_directory_duplicates(self):
+        with Database(self.database, backup=False) as db:
+            db.ingest_directory(self.folder, "*.csv", workers=1)
+            report = db.ingest_directory(self.folder, "**/*.*", workers=1)
+            assert report["added"] == 3
+            assert len(report["failed"]) == 2
+            assert len(db.fetch_instrument_data("FL")) == 4
+
+    def test_ingest_duplicate_keeps_pending_samples(self, txt_file):
+        with Database(self.database, backup=False) as db:
+            db.ingest_directory(self.folder, "*.csv", workers=1)
+            nmr = NMRDataLoader(txt_file)
+            nmr.add_metadata(sample_name="pending")
+            db.add_sample(nmr, commit=False)
+            db.ingest_directory(self.folder, "*.csv", workers=1)
+            assert "pending" in db.fetch_instrument_data(
+                "NMR").sample_name.tolist()
+
+
+class TestReturnDataloader:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.db = Database(database, backup=False)
+        with self.db as db:
+            nmr = NMRDataLoader(txt_file)
+            nmr.add_metadata(sample_name="NMR sample")
+            db.add_sample([nmr, FluorescenceDataLoader(csv_file)])
+
+    def test_signal_metadata_fetched_once(self):
+        with self.db as db:
+            statements = []
+            db._connection.set_trace_callback(statements.append)
+            loaders = db.return_dataloader(
+                sample_ids=["FL_3", "FL_1", "FL_2"])
+            db._connection.set_trace_callback(None)
+
+        assert sum("SELECT metadata_id, metadata" in s
+                   for s in statements) == 1
+        assert [dl.metadata["S1"]["Sample name"] for dl in loaders] == [
+            "Sample3", "Sample1", "Sample2"]
+        axes = [dl.metadata["S1"]["Signal Metadata"]["Emission"]
+                for dl in loaders]
+        assert all(axis is axes[0] for axis in axes)
+        assert not axes[0].flags.writeable
+
+    def test_mixed_instruments(self):
+        with self.db as db:
+            nmr, fl = db.return_dataloader(sample_ids=["NMR_1", "FL_4"])
+        assert isinstance(nmr, NMRDataLoader)
+        assert isinstance(fl, FluorescenceDataLoader)
+        assert_array_almost_equal(nmr.metadata["Signal Metadata"]["ppm"],
+                                  [16.4, 16.3])
+
+
+class TestSignalMetadataCache:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.database = database
+        self.db = Database(database, backup=False,
+                           signal_metadata_cache_size=1)
+        with self.db as db:
+            db.add_sample([NMRDataLoader(txt_file),
+                           FluorescenceDataLoader(csv_file)])
+
+    def test_hits_and_eviction(self):
+        with self.db as db:
+            db.fetch_matrix("FL")
+            db.fetch_matrix("FL")
+            assert db.signal_metadata_cache_info() == {
+                "hits": 1, "misses": 1, "size": 1, "maxsize": 1}
+            db.fetch_matrix("NMR")
+            db.fetch_matrix("FL")
+            assert db.signal_metadata_cache_info()["misses"] == 3
+            db.clear_signal_metadata_cache()
+            assert db.signal_metadata_cache_info()["size"] == 0
+
+    def test_invalidated_by_other_connection(self):
+        with self.db as db:
+            db.fetch_matrix("FL")
+            with sqlite3.connect(self.database) as other:
+                other.execute("DELETE FROM signal_metadata")
+                other.execute("INSERT INTO signal_metadata VALUES "
+                              "(2, '{\"Excitation\": [1, 2], "
+                              "\"Emission\": [3, 4, 5]}')")
+            _, (ex, em), _ = db.fetch_matrix("FL")
+            assert ex.tolist() == [1, 2]
+            assert db.signal_metadata_cache_info()["misses"] == 2
+
+
+class TestIndexes:
+    def test_query_plans_use_indexes(self, database):
+        with Database(database, backup=False) as db:
+            plans = db.check_query_plans()
+        assert set(plans) == {"sample_id", "instrument", "internal_code",
+                              "measurement_date"}
+        assert all(plan["uses_index"] for plan in plans.values()), plans
+
+    def test_existing_database_is_upgraded(self, database):
+        with Database(database, backup=False) as db:
+            db._connection.execute(
+                "DROP INDEX measurements_sample_id_idx")
+            assert not db.check_query_plans()["sample_id"]["uses_index"]
+        with Database(database, backup=False) as db:
+            assert db.check_query_plans()["sample_id"]["uses_index"]
+
+
+class TestSampleIdAllocation:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.nmr = NMRDataLoader(txt_file)
+        self.fl = FluorescenceDataLoader(csv_file)
+        self.database = database
+
+    def _ids(self, db, instrument):
+        return db.fetch_instrument_data(instrument).sample_id.tolist()
+
+    def test_bulk_allocation_and_legacy_writer(self):
+        with Database(self.database, backup=False) as db:
+            db.add_sample([self.fl])
+            self.nmr.add_metadata(sample_name="first")
+            db.add_sample(self.nmr)
+            # A legacy writer that leaves sample_id to the trigger
+            db._connection.execute(
+                "INSERT INTO measurements (instrument_id, sample_name) "
+                "VALUES ('FL', 'legacy')")
+            db._connection.commit()
+            self.nmr.add_metadata(sample_name="second")
+            db.add_sample(self.nmr)
+
+            assert self._ids(db, "FL") == ["FL_1", "FL_2", "FL_3", "FL_4",
+                                           "FL_5"]
+            assert self._ids(db, "NMR") == ["NMR_1", "NMR_2"]
+            counters, _ = db.execute_custom_query(
+                "SELECT * FROM measurements_instrument_sample_count")
+            assert dict(counters) == {"FL": 5, "NMR": 2}
+
+    def test_failed_insert_does_not_consume_ids(self):
+        with Database(self.database, backup=False) as db:
+            db.add_sample([self.fl])
+            db.add_sample([self.fl])
+            db.add_sample([self.nmr])
+            assert self._ids(db, "FL") == ["FL_1", "FL_2", "FL_3", "FL_4"]
+            assert self._ids(db, "NMR") == ["NMR_1"]
+
+    def test_legacy_trigger_is_replaced(self):
+        with Database(self.database, backup=False) as db:
+            db._connection.executescript("""
+                DROP TRIGGER generate_sample_id;
+                CREATE TRIGGER generate_sample_id
+                AFTER INSERT ON measurements
+                BEGIN
+                    UPDATE measurements SET sample_id = 'overwritten'
+                    WHERE rowid = NEW.rowid;
+                END;
+                """)
+        with Database(self.database, backup=False) as db:
+            db.add_sample(self.nmr)
+            assert self._ids(db, "NMR") == ["NMR_1"]
+
+
+class TestStreamingAddSample:
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, csv_file, database):
+        self.nmrs = []
+        for i in range(5):
+            file = tmp_path/f"nmr_{i}.txt"
+            file.write_text(f"Title\n 1, {i}, 555, 16.4\n 2, {i}, 555, 16.3")
+            nmr = NMRDataLoader(file)
+            nmr.add_metadata(sample_name=f"nmr_{i}")
+            self.nmrs.append(nmr)
+        self.fl = FluorescenceDataLoader(csv_file)
+        self.database = database
+
+    def test_input_is_not_mutated(self):
+        batch = [self.nmrs[0], self.fl]
+        with Database(self.database, backup=False) as db:
+            db.add_sample(batch, chunksize=2)
+            assert len(db.fetch_instrument_data("FL")) == 4
+        assert batch == [self.nmrs[0], self.fl]
+
+    def test_generator_input_commits_per_chunk(self):
+        with Database(self.database, backup=False) as db:
+            commits = []
+            db._connection.set_trace_callback(
+                lambda s: s == "COMMIT" and commits.append(s))
+            db.add_sample((nmr for nmr in self.nmrs), chunksize=2)
+            db._connection.set_trace_callback(None)
+            assert len(commits) == 3
+            assert db.fetch_instrument_data("NMR").sample_id.tolist() == [
+                f"NMR_{i}" for i in range(1, 6)]
+
+    def test_duplicate_in_middle_chunk(self, capsys):
+        with Database(self.database, backup=False) as db:
+            db.add_sample(self.nmrs[2])
+            db.add_sample(self.nmrs, chunksize=2)
+            assert "nmr_2" in capsys.readouterr().out
+            names = db.fetch_instrument_data("NMR").sample_name.tolist()
+            assert sorted(names) == [f"nmr_{i}" for i in range(5)]
+
+    def test_duplicate_keeps_caller_transaction(self):
+        with Database(self.database, backup=False) as db:
+            db.add_sample(self.nmrs[:2], commit=False)
+            db.add_sample(self.nmrs[1:4], commit=False, chunksize=1)
+            assert db._connection.in_transaction
+            db._connection.commit()
+            assert len(db.fetch_instrument_data("NMR")) == 4
+
+
+class TestConnectionProfile:
+    def test_profiles(self, database, tmp_path):
+        with Database(database, backup=False,
+                      connection_profile="analytics") as db:
+            settings = db.connection_settings()
+        assert settings["journal_mode"] == "wal"
+        assert settings["page_size"] == 16384
+        assert settings["mmap_size"] == 1 << 30
+        assert settings["synchronous"] == 1  # NORMAL
+        assert settings["temp_store"] == 2  # MEMORY
+
+        # page_size is fixed once the database exists
+        with Database(database, backup=False,
+                      connection_profile="safe") as db:
+            settings = db.connection_settings()
+        assert settings["journal_mode"] == "delete"
+        assert settings["synchronous"] == 2  # FULL
+        assert settings["page_size"] == 16384
+
+    def test_default_and_invalid_profile(self, database):
+        with Database(database, backup=False) as db:
+            assert db.connection_settings()["journal_mode"] == "delete"
+        with pytest.raises(ValueError):
+            Database(database, backup=False, connection_profile="fast")
+
+
+class TestConnectionPool:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.db = Database(database, backup=False,
+                           connection_profile="analytics", readers=2)
+        with self.db as db:
+            db.add_sample([NMRDataLoader(txt_file),
+                           FluorescenceDataLoader(csv_file)])
+
+    def test_readers_are_read_only(self):
+        with self.db as db:
+            with db._read_cursor() as cursor:
+                assert cursor.connection is not db._connection
+                with pytest.raises(sqlite3.OperationalError):
+                    cursor.execute("DELETE FROM measurements")
+
+    def test_parallel_reads_during_writes(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+
+        def write(i):
+            file = tmp_path/f"nmr_{i}.txt"
+            file.write_text(f"Title\n 1, {i}, 555, 16.4\n 2, {i}, 555, 16.3")
+            nmr = NMRDataLoader(file)
+            nmr.add_metadata(sample_name=f"nmr_{i}")
+            db.add_sample(nmr)
+
+        def read(_):
+            matrix, _, _ = db.fetch_matrix("FL")
+            loaders = db.return_dataloader(sample_ids=["FL_1", "FL_2"])
+            return matrix.shape, len(loaders)
+
+        with self.db as db, ThreadPoolExecutor(8) as executor:
+            writes = [executor.submit(write, i) for i in range(10)]
+            reads = list(executor.map(read, range(20)))
+            for future in writes:
+                future.result()
+            assert len(db._read_connections) <= 2
+            assert reads == [((4, 6), 2)] * 20
+            assert len(db.fetch_instrument_data("NMR")) == 11
+        assert db._read_connections == []
+
+    def test_reads_see_one_snapshot(self, monkeypatch, tmp_path):
+        selection = Database._matrix_selection
+        file = tmp_path/"nmr.txt"
+        file.write_text("Title\n 1, 1, 555, 16.4\n 2, 2, 555, 16.3")
+        added = []
+
+        def insert_after_count(db, *args):
+            result = selection(db, *args)
+            nmr = NMRDataLoader(file)
+            nmr.add_metadata(sample_name=f"added {len(added)}")
+            db.add_sample(nmr)
+            added.append(nmr)
+            return result
+
+        monkeypatch.setattr(Database, "_matrix_selection",
+                            insert_after_count)
+        with self.db as db:
+            matrix, _, _ = db.fetch_matrix("NMR")
+            path = db.transform_data_for_analysis(
+                "NMR", output_format="npy", output_dir=tmp_path/"out")
+        assert matrix.shape == (1, 2)
+        assert np.load(path).shape == (2, 2)
+        assert len(added) == 2
+
+
+class TestIterSamples:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.db = Database(database, backup=False, storage_format="binary")
+        with self.db as db:
+            db.add_sample([NMRDataLoader(txt_file),
+                           FluorescenceDataLoader(csv_file)])
+
+    def test_dataframe_chunks(self):
+        with self.db as db:
+            chunks = list(db.iter_samples(chunksize=2))
+            assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+            assert list(chunks[0].columns) == list(
+                db.fetch_instrument_data("FL").columns)
+            fl = list(db.iter_samples("FL", sample_ids=["FL_4", "FL_2"]))
+        assert fl[0].sample_id.tolist() == ["FL_2", "FL_4"]
+
+    def test_numpy_chunks(self):
+        with self.db as db:
+            expected, _, _ = db.fetch_matrix("FL")
+            chunks = list(db.iter_samples("FL", chunksize=3, as_numpy=True))
+            with pytest.raises(ValueError):
+                list(db.iter_samples(as_numpy=True))
+        assert [matrix.shape for matrix, _ in chunks] == [(3, 6), (1, 6)]
+        assert_array_almost_equal(np.vstack([m for m, _ in chunks]),
+                                  expected)
+        assert chunks[1][1].sample_id.tolist() == ["FL_4"]
+
+    @pytest.mark.parametrize("readers", [0, 2])
+    def test_open_iterator_does_not_block_writers(self, txt_file, database,
+                                                  readers):
+        nmr = NMRDataLoader(txt_file)
+        nmr.add_metadata(sample_name="other")
+        with Database(database, backup=False, readers=readers,
+                      connection_profile="analytics") as db:
+            iterator = db.iter_samples(chunksize=1)
+            next(iterator)
+            writer = threading.Thread(target=db.add_sample, args=(nmr,))
+            writer.start()
+            writer.join(timeout=3)
+            assert not writer.is_alive()
+            # The iterator may be finalized by another thread
+            closer = threading.Thread(target=iterator.close)
+            closer.start()
+            closer.join()
+            assert len(db.fetch_instrument_data("NMR")) == 2
+
+    def test_many_sample_ids(self):
+        sample_ids = [f"FL_{i}" for i in range(40000)]
+        with self.db as db:
+            chunks = list(db.iter_samples(sample_ids=sample_ids))
+        assert chunks[0].sample_id.tolist() == [
+            "FL_1", "FL_2", "FL_3", "FL_4"]
+
+
+class TestBackup:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.nmr = NMRDataLoader(txt_file)
+        self.fl = FluorescenceDataLoader(csv_file)
+        self.database = database
+        self.backup_dir = database.parent/"database_backup"
+
+    def _backups(self):
+        return sorted(self.backup_dir.glob("*_periodic_backup_*"))
+
+    def _count(self, path):
+        with sqlite3.connect(path) as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM measurements").fetchone()[0]
+
+    def test_paged_backup_with_progress(self):
+        steps = []
+        with Database(self.database, backup_interval=0, backup_pages=1,
+                      backup_progress=lambda *args: steps.append(args)
+                      ) as db:
+            db.add_sample(self.fl)
+            assert len(self._backups()) == 1
+            assert steps and steps[-1][1] == 0  # no page remaining
+            db.remove_sample("FL_1", commit=True)
+        assert not list(self.backup_dir.glob(".*"))
+        backups = self._backups()
+        # The second backup may share the timestamp of the first one
+        assert 1 <= len(backups) <= 2
+        assert self._count(backups[-1]) == 3
+
+    def test_skip_when_unchanged(self, monkeypatch):
+        with Database(self.database, backup_interval=0) as db:
+            db.add_sample(self.fl)
+            calls = []
+            monkeypatch.setattr(db, "_copy_database",
+                                lambda *args: calls.append(args))
+            db._periodic_backup()
+            assert calls == []
+            db.add_sample(self.nmr)
+            assert len(calls) == 1
+
+    @pytest.mark.parametrize("background", [False, True])
+    def test_failed_backup_is_retried(self, monkeypatch, background):
+        def fail(*args):
+            raise OSError("disk full")
+
+        with Database(self.database, backup_interval=0,
+                      backup_in_background=background) as db:
+            monkeypatch.setattr(db, "_copy_database", fail)
+            with pytest.raises(OSError):
+                db.add_sample(self.fl)
+                db.wait_for_backup()
+            monkeypatch.undo()
+            db._periodic_backup()
+            db.wait_for_backup()
+            assert len(self._backups()) == 1
+
+    def test_background_backup_and_rotation(self, tmp_path):
+        with Database(self.database, backup_interval=0, max_backups=2,
+                      backup_in_background=True) as db:
+            db.add_sample(self.fl)
+            for i in range(3):
+                target = db.create_backup(tmp_path/"database_backup" /
+                                          f"database_periodic_backup_{i}",
+                                          background=True)
+                db.wait_for_backup()
+                assert self._count(target) == 4
+        assert len(self._backups()) == 2
+
+
+class TestOrderedFetch:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.database = database
+        with Database(database, backup=False) as db:
+            db.add_sample([NMRDataLoader(txt_file),
+                           FluorescenceDataLoader(csv_file)])
+
+    @pytest.mark.parametrize("readers", [0, 1])
+    def test_large_ordered_fetch(self, readers):
+        ids = [f"missing_{i}" for i in range(40000)]
+        ids[10:10] = ["FL_3", "NMR_1", "FL_1", "FL_3"]
+        with Database(self.database, backup=False, readers=readers) as db:
+            df = db.fetch_sample_data(ids, col_name="sample_id", ordered=True)
+            unordered = db.fetch_sample_data(ids, col_name="sample_id")
+        assert df.sample_id.tolist() == ["FL_3", "NMR_1", "FL_1"]
+        assert sorted(unordered.sample_id) == ["FL_1", "FL_3", "NMR_1"]
+
+    def test_caller_transaction_is_kept(self):
+        with Database(self.database, backup=False) as db:
+            db.remove_sample("FL_1")
+            db.fetch_sample_data(["FL_2", "FL_1"], col_name="sample_id",
+                                 ordered=True)
+            assert db._connection.in_transaction
+            db._connection.rollback()
+            assert len(db.fetch_instrument_data("FL")) == 4
+
+
+class TestExport:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.db = Database(database, backup=False, storage_format="binary")
+        with self.db as db:
+            db.add_sample([NMRDataLoader(txt_file),
+                           FluorescenceDataLoader(csv_file)])
+            self.expected = db.transform_data_for_analysis("FL")
+
+    def test_csv_in_chunks(self):
+        import pandas as pd
+        with self.db as db:
+            path = db.transform_data_for_analysis("FL", output_format="csv",
+                                                  chunksize=3)
+        assert path.parent.name == "csv_export"
+        df = pd.read_csv(path)
+        assert list(df.columns) == list(self.expected.columns)
+        assert_array_almost_equal(df.iloc[:, 2:], self.expected.iloc[:, 2:])
+
+    def test_npz(self):
+        with self.db as db:
+            path = db.transform_data_for_analysis("FL", output_format="npz",
+                                                  chunksize=3)
+        with np.load(path) as archive:
+            assert archive["data"].dtype == np.float32
+            assert_array_almost_equal(archive["data"],
+                                      self.expected.iloc[:, 2:])
+            assert archive["Excitation"].tolist() == [200, 205]
+            assert archive["Emission"].tolist() == [210, 215, 220]
+            assert archive["sample_id"].tolist() == [
+                "FL_1", "FL_2", "FL_3", "FL_4"]
+
+    def test_npy_with_sidecar(self, tmp_path):
+        with self.db as db:
+            path = db.transform_data_for_analysis(
+                "NMR", output_format="npy", output_dir=tmp_path/"out")
+            empty = db.transform_data_for_analysis(
+                "FTIR", output_format="npy", output_dir=tmp_path/"out")
+        assert_array_almost_equal(np.load(path, mmap_mode="r"),
+                                  [[5000.0, 5500.0]])
+        with np.load(path.with_suffix(".axis.npz")) as sidecar:
+            assert_array_almost_equal(sidecar["ppm"], [16.4, 16.3])
+            assert sidecar["sample_name"].tolist() == [""]
+        assert np.load(empty).shape == (0, 0)
+
+    @pytest.mark.parametrize("output_format", ["npy", "npz"])
+    def test_rows_must_match_the_header(self, output_format, tmp_path):
+        from spectradb.utils.export import write_npy, write_npz
+        write = write_npy if output_format == "npy" else write_npz
+        chunk = (np.ones((2, 3)), {"sample_id": ["a", "b"],
+                                   "sample_name": ["a", "b"],
+                                   "internal_code": ["", ""]})
+        path = tmp_path/f"FL.{output_format}"
+        for shape in [(3, 3), (1, 3), (0, 3)]:
+            with pytest.raises(ValueError):
+                write(path, iter([chunk]), shape, {})
+            assert not path.exists()
+
+    def test_parquet(self):
+        pd = pytest.importorskip("pandas")
+        pytest.importorskip("pyarrow")
+        with self.db as db:
+            path = db.transform_data_for_analysis(
+                "FL", output_format="parquet", chunksize=3)
+        assert_array_almost_equal(pd.read_parquet(path).iloc[:, 2:],
+                                  self.expected.iloc[:, 2:])
+
+    def test_invalid_format(self):
+        with self.db as db, pytest.raises(ValueError):
+            db.transform_data_for_analysis("FL", output_format="xlsx")
+
+    def test_arrow_without_pyarrow(self):
+        try:
+            import pyarrow  # noqa: F401
+            pytest.skip("pyarrow is installed")
+        except ImportError:
+            pass
+        with self.db as db, pytest.raises(ImportError):
+            db.transform_data_for_analysis("FL", output_format="arrow")
+
+
+class TestShardStorage:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.nmr = NMRDataLoader(txt_file)
+        self.fl = FluorescenceDataLoader(csv_file)
+        self.database = database
+        with Database(database, backup=False) as db:
+            db.add_sample([self.nmr, self.fl])
+            self.expected = db.transform_data_for_analysis("FL")
+        database.unlink()
+
+    def test_roundtrip(self):
+        with Database(self.database, backup=False,
+                      storage_format="shard") as db:
+            db.add_sample([self.nmr, self.fl])
+            raw, _ = db.execute_custom_query(
+                "SELECT COUNT(*) FROM measurements WHERE data IS NULL")
+            assert raw[0][0] == 5
+            assert len(list(db.shard_dir.glob("*.npy"))) == 2
+
+            matrix, _, rows = db.fetch_matrix("FL")
+            assert_array_almost_equal(matrix, self.expected.iloc[:, 2:])
+            assert_array_almost_equal(
+                db.transform_data_for_analysis("FL").iloc[:, 2:],
+                self.expected.iloc[:, 2:])
+            fl = db.return_dataloader(sample_ids="FL_2")
+            assert_array_almost_equal(fl.data['S1'],
+                                      [[2.958580017, 8.902077675, 0],
+                                       [4.866179943, 0, -7.211538315]])
+            nmr = db.return_dataloader(sample_ids="NMR_1")
+            assert_array_almost_equal(nmr.data, [5000.0, 5500.0])
+            df = db.fetch_sample_data(["FL_3", "NMR_1"], col_name="sample_id",
+                                      ordered=True)
+            assert df.data.iloc[0].shape == (2, 3)
+            matrix, _ = next(db.iter_samples("FL", as_numpy=True))
+            assert_array_almost_equal(matrix, self.expected.iloc[:, 2:])
+
+    def test_failed_insert_does_not_leak_rows(self):
+        with Database(self.database, backup=False,
+                      storage_format="shard") as db:
+            db.add_sample(self.fl)
+            db.add_sample(self.fl)  # duplicates are rolled back
+            raw, _ = db.execute_custom_query(
+                "SELECT n_rows, filename FROM measurements_shards")
+            assert raw[0][0] == 4
+            # Rows of an interrupted append are ignored and overwritten
+            with open(db.shard_dir/raw[0][1], "ab") as file:
+                file.write(b"\0" * 24)
+            db.add_sample(self.nmr)
+            matrix, _, _ = db.fetch_matrix("FL")
+            assert_array_almost_equal(matrix, self.expected.iloc[:, 2:])
+
+    def test_compaction(self):
+        with Database(self.database, backup=False,
+                      storage_format="shard") as db:
+            db.add_sample([self.nmr, self.fl])
+            db.remove_sample(["FL_1", "FL_3"], commit=True)
+            assert db.compact_shards() == 2
+            assert db.compact_shards() == 0
+            raw, _ = db.execute_custom_query(
+                "SELECT filename FROM measurements_shards "
+                "WHERE n_points = 6")
+            assert raw[0][0].endswith(".1.npy")
+            assert np.load(db.shard_dir/raw[0][0]).shape == (2, 6)
+            assert len(list(db.shard_dir.glob("*.npy"))) == 2
+            matrix, _, rows = db.fetch_matrix("FL")
+            assert rows.sample_id.tolist() == ["FL_2", "FL_4"]
+            assert_array_almost_equal(
+                matrix, self.expected.iloc[[1, 3], 2:])
+
+    def test_backup_includes_shards(self, tmp_path):
+        with Database(self.database, backup=False,
+                      storage_format="shard") as db:
+            db.add_sample(self.fl)
+            target = db.create_backup(tmp_path/"copy.sqlite")
+            db.add_sample(self.nmr)
+        assert len(list((tmp_path/"copy_shards").glob("*.npy"))) == 1
+        with Database(target, backup=False) as copy:
+            matrix, _, _ = copy.fetch_matrix("FL")
+            assert_array_almost_equal(matrix, self.expected.iloc[:, 2:])
+            assert copy.fetch_matrix("NMR")[0].shape == (0, 0)
+
+
+class TestSimilarityIndex:
+    @pytest.fixture(autouse=True)
+    def setup(self, txt_file, csv_file, database):
+        self.nmr = NMRDataLoader(txt_file)
+        self.fl = FluorescenceDataLoader(csv_file)
+        self.db = Database(database, backup=False)
+        with self.db as db:
+            db.add_sample(self.fl)
+            self.matrix, _, _ = db.fetch_matrix("FL")
+
+    def _expected(self, queries, centered=False):
+        matrix = self.matrix.astype(np.float64)
+        queries = np.atleast_2d(queries).astype(np.float64)
+        if centered:
+            matrix = matrix - matrix.mean(axis=1, keepdims=True)
+            queries = queries - queries.mean(axis=1, keepdims=True)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        return queries @ matrix.T
+
+    def test_batched_top_k(self):
+        with self.db as db:
+            assert db.build_similarity_index("FL") == 4
+            result = db.find_similar(self.matrix[[2, 0]], k=2,
+                                     instrument_type="FL")
+        expected = self._expected(self.matrix[[2, 0]])
+        assert result["query"].tolist() == [0, 0, 1, 1]
+        assert result["rank"].tolist() == [1, 2, 1, 2]
+        assert result["sample_id"].tolist()[::2] == ["FL_3", "FL_1"]
+        assert_array_almost_equal(
+            result["score"], np.sort(expected, axis=1)[:, ::-1][:, :2].ravel(),
+            decimal=5)
+
+    def test_sample_ids_and_loaders(self):
+        with self.db as db:
+            db.build_similarity_index("FL", metric="correlation")
+            by_id = db.find_similar(["FL_2", "FL_4"], k=10)
+            by_loader = db.find_similar(self.fl, k=1)
+        assert len(by_id) == 8
+        expected = self._expected(self.matrix[1], centered=True)[0]
+        assert_array_almost_equal(by_id["score"][:4],
+                                  np.sort(expected)[::-1], decimal=5)
+        assert by_loader["sample_id"].tolist() == [
+            "FL_1", "FL_2", "FL_3", "FL_4"]
+
+    def test_incremental_updates(self):
+        with self.db as db:
+            db.build_similarity_index("FL")
+            db.remove_sample("FL_1", commit=True)
+            assert "FL_1" not in db.find_similar(
+                self.matrix[0], k=4, instrument_type="FL")["sample_id"].tolist()
+            db.add_sample(self.nmr)
+            db.build_similarity_index("NMR")
+            other = FluorescenceDataLoader(self.fl.filepath)
+            for sample in other.metadata.values():
+                sample["Comments"] = "copy"
+            db.add_sample(other)
+            result = db.find_similar(self.matrix[0], k=1,
+                                     instrument_type="FL")
+            assert result["sample_id"].tolist() == ["FL_5"]
+            assert result["score"][0] == pytest.approx(1)
+            nmr = db.find_similar("NMR_1", k=3)
+            assert nmr["sample_id"].tolist() == ["NMR_1"]
+            lazy = db.find_similar(
+                NMRDataLoader(self.nmr.filepath, lazy=True), k=1)
+            assert lazy["sample_id"].tolist() == ["NMR_1"]
+
+    def _scores(self, db):
+        result = db.find_similar(["FL_1", "FL_2", "FL_3", "FL_4"], k=4)
+        order = result["sample_id"].str[3:].astype(int) - 1
+        scores = np.empty((4, 4))
+        scores[result["query"], order] = result["score"]
+        return scores
+
+    @pytest.mark.parametrize("metric", ["cosine", "correlation"])
+    def test_pca_projection(self, metric):
+        exact = (self._expected(self.matrix) if metric == "cosine"
+                 else np.corrcoef(self.matrix.astype(np.float64)))
+        with self.db as db:
+            # All the components span the spectra: scores are exact
+            db.build_similarity_index("FL", metric=metric, n_components=4)
+            assert_array_almost_equal(self._scores(db), exact, decimal=5)
+            db.build_similarity_index("FL", metric=metric, n_components=3)
+            assert np.abs(self._scores(db) - exact).max() < 0.05
+            with pytest.raises(ValueError):
+                db.build_similarity_index("FL", n_components=10)
+            with pytest.raises(ValueError):
+                db.find_similar(self.matrix[:, :3], instrument_type="FL")
+
+    def test_missing_index(self):
+        with self.db as db, pytest.raises(ValueError):
+            db.find_similar("FL_1")
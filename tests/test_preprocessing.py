@@ -0,0 +1,178 @@
+from spectradb import Database
+from spectradb.dataloaders import FluorescenceDataLoader
+from spectradb.preprocessing import (Pipeline, SNV, MSC, SavitzkyGolay,
+                                     PolynomialBaseline)
+from numpy.testing import assert_array_almost_equal
+from pathlib import Path
+import numpy as np
+import pytest
+import threading
+import time
+
+path = Path(__file__).parent
+
+
+@pytest.fixture
+def spectra():
+    x = np.linspace(0, 4, 40)
+    reference = np.exp(-(x - 2) ** 2)
+    return x, reference, np.stack([0.5 + 2 * reference,
+                                   -1 + 0.5 * reference,
+                                   3 * reference]).astype(np.float32)
+
+
+def test_snv(spectra):
+    _, _, matrix = spectra
+    result = SNV().transform(matrix.copy())
+    assert_array_almost_equal(result.mean(axis=1), 0)
+    assert_array_almost_equal(result.std(axis=1, ddof=1), 1, decimal=5)
+
+
+def test_msc(spectra):
+    _, reference, matrix = spectra
+    assert_array_almost_equal(MSC(reference).transform(matrix.copy()),
+                              np.tile(reference, (3, 1)), decimal=5)
+    fitted = MSC().fit(matrix)
+    assert fitted.fitted
+    assert fitted.spec == "MSC(reference=None)"
+    assert_array_almost_equal(fitted.transform(matrix.copy()),
+                              np.tile(matrix.mean(axis=0), (3, 1)),
+                              decimal=5)
+    with pytest.raises(RuntimeError):
+        MSC().transform(matrix)
+
+
+def test_savitzky_golay_is_exact_on_polynomials():
+    x = np.arange(30, dtype=np.float64)
+    matrix = np.stack([2 + 0.5 * x - 0.1 * x ** 2, x ** 2])
+    assert_array_almost_equal(
+        SavitzkyGolay(7, 2).transform(matrix.copy()), matrix)
+    assert_array_almost_equal(
+        SavitzkyGolay(7, 2, deriv=1, delta=2.0).transform(matrix.copy()),
+        np.stack([0.5 - 0.2 * x, 2 * x]) / 2.0)
+    with pytest.raises(ValueError):
+        SavitzkyGolay(6, 2)
+    with pytest.raises(ValueError):
+        SavitzkyGolay(31, 2).transform(matrix.copy())
+
+
+def test_polynomial_baseline(spectra):
+    x, _, matrix = spectra
+    trend = (1 + 0.3 * x).astype(np.float32)
+    corrected = PolynomialBaseline(1).transform(matrix + trend)
+    assert_array_almost_equal(corrected,
+                              PolynomialBaseline(1).transform(matrix.copy()),
+                              decimal=5)
+
+
+def test_pipeline(spectra):
+    _, _, matrix = spectra
+    pipeline = Pipeline(MSC(), SNV(), SavitzkyGolay(5, 2, deriv=1))
+    assert pipeline.spec == ("MSC(reference=None)", "SNV(ddof=1)",
+                             "SavitzkyGolay(window_length=5, polyorder=2, "
+                             "deriv=1, delta=1.0)")
+    with pytest.raises(RuntimeError):
+        pipeline.transform(matrix)
+    copy = pipeline.fit_transform(matrix, copy=True)
+    assert copy is not matrix
+    chunks = list(pipeline.transform_chunks([matrix[:2].copy(),
+                                             matrix[2:].copy()]))
+    assert_array_almost_equal(np.concatenate(chunks), copy)
+    inplace = matrix.copy()
+    assert pipeline(inplace) is inplace
+    with pytest.raises(TypeError):
+        Pipeline(np.log)
+
+
+class TestDatabasePreprocessing:
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        self.db = Database(tmp_path/"database.sqlite", backup=False)
+        self.fl = FluorescenceDataLoader(path/"dataloaders"/"Test.csv")
+        with self.db as db:
+            db.add_sample(self.fl)
+            self.matrix, _, _ = db.fetch_matrix("FL")
+
+    def test_fetch_matrix_per_emission_spectrum(self):
+        pipeline = Pipeline(SNV())
+        with self.db as db:
+            matrix, _, _ = db.fetch_matrix("FL", preprocess=pipeline)
+            df = db.transform_data_for_analysis("FL", preprocess=pipeline)
+        expected = SNV().transform(self.matrix.reshape(-1, 3).copy())
+        assert_array_almost_equal(matrix, expected.reshape(4, 6))
+        assert_array_almost_equal(df.iloc[:, 2:], expected.reshape(4, 6),
+                                  decimal=5)
+
+    def test_chunked_outputs_need_fitted_pipeline(self, tmp_path):
+        with self.db as db:
+            with pytest.raises(RuntimeError):
+                next(db.iter_samples("FL", as_numpy=True,
+                                     preprocess=Pipeline(MSC())))
+            pipeline = Pipeline(MSC(), SNV())
+            whole, _, _ = db.fetch_matrix("FL", preprocess=pipeline)
+            chunks = [matrix for matrix, _ in db.iter_samples(
+                "FL", as_numpy=True, chunksize=3, preprocess=pipeline)]
+            path = db.transform_data_for_analysis(
+                "FL", output_format="npz", chunksize=3,
+                output_dir=tmp_path, preprocess=pipeline)
+        assert_array_almost_equal(np.concatenate(chunks), whole)
+        with np.load(path) as archive:
+            assert_array_almost_equal(archive["data"], whole)
+
+    def test_cache(self):
+        pipeline = Pipeline(PolynomialBaseline(0))
+        with self.db as db:
+            first, _, rows = db.fetch_matrix("FL", preprocess=pipeline,
+                                             cache=True)
+            rows["sample_id"] = None
+            second, _, rows = db.fetch_matrix("FL", preprocess=pipeline,
+                                              cache=True)
+            assert second is first
+            assert not first.flags.writeable
+            assert rows.sample_id.tolist() == ["FL_1", "FL_2", "FL_3",
+                                               "FL_4"]
+            other, _, _ = db.fetch_matrix(
+                "FL", preprocess=Pipeline(PolynomialBaseline(1)),
+                cache=True)
+            assert other is not first
+            db.remove_sample("FL_1", commit=True)
+            third, _, _ = db.fetch_matrix("FL", preprocess=pipeline,
+                                          cache=True)
+            assert third.shape == (3, 6)
+            db.clear_matrix_cache()
+            assert db._matrix_cache == {}
+
+    def test_cache_hit_fits_the_pipeline(self):
+        with self.db as db:
+            db.fetch_matrix("FL", preprocess=Pipeline(MSC()), cache=True)
+            pipeline = Pipeline(MSC())
+            cached, _, _ = db.fetch_matrix("FL", preprocess=pipeline,
+                                           cache=True)
+            assert pipeline.fitted
+            chunks = [matrix for matrix, _ in db.iter_samples(
+                "FL", as_numpy=True, chunksize=3, preprocess=pipeline)]
+        assert_array_almost_equal(np.concatenate(chunks), cached)
+
+    def test_cached_reads_do_not_wait_for_the_writer(self, tmp_path):
+        with Database(tmp_path/"database.sqlite", backup=False,
+                      readers=1) as db:
+            db.fetch_matrix("FL", cache=True)
+            locked, release = threading.Event(), threading.Event()
+
+            def writer():
+                with db._write_lock:
+                    locked.set()
+                    release.wait(5)
+
+            thread = threading.Thread(target=writer)
+            thread.start()
+            locked.wait()
+            start = time.perf_counter()
+            try:
+                matrix, _, _ = db.fetch_matrix("FL", cache=True)
+            finally:
+                elapsed = time.perf_counter() - start
+                release.set()
+                thread.join()
+        assert elapsed < 2
+        assert matrix.shape == (4, 6)
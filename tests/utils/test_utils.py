@@ -0,0 +1,114 @@
+from spectradb.dataloaders import NMRDataLoader
+from spectradb.utils import spectrum, zoom_spectrum, downsample
+import plotly.graph_objects as go
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def nmr_loader(tmp_path):
+    ppm = np.linspace(12, 0, 20000)
+    intensity = np.sin(ppm * 5)
+    intensity[5000] = 50
+    file = tmp_path/"large.txt"
+    file.write_text("Title\n" + "\n".join(
+        f"{i}, {y}, 0, {x}" for i, (x, y) in enumerate(zip(ppm, intensity))))
+    loader = NMRDataLoader(file)
+    loader.add_metadata(sample_name="large")
+    return loader
+
+
+class TestDownsample:
+    @pytest.mark.parametrize("method", ["minmax", "lttb"])
+    def test_budget_order_and_peaks(self, method):
+        x = np.arange(10001, dtype=float)
+        y = np.random.default_rng(0).normal(size=x.size)
+        y[1234] = 100
+        dx, dy = downsample(x, y, 500, method)
+        assert len(dx) <= 500
+        assert np.all(np.diff(dx) > 0)
+        assert dx[0] == 0 and dx[-1] == 10000
+        assert dy.max() == 100
+        np.testing.assert_array_equal(dy, y[dx.astype(int)])
+
+    def test_within_budget_is_unchanged(self):
+        x, y = np.arange(10), np.arange(10)
+        assert downsample(x, y, 10)[0] is x
+
+    def test_invalid_method(self):
+        with pytest.raises(ValueError):
+            downsample(np.arange(10), np.arange(10), 5, "mean")
+
+
+class TestDecimatedSpectrum:
+    def test_webgl_downsampled_traces(self, nmr_loader):
+        full = spectrum(nmr_loader)
+        fig = spectrum([nmr_loader], max_points=1000)
+        assert isinstance(full.data[0], go.Scatter)
+        assert len(full.data[0].y) == 20000
+        assert isinstance(fig.data[0], go.Scattergl)
+        assert len(fig.data[0].y) <= 1000
+        assert max(fig.data[0].y) == 50
+        assert fig.layout.xaxis.autorange == "reversed"
+
+    def test_zoom_uses_full_data(self, nmr_loader):
+        fig = spectrum(nmr_loader, max_points=1000, method="lttb")
+        zoom_spectrum(fig, nmr_loader, (6.5, 6.0), max_points=2000)
+        x = np.asarray(fig.data[0].x)
+        assert x.min() >= 6.0 and x.max() <= 6.5
+        # The full-resolution points of the range fit in the budget
+        assert len(x) == np.sum((nmr_loader.metadata["Signal Metadata"]
+                                 ["ppm"] >= 6.0) &
+                                (nmr_loader.metadata["Signal Metadata"]
+                                 ["ppm"] <= 6.5))
+
+
+def _px_reference(plot_data):
+    """The former melt/concat + px.line construction of the 1D plot."""
+    import pandas as pd
+    import plotly_express as px
+    combined_df = pd.concat([(pd.DataFrame(data, columns=em)
+                              .assign(Excitation=ex, Identifier=name)
+                              .melt(id_vars=['Excitation', 'Identifier'],
+                                    value_name='Intensity',
+                                    var_name='Emission'))
+                             for data, em, ex, name in plot_data],
+                            ignore_index=True)
+    single_identifier = combined_df['Identifier'].nunique() == 1
+    fig = px.line(combined_df, x="Emission", y="Intensity",
+                  line_group="Excitation",
+                  **({"color": "Identifier"} if not single_identifier
+                     else {}))
+    fig.update_traces(line=dict(width=1.5))
+    return fig
+
+
+class TestFluorescence1D:
+    @pytest.fixture
+    def loader(self):
+        from pathlib import Path
+        from spectradb.dataloaders import FluorescenceDataLoader
+        return FluorescenceDataLoader(
+            Path(__file__).parents[1]/"dataloaders"/"Test.csv")
+
+    @pytest.mark.parametrize("identifier", [
+        {"a": ["S1"]},
+        {"a": ["S1", "S2"], "b": ["S3", "S4"]},
+    ])
+    def test_matches_plotly_express(self, loader, identifier):
+        objs = {name: loader for name in identifier}
+        fig = spectrum(objs, identifier=identifier, plot_type="1D")
+        plot_data = [(loader.data[i], loader.metadata[i]["Signal Metadata"]
+                      ["Emission"], loader.metadata[i]["Signal Metadata"]
+                      ["Excitation"], loader.metadata[i]["Sample name"])
+                     for ids in identifier.values() for i in ids]
+        expected = _px_reference(plot_data)
+
+        keys = ("name", "legendgroup", "showlegend", "hovertemplate")
+        assert len(fig.data) == len(expected.data)
+        for trace, ref in zip(fig.data, expected.data):
+            assert all(trace[key] == ref[key] for key in keys)
+            assert trace.line.color == ref.line.color
+            np.testing.assert_array_equal(trace.x, ref.x)
+            np.testing.assert_array_equal(trace.y, ref.y)
+        assert fig.layout.legend.title.text == expected.layout.legend.title.text